@@ -1,19 +1,97 @@
+import hashlib
+import multiprocessing
 import numpy as np
 import pandas as pd
 import re
-import spacy
-import faiss
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 from pickle import load
 
+from DS.ds_index import (NEIGHBORS_COUNT, PRODUCT_INDEX_KIND, build_index,
+                         index_strategy, normalized_vectors)
+from DS.ds_nlp import nlp_registry
+from DS.ds_sparse import sparse_neighbors
+# Параметры пакетной лемматизации через nlp.pipe (LEMMA_BATCH_SIZE,
+# LEMMA_N_PROCESS) задаются переменными окружения
+from core.environment import LEMMA_BATCH_SIZE, LEMMA_N_PROCESS
+
+# Обученный TF-IDF векторайзер
+TFIDF_PATH = 'DS/korpus_tfidf.pkl'
+
+# Способы поиска ближайших соседей: faiss - плотные векторы и FAISS индекс,
+# sparse - косинусная близость на разреженных матрицах
+NEIGHBORS_BACKEND_FAISS = 'faiss'
+NEIGHBORS_BACKEND_SPARSE = 'sparse'
+NEIGHBORS_BACKEND = NEIGHBORS_BACKEND_FAISS
+
+# Этапы обработки строк дилеров, о которых сообщает колбэк progress
+STAGE_NORMALIZATION = 'normalization'
+STAGE_LEMMATIZATION = 'lemmatization'
+STAGE_VECTORIZATION = 'vectorization'
+STAGE_SEARCH = 'search'
+# Этапы, длительность которых только замеряется (без прогресса по строкам)
+STAGE_CATALOG = 'catalog'
+STAGE_ARTICLES = 'articles'
+
+
+def report_progress(progress, stage, count):
+    '''
+    Функция вызова колбэка прогресса progress(этап, количество строк),
+    если он передан. count - сколько строк дилера завершили этап
+    '''
+    if progress is not None and count:
+        progress(stage, count)
 
-def json_reading(json_parser, json_products):
-    parser = pd.read_json(json_parser).loc[:,['product_key','price',
-                                              'product_name',
-                                              'dealer_id']]
-    products = pd.read_json(json_products).rename(columns={'id_product': 'id'})
+
+@contextmanager
+def stage_timer(timings, stage):
+    '''
+    Контекстный менеджер замера этапа: прибавляет время выполнения блока
+    (сек) к timings[stage], если словарь timings передан
+    '''
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = (timings.get(stage, 0)
+                          + time.perf_counter() - started)
+
+
+class AnalysisCancelled(Exception):
+    '''
+    Исключение, которым анализ прерывается по запросу отмены
+    '''
+
+
+def check_cancelled(should_stop):
+    '''
+    Функция проверки запроса отмены между этапами анализа
+    should_stop - колбэк без аргументов, возвращает True, если анализ нужно остановить
+    '''
+    if should_stop is not None and should_stop():
+        raise AnalysisCancelled('Анализ отменён')
+
+
+def frames_reading(parser, products):
+    '''
+    Функция приведения таблиц дилеров и продукции к виду json_reading
+    Принимает уже загруженные таблицы (например, выгруженные из БД)
+    '''
+    parser = parser.loc[:, ['product_key', 'price',
+                            'product_name', 'dealer_id']]
+    products = products.rename(columns={'id_product': 'id'})
     return parser, products
 
 
+def json_reading(json_parser, json_products):
+    return frames_reading(pd.read_json(json_parser),
+                          pd.read_json(json_products))
+
+
 def csv_reading(path='', prep=True):
     '''
     Функция загрузки данных. по умолчани берет файлы из директории и проводит начальный препроцессинг
@@ -109,6 +187,95 @@ def change_equal(name):
         return dictionary
 
 
+# Предкомпилированные шаблоны для векторизованной нормализации названий
+SPLIT_PATTERNS = [re.compile(r"([а-я])([a-zA-ZА-Я])"),
+                  re.compile(r"([А-Я])([A-Za-z])"),
+                  re.compile(r"([a-z])([A-Zа-яА-Я])")]
+ARTICLE_PATTERN = re.compile(r' (\d+-\d+/?\d?[а-я]?)')
+VOLUME_PATTERN = re.compile(r"\d+(?:[\.,]\d+)? ?(?:мл|кг|г|л|шт)")
+NUMBER_PATTERN = re.compile(r'(\d+(?:[\.,]\d+)?)')
+DIMENSION_PATTERN = re.compile(r'([млкгшт]+)')
+NON_WORD_PATTERN = re.compile(r'\W+')
+DIMENSION_CONVERSION = {'мл': 'л', 'г': 'кг'}
+
+
+def _replace_sequential(name):
+    '''
+    Последовательные замены слов из text_worker (без разделения и нижнего регистра)
+    '''
+    bad = ['просепт', 'prosept50',
+           'prosept50,', 'prosepteco50',
+           'prosepteco50,', 'ultra',
+           'crystal', '-ая',
+           'prosept', 'ф/п']
+    good = ['prosept', ' prosept50 ',
+            ' prosept50 ', ' prosepteco50 ',
+            ' prosepteco50 ', ' ultra ',
+            ' crystal ', '',
+            '', 'пакет']
+    for o, n in zip(bad, good):
+        name = name.replace(o, n)
+    return name
+
+
+# Итоговая таблица замен за один проход: каждому слову сопоставлен результат
+# всей цепочки замен text_worker ('просепт50' -> 'prosept50' -> ' 50 ').
+# Длинные слова стоят в шаблоне раньше коротких
+REPLACEMENTS = {word: _replace_sequential(word)
+                for word in ['просепт', 'просепт50', 'prosept50', 'prosept50,',
+                             'prosepteco50', 'prosepteco50,', 'ultra',
+                             'crystal', '-ая', 'prosept', 'ф/п']}
+REPLACEMENT_PATTERN = re.compile('|'.join(
+    re.escape(word) for word in sorted(REPLACEMENTS, key=len, reverse=True)))
+
+
+def text_worker_frame(names):
+    '''
+    Векторизованная версия text_worker
+
+    Принимает Series строк, возвращает Series очищенных строк с тем же индексом
+    Замены слов выполняются за один проход по таблице REPLACEMENTS
+    '''
+    for pattern in SPLIT_PATTERNS:
+        names = names.str.replace(pattern, "\\1 \\2", regex=True)
+    return (names.str.lower()
+            .str.replace(REPLACEMENT_PATTERN,
+                         lambda match: REPLACEMENTS[match.group(0)],
+                         regex=True))
+
+
+def change_equal_frame(names):
+    '''
+    Векторизованная версия change_equal для целой колонки
+
+    Принимает Series названий, выдает таблицу с тем же индексом и колонками
+    name_new, article, dimension, quantity (как .apply(change_equal).apply(pd.Series))
+    '''
+    names = text_worker_frame(names)
+    article = names.str.extract(ARTICLE_PATTERN, expand=False)
+    # Артикул и объем вырезаются из названия во всех вхождениях
+    names = pd.Series([name if pd.isna(a) else name.replace(a, '')
+                       for name, a in zip(names, article)],
+                      index=names.index, dtype=object)
+    volume = names.str.findall(VOLUME_PATTERN).str[-1].astype(object)
+    dimension = volume.str.extract(DIMENSION_PATTERN, expand=False)
+    quantity = (volume.str.extract(NUMBER_PATTERN, expand=False)
+                .str.replace(',', '.', regex=False)
+                .astype(float))
+    converted = dimension.isin(list(DIMENSION_CONVERSION))
+    quantity = quantity.where(~converted, quantity / 1000).fillna(0)
+    dimension = dimension.replace(DIMENSION_CONVERSION)
+    names = pd.Series([name if pd.isna(v) else name.replace(v, '')
+                       for name, v in zip(names, volume)],
+                      index=names.index, dtype=object)
+    return pd.DataFrame({'name_new': names.str.replace(NON_WORD_PATTERN, ' ',
+                                                       regex=True),
+                         'article': article,
+                         'dimension': dimension,
+                         'quantity': quantity},
+                        index=names.index)
+
+
 def lemmatizate(text, nlp, nlp_ru):
     '''
     Функция лемматизации текста,
@@ -121,35 +288,122 @@ def lemmatizate(text, nlp, nlp_ru):
     return " ".join([token.lemma_ for token in doc_ru])
 
 
-def parser_prep(parser):
+def is_daemon_process():
+    '''
+    Функция проверки, что текущий процесс демонический (например дочерний
+    процесс prefork пула Celery) и не может порождать дочерние процессы
+    '''
+    if multiprocessing.current_process().daemon:
+        return True
+    try:
+        from billiard.process import current_process
+    except ImportError:
+        return False
+    return bool(current_process().daemon)
+
+
+def allowed_n_process(n_process):
+    '''
+    Функция ограничения количества процессов spaCy: в демоническом процессе
+    nlp.pipe с n_process != 1 падает, поэтому лемматизация идет в одном
+    '''
+    if n_process != 1 and is_daemon_process():
+        return 1
+    return n_process
+
+
+def lemmatizate_batch(texts, nlp, nlp_ru,
+                      batch_size=LEMMA_BATCH_SIZE, n_process=LEMMA_N_PROCESS):
+    '''
+    Пакетная версия функции lemmatizate
+
+    Принимает список (или Series) строк, пропускает их через nlp.pipe пачками
+    по batch_size документов в n_process процессах (в демоническом процессе,
+    например воркере Celery, - в одном).
+    Выдает список строк, полностью совпадающий с поэлементным вызовом lemmatizate
+    '''
+    texts = list(texts)
+    n_process = allowed_n_process(n_process)
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    texts_en = [" ".join([token.lemma_ for token in doc]) for doc in docs]
+    docs_ru = nlp_ru.pipe(texts_en, batch_size=batch_size, n_process=n_process)
+    return [" ".join([token.lemma_ for token in doc]) for doc in docs_ru]
+
+
+def lemmatizate_cached(texts, nlp, nlp_ru, cache,
+                       batch_size=LEMMA_BATCH_SIZE, n_process=LEMMA_N_PROCESS):
+    '''
+    Лемматизация с использованием кэша лемм отдельных слов (TokenLemmaCache)
+
+    Строки разбиваются на слова по пробелам, в модели spaCy (пакетно)
+    отправляются только слова, которых еще нет в кэше.
+    Каждое слово лемматизируется отдельно, без контекста соседних слов
+    Выдает список строк из лемм в исходном порядке слов
+    '''
+    tokenized = [text.split() for text in texts]
+    found, missing = cache.lookup(token for tokens in tokenized
+                                  for token in tokens)
+    if missing:
+        lemmas = dict(zip(missing, (lemma.strip() for lemma in lemmatizate_batch(
+            missing, nlp, nlp_ru, batch_size, n_process))))
+        cache.update(lemmas)
+        found.update(lemmas)
+    return [" ".join([found[token] for token in tokens])
+            for tokens in tokenized]
+
+
+def lemmatizate_frame(texts, batch_size=LEMMA_BATCH_SIZE,
+                      n_process=LEMMA_N_PROCESS, lemma_cache=None):
+    '''
+    Лемматизация колонки таблицы моделями из реестра процесса
+    При переданном lemma_cache используется кэш лемм слов, иначе пакетная лемматизация строк
+    '''
+    nlp, nlp_ru = nlp_registry.get()
+    if lemma_cache is None:
+        return lemmatizate_batch(texts, nlp, nlp_ru, batch_size, n_process)
+    return lemmatizate_cached(texts, nlp, nlp_ru, lemma_cache,
+                              batch_size, n_process)
+
+
+def parser_prep(parser, batch_size=LEMMA_BATCH_SIZE, n_process=LEMMA_N_PROCESS,
+                lemma_cache=None, progress=None, should_stop=None,
+                timings=None):
     '''
     Функция обработки таблицы dealer_price(парсерные данные)
     Применение функции по обработке текста, разделения названия на признаки, лемматизации
+    batch_size, n_process и lemma_cache передаются в лемматизацию
+    progress - колбэк прогресса (см. report_progress)
+    should_stop - колбэк отмены (см. check_cancelled)
+    timings - словарь длительностей этапов (см. stage_timer)
     '''
     # Удаляем 3 ненужные колонки, удаляем дубликаты, переименовываем колонку ключа, и выставляем новые индексы
-    parser = (parser
-              .drop_duplicates()
-              .rename(columns={'product_key': 'key'})
-              .reset_index(drop=True))
-    parser_new = (parser['product_name']
-                  .apply(lambda x: change_equal(x)).apply(pd.Series))
-    parser_final = (pd.concat([parser, parser_new], axis=1)
-                    .drop(['product_name'], axis=1))
-    parser_final['article'] = parser_final['article'].fillna('')
-
-    nlp = spacy.load('en_core_web_sm', disable=['parser', 'ner'])
-    nlp_ru = spacy.load('ru_core_news_sm', disable=['parser', 'ner'])
-    parser_final['name_new'] = (parser_final['name_new']
-                                .apply(lambda x: lemmatizate(x, nlp, nlp_ru)))
+    with stage_timer(timings, STAGE_NORMALIZATION):
+        parser = (parser
+                  .drop_duplicates()
+                  .rename(columns={'product_key': 'key'})
+                  .reset_index(drop=True))
+        parser_new = change_equal_frame(parser['product_name'])
+        parser_final = (pd.concat([parser, parser_new], axis=1)
+                        .drop(['product_name'], axis=1))
+        parser_final['article'] = parser_final['article'].fillna('')
+    report_progress(progress, STAGE_NORMALIZATION, len(parser_final))
+    check_cancelled(should_stop)
+
+    with stage_timer(timings, STAGE_LEMMATIZATION):
+        parser_final['name_new'] = lemmatizate_frame(
+            parser_final['name_new'], batch_size, n_process, lemma_cache)
+    report_progress(progress, STAGE_LEMMATIZATION, len(parser_final))
 
     return parser_final
 
 
-def products_prep(products):
+def products_prep(products, batch_size=LEMMA_BATCH_SIZE, n_process=LEMMA_N_PROCESS,
+                  lemma_cache=None):
     '''
     Функция обработки таблицы продукции
     Принимает исходную таблицу с проведенной предподготовкой
     Выдает винальный вариант таблицы, который можно использовать в МО
+    batch_size, n_process и lemma_cache передаются в лемматизацию
 
     Заполняет пропуски, собирает в одну колонку уникальные слова из 4 колонок названий, и собирает дополнительные фичи из названий
     '''
@@ -166,19 +420,14 @@ def products_prep(products):
     products[name_columns] = products[name_columns].fillna('')
 
     # Из субъективно лучшей колонки названия вытаскиваем количество и ед.измерения из остальных только очищеное имя
-    name_1c = (products['name_1c']
-    .apply(change_equal).apply(pd.Series)
-    .rename(columns={'name_new': 'name_1c_new'})['name_1c_new'])
-    ozon_name = (products['ozon_name']
-                 .apply(change_equal).apply(pd.Series)
+    name_1c = (change_equal_frame(products['name_1c'])
+               .rename(columns={'name_new': 'name_1c_new'})['name_1c_new'])
+    ozon_name = (change_equal_frame(products['ozon_name'])
                  .drop(['article'], axis=1)
                  .rename(columns={'name_new': 'ozon_name_new'}))
-    name_1 = (products['name']
-    .apply(change_equal).apply(pd.Series)
-    .rename(columns={'name_new': 'name_new'})['name_new'])
-    wb_name = (products['wb_name']
-    .apply(change_equal).apply(pd.Series)
-    .rename(columns={'name_new': 'wb_name_new'})['wb_name_new'])
+    name_1 = change_equal_frame(products['name'])['name_new']
+    wb_name = (change_equal_frame(products['wb_name'])
+               .rename(columns={'name_new': 'wb_name_new'})['wb_name_new'])
     products1 = pd.concat([products, ozon_name, name_1c, wb_name, name_1], axis=1)
 
     # Соединяем названия из 4х колонок в full name (только уникальные слова в том же порядке)
@@ -188,11 +437,10 @@ def products_prep(products):
                                                                             + x['name_new'] + ' '
                                                                             + x['wb_name_new']).split()))), axis=1))
 
-    # лемматизируем
-    nlp = spacy.load('en_core_web_sm', disable=['parser', 'ner'])
-    nlp_ru = spacy.load('ru_core_news_sm', disable=['parser', 'ner'])
-    products1['full_name'] = (products1['full_name']
-                              .apply(lambda x: lemmatizate(x, nlp, nlp_ru)))
+    # лемматизируем (модели берем из реестра процесса, без повторной загрузки)
+    products1['full_name'] = lemmatizate_frame(products1['full_name'],
+                                               batch_size, n_process,
+                                               lemma_cache)
 
     products1['article'] = products1['article'].apply(lambda x: str(x).lower())
 
@@ -226,6 +474,54 @@ def find_product_id_by_article(article, products_final):
             return np.nan
         return id
 
+
+def normalize_article(article):
+    '''
+    Функция приведения артикула к виду для поиска: строка без пробелов по краям
+    в нижнем регистре, пропуски дают пустую строку
+    '''
+    if not isinstance(article, str):
+        article = '' if pd.isna(article) else str(article)
+    article = article.strip().lower()
+    return '' if article in ('nan', 'none') else article
+
+
+def build_article_index(products_final):
+    '''
+    Функция построения словаря артикул -> список id товаров
+
+    Один артикул может встречаться у нескольких товаров, поэтому значения -
+    списки id в порядке таблицы продукции. Строится один раз на запуск
+    вместо полного просмотра продукции для каждой строки дилера
+    '''
+    article_index = {}
+    for article, product_id in zip(products_final['article'],
+                                   products_final['id']):
+        article = normalize_article(article)
+        if article:
+            ids = article_index.setdefault(article, [])
+            if int(product_id) not in ids:
+                ids.append(int(product_id))
+    return article_index
+
+
+def match_articles(parser_final, article_index):
+    '''
+    Функция поиска товаров по артикулу через словарь build_article_index
+
+    Выдает словарь {ключ товара дилера: [id товаров]} для найденных артикулов
+    и множество ключей с уверенным совпадением (артикул есть ровно у одного товара)
+    '''
+    dict_of_article_neigh = {}
+    for key, article in zip(parser_final['key'], parser_final['article']):
+        ids = article_index.get(normalize_article(article))
+        if ids:
+            dict_of_article_neigh[key] = list(ids)
+    confident_keys = {key for key, ids in dict_of_article_neigh.items()
+                      if len(ids) == 1}
+    return dict_of_article_neigh, confident_keys
+
+
 def accuracy_check(target, dict_of_preds,n):
     '''
     Функция промежуточной проверки точности
@@ -247,39 +543,65 @@ def accuracy_check(target, dict_of_preds,n):
         return 'Метрика не подсчитана, деление на 0, необходимо проверить условие в функции "accuracy_check"'
 
 
-def search_neighbors(base_tfidf, query_tfidf):
+def search_neighbors(base_tfidf, query_tfidf, kind=PRODUCT_INDEX_KIND,
+                     **params):
     '''
     Функция ранжирования и отбора ближайших соседей
-    по расстоянию между векторизированными текстами
+    по косинусной близости между векторизированными текстами
 
-    Принимает на вход 2 таблицы векторизированного текста
+    Принимает на вход 2 таблицы векторизированного текста и тип индекса
+    (flat, ivf или hnsw, параметры стратегии передаются в params)
     выдает (base_index) словарь соответствия индекса с id продукта,
-    (vecs) список списков расстояний между векторами по возрастанию (n ближайших)
+    (vecs) список списков косинусных близостей по убыванию (n ближайших)
     (idx) список списков ближайших n id продукции в соответствии с (vecs)
 
     '''
-    dims = base_tfidf.shape[1]
-    n_cells = 1  # количество центроидов
-    quantizer = faiss.IndexFlatL2(dims)
-    idx_l2 = faiss.IndexIVFFlat(quantizer, dims, n_cells)
-    # подготовка к поиску
-    idx_l2.train(np.ascontiguousarray(base_tfidf.values).astype('float32'))
-    idx_l2.add(np.ascontiguousarray(base_tfidf.values).astype('float32'))
+    strategy = index_strategy(kind, **params)
+    index = build_index(strategy, normalized_vectors(base_tfidf.values))
     # создание словаря для нахождения индекса товара в базовом наборе данных
     base_index = {k: v for k, v in enumerate(base_tfidf.index.to_list())}
-    vecs, idx = idx_l2.search(
-        np.ascontiguousarray(query_tfidf.values).astype('float32'),
-        10)
+    vecs, idx = index.search(normalized_vectors(query_tfidf.values),
+                             NEIGHBORS_COUNT)
     return base_index, vecs, idx
 
 
-def get_neighbors(products_final, parser_final):
+@lru_cache(maxsize=None)
+def load_vectorizer(path=TFIDF_PATH):
+    '''
+    Функция загрузки обученного TF-IDF, загружается один раз на процесс
+    '''
+    with open(path, 'rb') as fid:
+        return load(fid)
+
+
+@lru_cache(maxsize=None)
+def vectorizer_version(path=TFIDF_PATH):
+    '''
+    Функция получения версии векторайзера (sha1 содержимого файла)
+    '''
+    with open(path, 'rb') as fid:
+        return hashlib.sha1(fid.read()).hexdigest()
+
+
+def get_neighbors(products_final, parser_final, base_matrix=None,
+                  product_index=None, backend=NEIGHBORS_BACKEND,
+                  sync_index=True, progress=None, should_stop=None,
+                  timings=None):
     '''
     Функция поиска ближайших соседей
     (включает использование функций обучения векторайзера и самого поиска соседей)
     Если передаем таблицу мэтчей - значит в работу берем только данные с известным ответом и будет показана метрика
 
     Принимает 2 обработанные таблицы(продукция и парсерные данные) и опционально таблицу мэтчей
+    base_matrix - заранее посчитанная TF-IDF матрица продукции (строки в порядке products_final)
+    product_index - сохраняемый индекс продукции (ProductIndex), при его наличии
+    индекс только синхронизируется с каталогом, а векторизуются и ищутся лишь запросы дилеров
+    backend - способ поиска: 'faiss' или 'sparse' (без перевода матриц в плотный вид)
+    sync_index - синхронизировать ли product_index с каталогом перед поиском,
+    False - индекс уже построен (например, перед запуском частей анализа)
+    progress - колбэк прогресса (см. report_progress)
+    should_stop - колбэк отмены (см. check_cancelled)
+    timings - словарь длительностей этапов (см. stage_timer)
     Выдает словарь соответствия ключа предполагаемым 10 id и при зарузке таблицы мэтчей - таргет
     '''
     # Создадим две таблицы. Первая: base - данные производителя, где индексы - это id товаров.
@@ -291,24 +613,41 @@ def get_neighbors(products_final, parser_final):
                     'name_new', 'article',
                     'quantity', 'dimension']])
 
-    #загрузка обученного TF-IDF
-    with open('DS/korpus_tfidf.pkl', 'rb') as fid:
-        count_tf_idf = load(fid)
-
-    base_tfidf = pd.DataFrame(count_tf_idf.transform(base['full_name'])
-                              .toarray()).set_index(base.index)
-    query_tfidf = pd.DataFrame(count_tf_idf.transform(query['name_new'])
-                               .toarray())
-    base_tfidf.columns = base_tfidf.columns.astype('str')
-    query_tfidf.columns = query_tfidf.columns.astype('str')
-    # Поиск соседей функцией
-    base_index, vecs, idx = search_neighbors(base_tfidf, query_tfidf)
-
-    # Сборка словаря предсказаний
-    dict_of_neighbors = {}
-    for k, v in zip(query['key'], idx.tolist()):
-        list_of_preds = [base_index[i] for i in v]
-        dict_of_neighbors[k] = list_of_preds
+    with stage_timer(timings, STAGE_VECTORIZATION):
+        #загрузка обученного TF-IDF
+        count_tf_idf = load_vectorizer()
+
+        if base_matrix is None:
+            base_matrix = count_tf_idf.transform(base['full_name'])
+        query_matrix = count_tf_idf.transform(query['name_new'])
+    report_progress(progress, STAGE_VECTORIZATION, len(query))
+    check_cancelled(should_stop)
+
+    with stage_timer(timings, STAGE_SEARCH):
+        if backend == NEIGHBORS_BACKEND_SPARSE:
+            dict_of_neighbors = sparse_neighbors(base.index, base_matrix,
+                                                 query['key'], query_matrix)
+        elif product_index is not None:
+            if sync_index:
+                product_index.sync(base.index, base_matrix)
+            vecs, idx = product_index.search(query_matrix)
+            dict_of_neighbors = {k: [i for i in v if i >= 0]
+                                 for k, v in zip(query['key'], idx.tolist())}
+        else:
+            base_tfidf = (pd.DataFrame(base_matrix.toarray())
+                          .set_index(base.index))
+            query_tfidf = pd.DataFrame(query_matrix.toarray())
+            base_tfidf.columns = base_tfidf.columns.astype('str')
+            query_tfidf.columns = query_tfidf.columns.astype('str')
+            # Поиск соседей функцией
+            base_index, vecs, idx = search_neighbors(base_tfidf, query_tfidf)
+
+            # Сборка словаря предсказаний
+            dict_of_neighbors = {}
+            for k, v in zip(query['key'], idx.tolist()):
+                list_of_preds = [base_index[i] for i in v if i >= 0]
+                dict_of_neighbors[k] = list_of_preds
+    report_progress(progress, STAGE_SEARCH, len(query))
 
     return dict_of_neighbors
 
@@ -335,33 +674,88 @@ def dict_join(dict_all, dict_small):
     return dict_all
 
 
-def main_function(json_parser=0, json_products=0, path=''):
+def main_function(json_parser=0, json_products=0, path='',
+                  batch_size=LEMMA_BATCH_SIZE, n_process=LEMMA_N_PROCESS,
+                  lemma_cache=None, catalog_cache=None, product_index=None,
+                  backend=NEIGHBORS_BACKEND, stats=None, sync_index=True,
+                  progress=None, should_stop=None, timings=None):
     '''
     Главная функция которая задействует все остальные функции,
-    Принимает на вход путь к файлам,
+    Принимает на вход JSON с данными дилеров и продукции
+    или готовые таблицы pandas,
     выдает словарь соответствия ключа предложения диллера с 10 id продукции заказчика
+    batch_size и n_process - параметры пакетной лемматизации
+    lemma_cache - кэш лемм слов (TokenLemmaCache), сохраняется на диск после лемматизации
+    catalog_cache - кэш подготовленной продукции и ее TF-IDF матрицы (CatalogCache)
+    product_index - сохраняемый FAISS индекс продукции (ProductIndex)
+    backend - способ поиска соседей ('faiss' или 'sparse')
+    stats - словарь, в который записывается количество строк дилера,
+    найденных по артикулу и прошедших быстрый путь (без TF-IDF поиска)
+    sync_index - передается в get_neighbors
+    progress - колбэк прогресса progress(этап, количество строк),
+    вызывается по завершении этапа для очередной группы строк дилера
+    should_stop - колбэк отмены, проверяется между этапами;
+    при отмене выбрасывается AnalysisCancelled
+    timings - словарь, в котором копится длительность этапов (сек),
+    каждый этап замеряется вокруг своего блока кода (см. stage_timer)
 
     '''
 
     # загрузка документов
-    parser, products = json_reading(json_parser, json_products)
+    if isinstance(json_parser, pd.DataFrame):
+        parser, products = frames_reading(json_parser, json_products)
+    else:
+        parser, products = json_reading(json_parser, json_products)
     #dilers, parser, products, matches = csv_reading(path)
     # преобразование текста(обе таблицы, лемматизация)
-    parser_final = parser_prep(parser)
-    products_final = products_prep(products)
+    check_cancelled(should_stop)
+    parser_final = parser_prep(parser, batch_size, n_process, lemma_cache,
+                               progress, should_stop, timings)
+    check_cancelled(should_stop)
+    with stage_timer(timings, STAGE_CATALOG):
+        if catalog_cache is None:
+            products_final = products_prep(products, batch_size, n_process,
+                                           lemma_cache)
+            base_matrix = None
+        else:
+            products_final, base_matrix = catalog_cache.load_or_build(
+                products, batch_size, n_process, lemma_cache)
+    with stage_timer(timings, STAGE_LEMMATIZATION):
+        if lemma_cache is not None:
+            lemma_cache.save()
     # Составляем макет словаря
     dict_of_neigh = dict.fromkeys(parser_final['key'], [])
 
-    # Поиск по артикулу
-    dict_of_article_neigh = (pd.DataFrame(parser_final['article']
-                                          .apply(lambda x: find_product_id_by_article(x, products_final)))
-                                          .set_index(parser_final['key'])
-                                          .dropna().to_dict()['article'])
+    # Поиск по артикулу через словарь артикулов
+    with stage_timer(timings, STAGE_ARTICLES):
+        dict_of_article_neigh, confident_keys = match_articles(
+            parser_final, build_article_index(products_final))
     # Заносим найденное в основной словарь
     dict_of_neigh.update(dict_of_article_neigh)
+    # Строки с уверенным совпадением артикула не векторизуются и не ищутся
+    query_final = parser_final.loc[~parser_final['key'].isin(confident_keys)]
+    report_progress(progress, STAGE_VECTORIZATION,
+                    len(parser_final) - len(query_final))
+    report_progress(progress, STAGE_SEARCH,
+                    len(parser_final) - len(query_final))
     # поиск с помощью Tf-idf и faiss
-    dict_of_tfidf_neighbors = get_neighbors(products_final,
-                                                     parser_final)
+    if len(query_final):
+        dict_of_tfidf_neighbors = get_neighbors(products_final,
+                                                query_final,
+                                                base_matrix,
+                                                product_index,
+                                                backend,
+                                                sync_index,
+                                                progress,
+                                                should_stop,
+                                                timings)
+    else:
+        dict_of_tfidf_neighbors = {}
+    if stats is not None:
+        stats.update({'rows': len(dict_of_neigh),
+                      'article_hits': len(dict_of_article_neigh),
+                      'fast_path': len(confident_keys),
+                      'searched': len(dict_of_tfidf_neighbors)})
     '''
     Эти этапы не реализованы, но предполагают возможное внедрение для улучшения точности
     # сборка каждый к каждому(query-base)
@@ -0,0 +1,212 @@
+'''
+Замеры производительности этапов анализа
+
+Запуск из каталога backend:
+    python -m DS.ds_benchmark lemmatization --rows 10000
+    python -m DS.ds_benchmark normalization --rows 100000
+    python -m DS.ds_benchmark retrieval --rows 100000 --products 2000
+    python -m DS.ds_benchmark ann --rows 10000 --products 50000
+'''
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from DS.ds_analyze import (LEMMA_BATCH_SIZE, LEMMA_N_PROCESS,
+                           change_equal, change_equal_frame,
+                           lemmatizate, lemmatizate_batch,
+                           load_vectorizer, search_neighbors)
+from DS.ds_index import (INDEX_STRATEGIES, NEIGHBORS_COUNT, build_index,
+                         index_strategy, normalized_vectors)
+from DS.ds_nlp import nlp_registry
+from DS.ds_sparse import sparse_top_k
+
+# Типичные названия из выгрузок дилеров, размножаются до нужного числа строк
+SAMPLE_NAMES = [
+    'средство для мытья полов prosept multipower floor концентрат 1 л',
+    'антисептик для дерева prosept eco 50 готовый состав 5 л',
+    'пропитка огнебиозащитная prosept 1 группа красная 10 кг',
+    'очиститель фасадов prosept fasad cleaner 1 литр',
+    'гель для стирки prosept crystal универсальный 5 л',
+    'средство для удаления ржавчины prosept rust remover 0 5 л',
+    'грунт глубокого проникновения prosept multiprimer 10 л',
+    'антисептик для рук prosept brand antiseptic 500 мл',
+]
+
+
+def sample_texts(rows):
+    '''
+    Функция генерации тестового набора строк заданного размера
+    '''
+    return [f'{SAMPLE_NAMES[i % len(SAMPLE_NAMES)]} {i}' for i in range(rows)]
+
+
+def sample_vocabulary_texts(rows, words=6, seed=0):
+    '''
+    Функция генерации названий из случайных слов словаря TF-IDF
+    '''
+    vocabulary = np.array(sorted(load_vectorizer().vocabulary_))
+    random = np.random.default_rng(seed)
+    return [' '.join(random.choice(vocabulary, words)) for _ in range(rows)]
+
+
+def timed(function, *args, **kwargs):
+    '''
+    Функция замера времени выполнения, возвращает (результат, секунды)
+    '''
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def benchmark_lemmatization(texts, batch_size=LEMMA_BATCH_SIZE,
+                            n_process=LEMMA_N_PROCESS):
+    '''
+    Сравнение построчной (lemmatizate через apply) и пакетной (nlp.pipe)
+    лемматизации
+
+    Выдает словарь с временем, пропускной способностью и признаком
+    совпадения результатов
+    '''
+    nlp, nlp_ru = nlp_registry.get()
+    per_row, per_row_time = timed(
+        lambda: [lemmatizate(text, nlp, nlp_ru) for text in texts])
+    batched, batched_time = timed(lemmatizate_batch, texts, nlp, nlp_ru,
+                                  batch_size, n_process)
+    return {'rows': len(texts),
+            'per_row_sec': round(per_row_time, 3),
+            'batched_sec': round(batched_time, 3),
+            'per_row_rows_per_sec': round(len(texts) / per_row_time, 1),
+            'batched_rows_per_sec': round(len(texts) / batched_time, 1),
+            'speedup': round(per_row_time / batched_time, 2),
+            'identical': per_row == batched}
+
+
+def benchmark_normalization(texts):
+    '''
+    Сравнение построчной нормализации (apply(change_equal).apply(pd.Series))
+    и векторизованной change_equal_frame
+    '''
+    names = pd.Series(texts)
+    per_row, per_row_time = timed(
+        lambda: names.apply(change_equal).apply(pd.Series))
+    vectorized, vectorized_time = timed(change_equal_frame, names)
+    try:
+        pd.testing.assert_frame_equal(vectorized, per_row, check_dtype=False)
+        identical = True
+    except AssertionError:
+        identical = False
+    return {'rows': len(texts),
+            'per_row_sec': round(per_row_time, 3),
+            'vectorized_sec': round(vectorized_time, 3),
+            'per_row_rows_per_sec': round(len(texts) / per_row_time, 1),
+            'vectorized_rows_per_sec': round(len(texts) / vectorized_time, 1),
+            'speedup': round(per_row_time / vectorized_time, 2),
+            'identical': identical}
+
+
+def measured(function, *args, **kwargs):
+    '''
+    Функция замера времени и пика памяти Python-аллокаций (tracemalloc)
+    Память внутри FAISS (C++) tracemalloc не видит
+    '''
+    tracemalloc.start()
+    try:
+        result, seconds = timed(function, *args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_retrieval(rows, products):
+    '''
+    Сравнение поиска соседей: плотные матрицы + FAISS (как в get_neighbors)
+    и блочный разреженный поиск sparse_top_k
+
+    Выдает время, пик памяти и долю совпадающих первых соседей
+    '''
+    vectorizer = load_vectorizer()
+    base_matrix = vectorizer.transform(
+        sample_vocabulary_texts(products, seed=1))
+    query_matrix = vectorizer.transform(sample_vocabulary_texts(rows, seed=2))
+
+    def dense_search():
+        base_tfidf = pd.DataFrame(base_matrix.toarray())
+        query_tfidf = pd.DataFrame(query_matrix.toarray())
+        return search_neighbors(base_tfidf, query_tfidf)[2]
+
+    dense_idx, dense_time, dense_peak = measured(dense_search)
+    (_, sparse_idx), sparse_time, sparse_peak = measured(
+        sparse_top_k, base_matrix, query_matrix)
+    return {'rows': rows,
+            'products': products,
+            'faiss_sec': round(dense_time, 3),
+            'sparse_sec': round(sparse_time, 3),
+            'faiss_peak_mb': round(dense_peak / 2 ** 20, 1),
+            'sparse_peak_mb': round(sparse_peak / 2 ** 20, 1),
+            'top1_agreement': round(float(
+                (dense_idx[:, 0] == sparse_idx[:, 0]).mean()), 4)}
+
+
+def recall_at_k(found, exact):
+    '''
+    Функция расчета recall@k: доля точных k соседей, найденных индексом
+    '''
+    hits = sum(len(set(row) & set(truth))
+               for row, truth in zip(found.tolist(), exact.tolist()))
+    return hits / exact.size
+
+
+def benchmark_ann(rows, products, k=NEIGHBORS_COUNT):
+    '''
+    Сравнение типов индекса (flat, ivf, hnsw) на нормированных TF-IDF векторах
+
+    Для каждого типа выдает время построения, запросов в секунду
+    и recall@k относительно точного поиска (flat)
+    '''
+    vectorizer = load_vectorizer()
+    base = normalized_vectors(vectorizer.transform(
+        sample_vocabulary_texts(products, seed=1)))
+    query = normalized_vectors(vectorizer.transform(
+        sample_vocabulary_texts(rows, seed=2)))
+
+    result = {'rows': rows, 'products': products}
+    exact = None
+    for kind in INDEX_STRATEGIES:
+        index, build_time = timed(build_index, index_strategy(kind), base)
+        (_, found), search_time = timed(index.search, query, k)
+        if exact is None:
+            exact = found
+        result[f'{kind}_build_sec'] = round(build_time, 3)
+        result[f'{kind}_qps'] = round(rows / search_time, 1)
+        result[f'{kind}_recall@{k}'] = round(recall_at_k(found, exact), 4)
+    return result
+
+
+BENCHMARKS = {
+    'lemmatization': lambda args: benchmark_lemmatization(
+        sample_texts(args.rows), args.batch_size, args.n_process),
+    'normalization': lambda args: benchmark_normalization(
+        sample_texts(args.rows)),
+    'retrieval': lambda args: benchmark_retrieval(args.rows, args.products),
+    'ann': lambda args: benchmark_ann(args.rows, args.products),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=LEMMA_BATCH_SIZE)
+    parser.add_argument('--n-process', type=int, default=LEMMA_N_PROCESS)
+    args = parser.parse_args()
+    for name, value in BENCHMARKS[args.benchmark](args).items():
+        print(f'{name}: {value}')
+
+
+if __name__ == '__main__':
+    main()
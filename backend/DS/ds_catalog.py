@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from DS.ds_analyze import (LEMMA_BATCH_SIZE, LEMMA_N_PROCESS, TFIDF_PATH,
+                           load_vectorizer, products_prep, vectorizer_version)
+from DS.ds_storage import atomic_dump, safe_load
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_PATH = 'DS/cache/catalog.pkl'
+# Версия подготовки продукции, увеличивается при изменении products_prep
+CATALOG_PREP_VERSION = 1
+# Колонки продукции, от которых зависит результат products_prep
+CATALOG_HASH_COLUMNS = ['id', 'article', 'name', 'name_1c', 'ozon_name',
+                        'wb_name', 'cost', 'recommended_price']
+
+
+def catalog_row_hashes(products):
+    '''
+    Функция вычисления хэша каждой строки продукции по значимым колонкам
+
+    Значения приводятся к строкам, чтобы хэш не зависел от типов колонок
+    Выдает массив uint64 в порядке строк таблицы
+    '''
+    columns = [column for column in CATALOG_HASH_COLUMNS
+               if column in products.columns]
+    return pd.util.hash_pandas_object(products[columns].astype(str),
+                                      index=False).to_numpy()
+
+
+class CatalogCache:
+    '''
+    Кэш подготовленной таблицы продукции (результат products_prep)
+    и ее TF-IDF матрицы с адресацией по содержимому
+
+    Каждая строка адресуется хэшем значимых колонок, весь каталог -
+    хэшем всех строк. Кэш действителен, пока не изменились версия подготовки
+    и версия векторайзера. При изменении части продукции заново
+    обрабатываются только новые и измененные строки.
+
+    Атрибуты:
+        last_stats - статистика последнего вызова load_or_build
+    '''
+
+    def __init__(self, path=CATALOG_CACHE_PATH, tfidf_path=TFIDF_PATH):
+        self.path = path
+        self.tfidf_path = tfidf_path
+        self._state = {}
+        self._mtime = None
+        self.last_stats = {}
+
+    def version(self):
+        return f'{CATALOG_PREP_VERSION}:{vectorizer_version(self.tfidf_path)}'
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _load_state(self):
+        '''
+        Состояние держится в памяти процесса и перечитывается с диска,
+        только если файл обновил другой процесс
+        '''
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._mtime:
+            state = safe_load(self.path, default={})
+            if state.get('version') != self.version():
+                state = {}
+            self._state = state
+            self._mtime = mtime
+        return self._state
+
+    def _save_state(self, state):
+        self._state = state
+        atomic_dump(state, self.path)
+        self._mtime = self._file_mtime()
+
+    def load_or_build(self, products, batch_size=LEMMA_BATCH_SIZE,
+                      n_process=LEMMA_N_PROCESS, lemma_cache=None):
+        '''
+        Выдает подготовленную таблицу продукции и ее TF-IDF матрицу (csr)
+        в порядке строк products, используя кэш для неизмененных строк
+        '''
+        products = products.reset_index(drop=True)
+        hashes = catalog_row_hashes(products)
+        key = hashlib.sha1(hashes.tobytes()).hexdigest()
+        state = self._load_state()
+
+        if state.get('key') == key:
+            self.last_stats = {'rows': len(products),
+                               'cached_rows': len(products),
+                               'rebuilt_rows': 0}
+            return state['frame'].copy(), state['matrix']
+
+        cached_frame = state.get('frame')
+        cached_positions = {value: position for position, value
+                            in enumerate(state.get('hashes', []))}
+        positions = np.array([cached_positions.get(value, -1)
+                              for value in hashes], dtype=np.int64)
+        new_rows = positions < 0
+
+        if new_rows.any() or cached_frame is None:
+            new_frame = products_prep(products.loc[new_rows].copy(),
+                                      batch_size, n_process, lemma_cache)
+            new_matrix = load_vectorizer(self.tfidf_path).transform(
+                new_frame['full_name'])
+        else:
+            # Продукция только удалена или переставлена
+            new_frame = cached_frame.iloc[:0]
+            new_matrix = state['matrix'][:0]
+
+        if cached_frame is None:
+            cached_frame = new_frame.iloc[:0]
+            cached_matrix = new_matrix[:0]
+        else:
+            cached_matrix = state['matrix']
+        # Новые строки идут после закэшированных, затем восстанавливаем порядок
+        positions[new_rows] = len(cached_frame) + np.arange(new_rows.sum())
+        frame = (pd.concat([cached_frame, new_frame], ignore_index=True)
+                 .iloc[positions].reset_index(drop=True))
+        matrix = sparse.vstack([cached_matrix, new_matrix],
+                               format='csr')[positions]
+
+        self._save_state({'version': self.version(), 'key': key,
+                          'hashes': hashes, 'frame': frame, 'matrix': matrix})
+        self.last_stats = {'rows': len(products),
+                           'cached_rows': int((~new_rows).sum()),
+                           'rebuilt_rows': int(new_rows.sum())}
+        logger.info('Кэш каталога обновлен: %s', self.last_stats)
+        return frame.copy(), matrix
@@ -0,0 +1,299 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import faiss
+import numpy as np
+
+from DS.ds_storage import atomic_dump, safe_load
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_INDEX_PATH = 'DS/cache/products.faiss'
+# Количество ближайших соседей, выдаваемых поиском
+NEIGHBORS_COUNT = 10
+
+# Типы индекса: flat - точный поиск по скалярному произведению,
+# ivf - инвертированные списки, hnsw - граф HNSW
+INDEX_KIND_FLAT = 'flat'
+INDEX_KIND_IVF = 'ivf'
+INDEX_KIND_HNSW = 'hnsw'
+PRODUCT_INDEX_KIND = INDEX_KIND_FLAT
+# Параметры IVF: ячеек ~ 4 * sqrt(N), но не меньше 39 векторов на ячейку
+IVF_POINTS_PER_CELL = 39
+IVF_NPROBE = 8
+# Параметры HNSW
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+
+
+def normalized_vectors(matrix):
+    '''
+    Функция перевода матрицы в непрерывный float32 массив
+    с нормировкой строк по L2
+
+    После нормировки скалярное произведение равно косинусной близости
+    '''
+    if hasattr(matrix, 'toarray'):
+        matrix = matrix.toarray()
+    vectors = np.ascontiguousarray(matrix, dtype='float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+class FlatIndexStrategy:
+    '''
+    Точный поиск: IndexFlatIP по нормированным векторам (косинусная близость)
+    '''
+    kind = INDEX_KIND_FLAT
+    supports_remove = True
+
+    def __init__(self, **params):
+        self.params = {}
+
+    def signature(self, size):
+        return {'kind': self.kind}
+
+    def create(self, dims, vectors):
+        return faiss.IndexFlatIP(dims)
+
+    def configure(self, index):
+        return index
+
+
+class IVFIndexStrategy(FlatIndexStrategy):
+    '''
+    IndexIVFFlat по скалярному произведению, число ячеек подбирается
+    по размеру каталога, при поиске просматривается nprobe ячеек
+    remove_ids через IndexIDMap2 рассчитан на сжатие плоского индекса
+    и портит соответствие id у IVF, поэтому при удалении товаров
+    индекс пересобирается
+    '''
+    kind = INDEX_KIND_IVF
+    supports_remove = False
+
+    def __init__(self, nprobe=IVF_NPROBE, nlist=None, **params):
+        self.nprobe = nprobe
+        self.nlist = nlist
+
+    @staticmethod
+    def default_nlist(size):
+        return max(1, min(int(4 * np.sqrt(size)), size // IVF_POINTS_PER_CELL))
+
+    def signature(self, size):
+        # Размер каталога влияет на сигнатуру через nlist: при росте
+        # каталога индекс пересобирается с подходящим числом ячеек
+        nlist = self.nlist or self.default_nlist(size)
+        return {'kind': self.kind, 'nlist': nlist}
+
+    def create(self, dims, vectors):
+        nlist = self.signature(len(vectors))['nlist']
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dims), dims, nlist,
+                                   faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        return index
+
+    def configure(self, index):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(self.nprobe, ivf.nlist)
+        return index
+
+
+class HNSWIndexStrategy(FlatIndexStrategy):
+    '''
+    IndexHNSWFlat по скалярному произведению, точность поиска задается efSearch
+    HNSW не поддерживает удаление,
+    поэтому при удалении товаров индекс пересобирается
+    '''
+    kind = INDEX_KIND_HNSW
+    supports_remove = False
+
+    def __init__(self, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                 ef_search=HNSW_EF_SEARCH, **params):
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+    def signature(self, size):
+        return {'kind': self.kind, 'm': self.m,
+                'ef_construction': self.ef_construction}
+
+    def create(self, dims, vectors):
+        index = faiss.IndexHNSWFlat(dims, self.m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.ef_construction
+        return index
+
+    def configure(self, index):
+        hnsw = faiss.downcast_index(
+            index.index if isinstance(index, faiss.IndexIDMap) else index)
+        hnsw.hnsw.efSearch = self.ef_search
+        return index
+
+
+INDEX_STRATEGIES = {strategy.kind: strategy for strategy in
+                    (FlatIndexStrategy, IVFIndexStrategy, HNSWIndexStrategy)}
+
+
+def index_strategy(kind=PRODUCT_INDEX_KIND, **params):
+    '''
+    Функция получения стратегии индекса по названию типа
+    '''
+    try:
+        return INDEX_STRATEGIES[kind](**params)
+    except KeyError:
+        raise ValueError(f'Неизвестный тип индекса: {kind}. '
+                         f'Доступны: {", ".join(INDEX_STRATEGIES)}')
+
+
+def build_index(strategy, vectors, ids=None):
+    '''
+    Функция построения индекса с адресацией по id (IndexIDMap2)
+    из нормированных векторов
+    Без ids векторы адресуются номерами строк
+    '''
+    if ids is None:
+        ids = np.arange(len(vectors), dtype='int64')
+    index = faiss.IndexIDMap2(strategy.create(vectors.shape[1], vectors))
+    if len(vectors):
+        index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    return strategy.configure(index)
+
+
+def vector_hashes(matrix):
+    '''
+    Функция вычисления хэша каждой строки разреженной матрицы (csr)
+
+    Хэш зависит только от содержимого вектора, поэтому позволяет понять,
+    изменился ли вектор товара с момента добавления в индекс
+    '''
+    # Приводим матрицу к каноническому виду, чтобы хэш не зависел от
+    # порядка хранения и типов индексов
+    matrix = matrix.tocsr(copy=True)
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    indices = matrix.indices.astype('int64')
+    data = matrix.data.astype('float64')
+    hashes = []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        digest = hashlib.blake2b(indices[start:end].tobytes(), digest_size=8)
+        digest.update(data[start:end].tobytes())
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+class ProductIndex:
+    '''
+    Сохраняемый на диск FAISS индекс продукции с адресацией по id товара
+
+    Индекс (IndexIDMap2 поверх индекса выбранной стратегии) хранится в файле
+    path, рядом лежит файл path.meta с сигнатурой стратегии и соответствием
+    id товара -> хэш его вектора. sync() приводит индекс в соответствие
+    с текущим каталогом: удаляет исчезнувшие и измененные товары, добавляет
+    новые и измененные. При смене стратегии (или если она не умеет удалять)
+    индекс пересобирается целиком. Для поиска индекс читается с диска
+    в память процесса (каждый процесс воркера держит свою копию, mmap
+    FAISS для плоского и HNSW индексов не поддерживает) и перечитывается,
+    только когда файл обновили.
+    '''
+
+    def __init__(self, path=PRODUCT_INDEX_PATH, kind=PRODUCT_INDEX_KIND,
+                 **params):
+        self.path = path
+        self.meta_path = f'{path}.meta'
+        self.strategy = index_strategy(kind, **params)
+        self._lock = threading.Lock()
+        self._reader = None
+        self._reader_mtime = None
+        self.last_sync = {}
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _write(self, index, meta):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as fid:
+            tmp_path = fid.name
+        faiss.write_index(index, tmp_path)
+        # Сначала индекс, затем метаданные: при сбое между записями
+        # следующий sync повторно удалит и добавит те же векторы
+        os.replace(tmp_path, self.path)
+        atomic_dump(meta, self.meta_path)
+
+    def _load_for_update(self, signature, dims):
+        meta = safe_load(self.meta_path, default=None)
+        if (meta is None or self._file_mtime() is None
+                or meta.get('signature') != signature):
+            return None, {}
+        index = faiss.read_index(self.path)
+        if index.d != dims:
+            return None, {}
+        return index, meta['hashes']
+
+    def sync(self, ids, matrix):
+        '''
+        Синхронизация индекса с каталогом
+
+        Принимает id товаров и их TF-IDF матрицу (строки в том же порядке)
+        Выдает словарь с количеством добавленных и удаленных векторов
+        '''
+        ids = np.asarray(ids, dtype='int64')
+        current = dict(zip(ids.tolist(), vector_hashes(matrix)))
+        signature = self.strategy.signature(len(ids))
+        with self._lock:
+            index, hashes = self._load_for_update(signature, matrix.shape[1])
+            stale = [product_id for product_id, value in hashes.items()
+                     if current.get(product_id) != value]
+            fresh = [row for row, product_id in enumerate(ids.tolist())
+                     if hashes.get(product_id) != current[product_id]]
+            rebuild = index is None or (
+                stale and not self.strategy.supports_remove)
+
+            if rebuild:
+                index = build_index(self.strategy, normalized_vectors(matrix),
+                                    ids)
+                fresh = list(range(len(ids)))
+            elif stale or fresh:
+                # Добавляемые id тоже удаляются: так повторный sync после
+                # прерванной записи не создаст дублей
+                removed = stale + ids[fresh].tolist()
+                if self.strategy.supports_remove:
+                    index.remove_ids(np.array(removed, dtype='int64'))
+                index.add_with_ids(normalized_vectors(matrix[fresh]),
+                                   ids[fresh])
+            if rebuild or stale or fresh:
+                self._write(index, {'signature': signature,
+                                    'hashes': current})
+        self.last_sync = {'kind': self.strategy.kind,
+                          'added': len(fresh), 'removed': len(stale),
+                          'rebuilt': bool(rebuild),
+                          'total': int(index.ntotal)}
+        logger.info('Индекс продукции синхронизирован: %s', self.last_sync)
+        return self.last_sync
+
+    def reader(self):
+        '''
+        Возвращает индекс для поиска, загруженный в память процесса,
+        перечитывая файл после обновления
+        '''
+        mtime = self._file_mtime()
+        if self._reader is None or mtime != self._reader_mtime:
+            self._reader = self.strategy.configure(
+                faiss.read_index(self.path))
+            self._reader_mtime = mtime
+        return self._reader
+
+    def search(self, query_matrix, k=NEIGHBORS_COUNT):
+        '''
+        Поиск k ближайших товаров для каждой строки query_matrix
+        Выдает (косинусные близости, id товаров),
+        отсутствующие соседи обозначены id -1
+        '''
+        return self.reader().search(normalized_vectors(query_matrix), k)
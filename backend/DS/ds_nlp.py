@@ -0,0 +1,202 @@
+import logging
+import os
+import resource
+import threading
+import time
+from collections import OrderedDict
+
+import spacy
+
+from DS.ds_storage import atomic_dump, safe_load
+
+logger = logging.getLogger(__name__)
+
+# Модели spaCy, используемые при лемматизации названий
+NLP_MODEL_EN = 'en_core_web_sm'
+NLP_MODEL_RU = 'ru_core_news_sm'
+NLP_DISABLED_PIPES = ['parser', 'ner']
+
+# Кэш лемм отдельных слов, сохраняемый между запусками анализа
+LEMMA_CACHE_SIZE = 100000
+LEMMA_CACHE_PATH = 'DS/cache/lemma_cache.pkl'
+
+
+def current_rss():
+    '''
+    Функция получения текущего объема резидентной памяти процесса в байтах
+
+    На Linux читает /proc/self/statm, на остальных системах
+    возвращает пиковое значение из getrusage (ru_maxrss)
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss на Linux в килобайтах, на macOS в байтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class NLPModelRegistry:
+    '''
+    Реестр моделей spaCy уровня процесса
+
+    Загружает английскую и русскую модели один раз на процесс
+    (воркер celery прогревает реестр сигналом worker_process_init)
+    и отдает одни и те же объекты всем последующим задачам.
+
+    Атрибуты:
+        load_time - время последней загрузки моделей в секундах
+        memory_footprint - прирост памяти процесса при загрузке в байтах
+        loads - сколько раз модели загружались в этом процессе
+    '''
+
+    def __init__(self, loader=None,
+                 model_en=NLP_MODEL_EN, model_ru=NLP_MODEL_RU):
+        self._loader = loader or (
+            lambda name: spacy.load(name, disable=NLP_DISABLED_PIPES))
+        self._model_names = (model_en, model_ru)
+        self._models = None
+        self._lock = threading.Lock()
+        self.load_time = None
+        self.memory_footprint = None
+        self.loads = 0
+
+    @property
+    def is_loaded(self):
+        return self._models is not None
+
+    def _load(self):
+        rss_before = current_rss()
+        started = time.perf_counter()
+        models = tuple(self._loader(name) for name in self._model_names)
+        self.load_time = time.perf_counter() - started
+        self.memory_footprint = max(current_rss() - rss_before, 0)
+        self.loads += 1
+        self._models = models
+        logger.info('Модели spaCy %s загружены за %.2f с, '
+                    'занято памяти %.1f МБ',
+                    ', '.join(self._model_names), self.load_time,
+                    self.memory_footprint / 2 ** 20)
+        return models
+
+    def get(self):
+        '''
+        Возвращает пару (nlp, nlp_ru), загружая модели при первом обращении
+        '''
+        models = self._models
+        if models is None:
+            with self._lock:
+                models = self._models or self._load()
+        return models
+
+    def warm(self):
+        '''
+        Прогрев реестра, повторный вызов не перезагружает модели
+        '''
+        self.get()
+        return self.stats()
+
+    def reload(self):
+        '''
+        Принудительная перезагрузка моделей
+        (например после обновления пакетов моделей)
+        '''
+        with self._lock:
+            self._models = None
+            self._load()
+        return self.stats()
+
+    def stats(self):
+        return {'models': list(self._model_names),
+                'loaded': self.is_loaded,
+                'loads': self.loads,
+                'load_time': self.load_time,
+                'memory_footprint': self.memory_footprint}
+
+
+class TokenLemmaCache:
+    '''
+    Ограниченный LRU кэш соответствия слово -> лемма
+
+    Хранит не более maxsize слов, при переполнении вытесняет
+    давно не использованные. Сохраняется на диск (pickle) между запусками,
+    загружается лениво при первом обращении.
+
+    Атрибуты:
+        hits - количество слов, найденных в кэше
+        misses - количество слов, отправленных в модели spaCy
+    '''
+
+    def __init__(self, maxsize=LEMMA_CACHE_SIZE, path=LEMMA_CACHE_PATH):
+        self.maxsize = maxsize
+        self.path = path
+        self._data = OrderedDict()
+        self._loaded = path is None
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        self.load()
+        return len(self._data)
+
+    def load(self):
+        '''
+        Загрузка кэша с диска, отсутствующий или битый файл дает пустой кэш
+        '''
+        if self._loaded:
+            return
+        self._loaded = True
+        self._data = OrderedDict(safe_load(self.path, default=[]))
+        self._evict()
+
+    def save(self):
+        '''
+        Атомарная запись кэша на диск (через временный файл),
+        только при изменениях
+        '''
+        if self.path is None or not self._dirty:
+            return
+        atomic_dump(list(self._data.items()), self.path)
+        self._dirty = False
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def lookup(self, tokens):
+        '''
+        Возвращает словарь найденных лемм и список слов, которых нет в кэше
+        Повторы слов учитываются один раз, найденные помечаются
+        как недавно использованные
+        '''
+        self.load()
+        found, missing = {}, []
+        for token in dict.fromkeys(tokens):
+            lemma = self._data.get(token)
+            if lemma is None:
+                missing.append(token)
+            else:
+                self._data.move_to_end(token)
+                found[token] = lemma
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def update(self, lemmas):
+        self.load()
+        self._data.update(lemmas)
+        self._evict()
+        self._dirty = True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None}
+
+
+nlp_registry = NLPModelRegistry()
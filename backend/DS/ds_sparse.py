@@ -0,0 +1,58 @@
+import numpy as np
+from sklearn.preprocessing import normalize
+
+from DS.ds_index import NEIGHBORS_COUNT
+
+# Количество строк запросов, перемножаемых с каталогом за один шаг
+SPARSE_BLOCK_SIZE = 2048
+
+
+def sparse_top_k(base_matrix, query_matrix, k=NEIGHBORS_COUNT,
+                 block_size=SPARSE_BLOCK_SIZE):
+    '''
+    Функция поиска k ближайших товаров по косинусной близости
+    без перевода матриц в плотный вид
+
+    Принимает TF-IDF матрицы каталога и запросов (csr),
+    строки нормируются по L2.
+    Запросы перемножаются с каталогом блоками по block_size строк,
+    в плотный вид переводится только блок block_size x число товаров.
+    Выдает (близости, номера строк каталога) размером (число запросов, k)
+    по убыванию близости, при равенстве - по возрастанию номера строки
+    '''
+    base = normalize(base_matrix.tocsr(), norm='l2', copy=True)
+    query = normalize(query_matrix.tocsr(), norm='l2', copy=True)
+    k = min(k, base.shape[0])
+    if k == 0:
+        return (np.empty((query.shape[0], 0), dtype='float32'),
+                np.empty((query.shape[0], 0), dtype='int64'))
+    scores = np.empty((query.shape[0], k), dtype='float32')
+    positions = np.empty((query.shape[0], k), dtype='int64')
+    base_t = base.T
+
+    for start in range(0, query.shape[0], block_size):
+        end = min(start + block_size, query.shape[0])
+        block = (query[start:end] @ base_t).toarray()
+        if k < block.shape[1]:
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(block.shape[1]), (end - start, 1))
+        top_scores = np.take_along_axis(block, top, axis=1)
+        # Сортировка кандидатов: по убыванию близости, затем по номеру строки
+        order = np.lexsort((top, -top_scores), axis=1)
+        positions[start:end] = np.take_along_axis(top, order, axis=1)
+        scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+    return scores, positions
+
+
+def sparse_neighbors(base_ids, base_matrix, query_keys, query_matrix,
+                     k=NEIGHBORS_COUNT, block_size=SPARSE_BLOCK_SIZE):
+    '''
+    Функция сборки словаря предсказаний разреженным поиском
+
+    Выдает словарь {ключ товара дилера: [id товаров Prosept]} как get_neighbors
+    '''
+    base_ids = list(base_ids)
+    _, positions = sparse_top_k(base_matrix, query_matrix, k, block_size)
+    return {key: [base_ids[position] for position in row]
+            for key, row in zip(query_keys, positions.tolist())}
@@ -0,0 +1,33 @@
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_dump(obj, path):
+    '''
+    Функция записи объекта в pickle через временный файл
+
+    Файл подменяется целиком (os.replace), поэтому параллельные читатели
+    никогда не видят частично записанные данные
+    '''
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as fid:
+        pickle.dump(obj, fid, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fid.name, path)
+
+
+def safe_load(path, default=None):
+    '''
+    Функция чтения pickle, отсутствующий или битый файл дает default
+    '''
+    try:
+        with open(path, 'rb') as fid:
+            return pickle.load(fid)
+    except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError) as error:
+        logger.info('Файл %s не загружен: %s', path, error)
+        return default
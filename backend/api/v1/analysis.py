@@ -0,0 +1,201 @@
+import logging
+import time
+
+import pandas as pd
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from core.constants.analysis import (ANALYSIS_CHUNK_SIZE,
+                                     ANALYSIS_SHARD_SIZE,
+                                     PREDICTIONS_BATCH_SIZE)
+from products.models import (AnalysisChunk, DealerParsing,
+                             MatchingPredictions, Product)
+
+logger = logging.getLogger(__name__)
+
+# Поля товаров дилеров, которые нужны DS-модулю
+DEALER_PRODUCT_FIELDS = ['product_key', 'price', 'product_name', 'dealer_id']
+
+
+def backfill_fingerprints(chunk_size=ANALYSIS_CHUNK_SIZE):
+    """
+    Пересчитывает отпечатки данных у товаров дилеров, изменённых
+    в обход save() (массовая загрузка, update(), bulk_update()).
+
+    При сохранении через save() отпечаток обновляется сразу, поэтому
+    анализ не пересчитывает его: полный проход по таблице выполняет
+    команда backfill_fingerprints после загрузки данных в обход Django.
+    Отпечаток сохраняется, только если отличается от записанного: так
+    товар с изменённым названием или ценой снова попадает в анализ.
+    Возвращает количество обновлённых строк.
+    """
+    rows = (DealerParsing.objects
+            .values_list('pk', 'product_name', 'price', 'fingerprint')
+            .iterator(chunk_size=chunk_size))
+    updated = []
+    for pk, product_name, price, fingerprint in rows:
+        actual = DealerParsing.make_fingerprint(product_name, price)
+        if actual != fingerprint:
+            updated.append(DealerParsing(pk=pk, fingerprint=actual))
+    DealerParsing.objects.bulk_update(updated, ['fingerprint'],
+                                      batch_size=chunk_size)
+    return len(updated)
+
+
+def pending_dealer_products():
+    """
+    Возвращает товары дилеров, которые нужно проанализировать.
+
+    Берутся товары без установленного соответствия, которые ещё не
+    анализировались или изменились после последнего анализа (отпечаток
+    данных не совпадает с отпечатком на момент анализа).
+    """
+    return (DealerParsing.objects
+            .filter(is_matched=False)
+            .exclude(analyzed_fingerprint=F('fingerprint')))
+
+
+def plan_shards(shard_size=ANALYSIS_SHARD_SIZE,
+                chunk_size=ANALYSIS_CHUNK_SIZE, pk_range=None):
+    """
+    Делит товары дилеров для анализа на части по shard_size строк.
+
+    Возвращает список частей (первый pk, последний pk, количество строк),
+    поэтому размер задачи в очереди не зависит от объёма данных.
+    pk_range ограничивает деление диапазоном первичных ключей, так часть
+    анализа делится на порции с контрольными точками.
+    """
+    queryset = pending_dealer_products()
+    if pk_range is not None:
+        queryset = queryset.filter(pk__range=pk_range)
+    pks = list(queryset.order_by('pk')
+               .values_list('pk', flat=True).iterator(chunk_size=chunk_size))
+    shards = []
+    for start in range(0, len(pks), shard_size):
+        chunk = pks[start:start + shard_size]
+        shards.append((chunk[0], chunk[-1], len(chunk)))
+    return shards
+
+
+def last_checkpoint(run_id, pk_range):
+    """
+    Возвращает последний первичный ключ, до которого включительно
+    часть pk_range запуска run_id уже зафиксирована, или None.
+    """
+    return (AnalysisChunk.objects
+            .filter(run_id=run_id, last_pk__range=pk_range)
+            .aggregate(last_pk=Max('last_pk'))['last_pk'])
+
+
+def load_dealer_products_frame(pk_range=None,
+                               chunk_size=ANALYSIS_CHUNK_SIZE):
+    """
+    Загружает из БД товары дилеров для анализа в таблицу для DS-модуля.
+
+    pk_range - диапазон первичных ключей части анализа (plan_shards),
+    без него загружаются все товары для анализа. Строки читаются
+    кортежами через iterator, без создания объектов моделей.
+    Колонка fingerprint передаётся в save_predictions.
+    """
+    fields = DEALER_PRODUCT_FIELDS + ['fingerprint']
+    queryset = pending_dealer_products()
+    if pk_range is not None:
+        queryset = queryset.filter(pk__range=pk_range)
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    return pd.DataFrame.from_records(rows, columns=fields)
+
+
+def load_products_frame(chunk_size=ANALYSIS_CHUNK_SIZE):
+    """
+    Загружает каталог Prosept из БД в таблицу для DS-модуля.
+
+    Колонки совпадают с результатом json_reading: все поля Product,
+    id_product переименован в id и приведён к числу.
+    """
+    fields = [field.name for field in Product._meta.fields
+              if field.name != 'id']
+    products = pd.DataFrame.from_records(
+        Product.objects.values_list(*fields).iterator(chunk_size=chunk_size),
+        columns=fields,
+    ).rename(columns={'id_product': 'id'})
+    products['id'] = pd.to_numeric(products['id'])
+    return products
+
+
+def save_predictions(ml_results, batch_size=PREDICTIONS_BATCH_SIZE,
+                     fingerprints=None):
+    """
+    Сохраняет предсказания модели в БД пакетами.
+
+    Товары дилеров и продукты Prosept загружаются заранее двумя
+    запросами in_bulk, предсказания пишутся bulk_create пачками по
+    batch_size строк в одной транзакции. Уже существующие пары
+    пропускаются (ignore_conflicts), неизвестные ключи и id - тоже.
+
+    Если переданы отпечатки, в той же транзакции старые предсказания
+    этих товаров удаляются, а товары помечаются проанализированными,
+    поэтому читатели видят либо старые, либо новые предсказания.
+
+    Параметры:
+        - ml_results: Словарь {ключ товара дилера: [id продуктов Prosept]}.
+        - batch_size: Количество строк в одном INSERT.
+        - fingerprints: Словарь {ключ товара дилера: отпечаток данных,
+            по которым построены предсказания}.
+
+    Возвращает словарь со статистикой записи.
+    """
+    started = time.perf_counter()
+    fingerprints = fingerprints or {}
+    dealer_products = DealerParsing.objects.only('product_key').in_bulk(
+        list({*ml_results, *fingerprints}), field_name='product_key')
+    prosept_ids = {str(prosept_id) for prosept_ids in ml_results.values()
+                   for prosept_id in prosept_ids}
+    products = Product.objects.only('id_product').in_bulk(
+        list(prosept_ids), field_name='id_product')
+
+    predictions = [
+        MatchingPredictions(
+            dealer_product_id=dealer_products[dealer_product_id],
+            prosept_product_id=products[str(prosept_id)],
+        )
+        for dealer_product_id, prosept_product_ids in ml_results.items()
+        if dealer_product_id in dealer_products
+        for prosept_id in prosept_product_ids
+        if str(prosept_id) in products
+    ]
+    analyzed_at = timezone.now()
+    analyzed = []
+    for key, fingerprint in fingerprints.items():
+        if key in dealer_products:
+            dealer_product = dealer_products[key]
+            dealer_product.analyzed_fingerprint = fingerprint
+            dealer_product.analyzed_at = analyzed_at
+            analyzed.append(dealer_product)
+    replaced = 0
+    with transaction.atomic():
+        for start in range(0, len(analyzed), batch_size):
+            keys = [dealer_product.product_key
+                    for dealer_product in analyzed[start:start + batch_size]]
+            replaced += MatchingPredictions.objects.filter(
+                dealer_product_id__in=keys).delete()[0]
+        for start in range(0, len(predictions), batch_size):
+            MatchingPredictions.objects.bulk_create(
+                predictions[start:start + batch_size],
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+        DealerParsing.objects.bulk_update(
+            analyzed, ['analyzed_fingerprint', 'analyzed_at'],
+            batch_size=batch_size)
+
+    stats = {
+        'rows': len(predictions),
+        'replaced': replaced,
+        'analyzed': len(analyzed),
+        'missing_dealer_products': len(set(ml_results) - set(dealer_products)),
+        'missing_products': len(prosept_ids - set(products)),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    logger.info(f'Предсказания записаны: {stats}')
+    return stats
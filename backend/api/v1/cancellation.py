@@ -0,0 +1,53 @@
+import time
+
+from django.core.cache import cache
+
+from core.constants.analysis import CANCEL_CHECK_INTERVAL, PROGRESS_TIMEOUT
+from products.models import AnalysisRun
+
+
+def cancel_key(run_id):
+    return f'analysis_cancel:{run_id}'
+
+
+def request_cancel(run_id):
+    """
+    Помечает запуск анализа отменённым пользователем.
+
+    Флаг записывается в БД и дублируется в кэш, чтобы воркеры
+    проверяли его без запросов к БД. Возвращает False, если запуск
+    не найден или уже завершён.
+    """
+    updated = AnalysisRun.objects.filter(
+        pk=run_id, status__in=AnalysisRun.ACTIVE_STATUSES,
+    ).update(cancel_requested=True)
+    if updated:
+        cache.set(cancel_key(run_id), True, timeout=PROGRESS_TIMEOUT)
+    return bool(updated)
+
+
+def cancel_checker(run_id, interval=CANCEL_CHECK_INTERVAL):
+    """
+    Возвращает колбэк should_stop для DS-модуля.
+
+    Флаг сначала ищется в кэше. Кэш может быть локальным для процесса
+    (locmem) или потерять ключ, поэтому флаг в БД перечитывается,
+    но не чаще раза в interval секунд.
+    """
+    checked_at = None
+
+    def should_stop():
+        nonlocal checked_at
+        if cache.get(cancel_key(run_id)):
+            return True
+        now = time.monotonic()
+        if checked_at is not None and now - checked_at < interval:
+            return False
+        checked_at = now
+        if AnalysisRun.objects.filter(pk=run_id,
+                                      cancel_requested=True).exists():
+            cache.set(cancel_key(run_id), True, timeout=PROGRESS_TIMEOUT)
+            return True
+        return False
+
+    return should_stop
@@ -1,7 +1,8 @@
 import django_filters
 from django.db.models import Exists, OuterRef
 
-from products.models import DealerParsing, MatchingPredictions, Product
+from products.models import (DealerParsing, DealerStatistic,
+                             MatchingPredictions, Product)
 
 
 class DealerParsingFilter(django_filters.FilterSet):
@@ -71,7 +72,7 @@ class StatisticFilter(django_filters.FilterSet):
                                          required=False)
 
     class Meta:
-        model = DealerParsing
+        model = DealerStatistic
         fields = ['min_date', 'max_date']
 
 
@@ -0,0 +1,88 @@
+from django.core.cache import cache
+
+from core.constants.analysis import ANALYSIS_LOCK_TTL
+
+ANALYSIS_LOCK_KEY = 'analysis_lock'
+# Продление и освобождение блокировки в Redis одной командой: проверка
+# владельца и изменение ключа выполняются атомарно
+COMPARE_AND_EXPIRE = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+'''
+COMPARE_AND_DELETE = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+class AnalysisLock:
+    """
+    Аренда права на запуск анализа: в каждый момент идёт не более
+    одного анализа.
+
+    Блокировка - ключ кэша с id запуска и временем жизни ttl. Захват
+    атомарный (cache.add), задачи анализа продлевают аренду (heartbeat),
+    пока работают. Если воркер упал, блокировка освобождается сама
+    по истечении ttl.
+
+    С django-redis продление и освобождение проверяют владельца
+    атомарно (скрипт Lua), поэтому запуск, чья аренда истекла, не
+    продлит и не снимет блокировку следующего запуска. Другие бэкенды
+    кэша проверяют владельца отдельным запросом: между проверкой
+    и изменением остаётся окно гонки, поэтому ttl должен быть намного
+    больше интервала продления.
+
+    Параметры:
+        - ttl: Время жизни блокировки без продления (сек).
+        - key: Ключ кэша блокировки.
+    """
+
+    def __init__(self, ttl=ANALYSIS_LOCK_TTL, key=ANALYSIS_LOCK_KEY):
+        self.ttl = ttl
+        self.key = key
+
+    def holder(self):
+        """
+        Возвращает id запуска, удерживающего блокировку, или None.
+        """
+        return cache.get(self.key)
+
+    def acquire(self, run_id):
+        return cache.add(self.key, run_id, timeout=self.ttl)
+
+    def heartbeat(self, run_id):
+        """
+        Продлевает аренду, если блокировка всё ещё у запуска run_id.
+        """
+        if self._redis() is not None:
+            return self._compare_and(COMPARE_AND_EXPIRE, run_id, self.ttl)
+        if self.holder() == run_id:
+            return cache.touch(self.key, timeout=self.ttl)
+        return False
+
+    def release(self, run_id):
+        if self._redis() is not None:
+            self._compare_and(COMPARE_AND_DELETE, run_id)
+        elif self.holder() == run_id:
+            cache.delete(self.key)
+
+    @staticmethod
+    def _redis():
+        """
+        Возвращает клиент django-redis или None для других бэкендов.
+        """
+        client = getattr(cache, 'client', None)
+        return client if hasattr(client, 'get_client') else None
+
+    def _compare_and(self, script, run_id, *args):
+        client = self._redis()
+        redis = client.get_client(write=True)
+        return bool(redis.eval(script, 1, client.make_key(self.key),
+                               client.encode(run_id), *args))
+
+
+analysis_lock = AnalysisLock()
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused
+
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from telegram import Bot
+from telegram.error import BadRequest, InvalidToken
+
+from api.v1.lock import AnalysisLock
+from core.constants.analysis import (NOTIFICATION_BATCH_SIZE,
+                                     NOTIFICATION_DISPATCH_LOCK_TTL,
+                                     NOTIFICATION_MAX_RETRIES,
+                                     NOTIFICATION_RETRY_BACKOFF,
+                                     NOTIFICATION_RETRY_BACKOFF_MAX)
+from products.models import Notification
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_LOCK_KEY = 'notification_dispatch_lock'
+EMAIL_SUBJECT = 'Анализ данных Prosept'
+EMAIL_MESSAGE = ('Привет, дорогой друг. Это письмо пришло тебе '
+                 'потому что ты запустил процесс анализа данных в сервисе '
+                 'соответствий.\n\nСпешим сообщить тебе, что анализ прошёл '
+                 'успешно. При следующем запросе тебе будут предоставлены '
+                 'обновлённые данные.\n\nПриятного тебе трудового дня! '
+                 'P.S. Не забывай прерываться на чай :)\n\nС любовью, '
+                 'Команда 4 <3')
+# Ошибки, которые не исчезнут при повторе: неверный chat_id, токен
+# или адрес почты
+PERMANENT_ERRORS = (BadRequest, InvalidToken, SMTPRecipientsRefused)
+
+dispatch_lock = AnalysisLock(NOTIFICATION_DISPATCH_LOCK_TTL,
+                             NOTIFICATION_LOCK_KEY)
+
+
+class TelegramClient:
+    """
+    Долгоживущий клиент Telegram для процесса воркера.
+
+    Bot и его HTTP сессия создаются при первой отправке и живут в
+    собственном цикле событий до завершения процесса, поэтому соединение
+    с серверами Telegram не открывается заново на каждое сообщение.
+    После fork клиент создаётся заново. Отправка из нескольких потоков
+    выполняется по очереди.
+
+    Параметры:
+        - token: Токен Telegram бота.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self._lock = threading.Lock()
+        self._loop = None
+        self._bot = None
+        self._pid = None
+
+    def _start(self):
+        if self._pid != os.getpid():
+            self._loop = asyncio.new_event_loop()
+            self._bot = None
+            self._pid = os.getpid()
+        if self._bot is None:
+            bot = Bot(token=self.token)
+            self._loop.run_until_complete(bot.initialize())
+            self._bot = bot
+
+    def send_many(self, messages):
+        """
+        Отправляет пачку сообщений одновременно.
+
+        Принимает список пар (chat_id, текст), возвращает список ошибок
+        в том же порядке: None для доставленных сообщений.
+        """
+        with self._lock:
+            try:
+                self._start()
+            except Exception as error:
+                return [error] * len(messages)
+            results = self._loop.run_until_complete(asyncio.gather(
+                *(self._bot.send_message(chat_id=chat_id, text=text)
+                  for chat_id, text in messages),
+                return_exceptions=True))
+        return [result if isinstance(result, Exception) else None
+                for result in results]
+
+    def close(self):
+        with self._lock:
+            if self._bot is not None and self._pid == os.getpid():
+                self._loop.run_until_complete(self._bot.shutdown())
+                self._loop.close()
+            self._loop = self._bot = self._pid = None
+
+
+def enqueue_notification(run, message):
+    """
+    Сохраняет уведомление о запуске анализа в outbox.
+
+    Без chat_id уведомление сразу отправляется на почту, без получателей
+    вовсе - сохраняется как недоставленное.
+    """
+    notification = Notification(run=run, chat_id=run.chat_id,
+                                email=run.email, message=message)
+    if run.chat_id is None:
+        notification.channel = Notification.EMAIL
+    if run.chat_id is None and not run.email:
+        notification.status = Notification.FAILED
+        notification.last_error = 'Не указаны получатели уведомления'
+    notification.save()
+    return notification
+
+
+def notification_countdown(attempts):
+    """
+    Возвращает задержку перед следующей попыткой доставки (сек).
+    """
+    return get_exponential_backoff_interval(
+        NOTIFICATION_RETRY_BACKOFF, attempts - 1,
+        NOTIFICATION_RETRY_BACKOFF_MAX, full_jitter=False)
+
+
+def mark_sent(notification, now):
+    notification.status = Notification.SENT
+    notification.sent_at = now
+    notification.last_error = ''
+
+
+def mark_failed(notification, error, now):
+    """
+    Учитывает неудачную попытку доставки.
+
+    Временная ошибка откладывает следующую попытку с экспоненциальной
+    задержкой. Постоянная ошибка или исчерпанные повторы в Telegram
+    переводят уведомление на почту, на почте - делают недоставленным.
+    """
+    notification.attempts += 1
+    notification.last_error = f'{type(error).__name__}: {error}'
+    exhausted = (isinstance(error, PERMANENT_ERRORS)
+                 or notification.attempts > NOTIFICATION_MAX_RETRIES)
+    if not exhausted:
+        notification.next_attempt_at = now + timedelta(
+            seconds=notification_countdown(notification.attempts))
+    elif notification.channel == Notification.TELEGRAM and notification.email:
+        notification.channel = Notification.EMAIL
+        notification.attempts = 0
+        notification.next_attempt_at = now
+    else:
+        notification.status = Notification.FAILED
+
+
+def deliver_telegram(client, notifications):
+    """
+    Отправляет пачку уведомлений в Telegram одним клиентом.
+    """
+    if not notifications:
+        return
+    errors = client.send_many([(notification.chat_id, notification.message)
+                               for notification in notifications])
+    now = timezone.now()
+    for notification, error in zip(notifications, errors):
+        if error is None:
+            mark_sent(notification, now)
+        else:
+            logger.warning(f'Уведомление #{notification.pk} не отправлено '
+                           f'в Telegram: {error}')
+            mark_failed(notification, error, now)
+
+
+def deliver_emails(notifications):
+    """
+    Отправляет пачку уведомлений на почту через одно SMTP соединение.
+    """
+    if not notifications:
+        return
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as error:
+        logger.error(f'Нет соединения с почтовым сервером: {error}')
+        now = timezone.now()
+        for notification in notifications:
+            mark_failed(notification, error, now)
+        return
+    try:
+        for notification in notifications:
+            message = EmailMessage(EMAIL_SUBJECT, EMAIL_MESSAGE,
+                                   settings.DEFAULT_FROM_EMAIL,
+                                   [notification.email],
+                                   connection=connection)
+            try:
+                message.send()
+            except Exception as error:
+                logger.error(f'Письмо по уведомлению #{notification.pk} '
+                             f'не отправлено: {error}')
+                mark_failed(notification, error, timezone.now())
+            else:
+                mark_sent(notification, timezone.now())
+    finally:
+        connection.close()
+
+
+def deliver_pending(client, holder, batch_size=NOTIFICATION_BATCH_SIZE):
+    """
+    Доставляет накопившиеся уведомления пачками по batch_size.
+
+    Одновременно работает не более одного диспетчера: остальные сразу
+    выходят. Возвращает количество уведомлений по итоговым состояниям
+    или None, если диспетчер уже запущен.
+
+    Параметры:
+        - client: Клиент Telegram (TelegramClient).
+        - holder: Идентификатор диспетчера для блокировки.
+        - batch_size: Количество уведомлений в пачке.
+    """
+    if not dispatch_lock.acquire(holder):
+        return None
+    stats = {}
+    try:
+        while True:
+            batch = list(Notification.objects.filter(
+                status=Notification.PENDING,
+                next_attempt_at__lte=timezone.now(),
+            ).order_by('next_attempt_at', 'id')[:batch_size])
+            if not batch:
+                break
+            deliver_telegram(client, [
+                notification for notification in batch
+                if notification.channel == Notification.TELEGRAM])
+            deliver_emails([
+                notification for notification in batch
+                if notification.channel == Notification.EMAIL
+                and notification.status == Notification.PENDING])
+            Notification.objects.bulk_update(batch, (
+                'channel', 'status', 'attempts', 'next_attempt_at',
+                'last_error', 'sent_at'))
+            for notification in batch:
+                key = f'{notification.channel}_{notification.status}'
+                stats[key] = stats.get(key, 0) + 1
+            dispatch_lock.heartbeat(holder)
+    finally:
+        dispatch_lock.release(holder)
+    return stats
@@ -0,0 +1,115 @@
+import time
+
+from django.core.cache import cache
+
+from core.constants.analysis import ANALYSIS_STAGES, PROGRESS_TIMEOUT
+
+# Ключ с id последнего запущенного анализа
+CURRENT_RUN_KEY = 'analysis_progress:current'
+
+
+class AnalysisProgress:
+    """
+    Прогресс запуска анализа в кэше Django (Redis в продакшене).
+
+    Для каждого этапа хранятся отдельные ключи с количеством обработанных
+    строк и временем начала этапа. Части анализа работают параллельно
+    и увеличивают счётчики атомарно (cache.incr), поэтому чтение
+    прогресса не обращается к таблицам БД и не блокирует расчёт.
+
+    Параметры:
+        - run_id: Идентификатор запуска анализа (AnalysisRun).
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.prefix = f'analysis_progress:{run_id}'
+
+    def key(self, *parts):
+        return ':'.join((self.prefix, *parts))
+
+    @classmethod
+    def current(cls):
+        """
+        Возвращает прогресс последнего запущенного анализа или None.
+        """
+        run_id = cache.get(CURRENT_RUN_KEY)
+        return None if run_id is None else cls(run_id)
+
+    def start(self, total):
+        """
+        Начинает отсчёт: total - количество строк дилеров в запуске.
+        """
+        values = {self.key('total'): total,
+                  self.key('status'): 'running',
+                  self.key('started_at'): time.time()}
+        values.update({self.key(stage, 'processed'): 0
+                       for stage in ANALYSIS_STAGES})
+        cache.set_many(values, timeout=PROGRESS_TIMEOUT)
+        cache.set(CURRENT_RUN_KEY, self.run_id, timeout=PROGRESS_TIMEOUT)
+
+    def advance(self, stage, count):
+        """
+        Отмечает, что count строк завершили этап stage.
+        Подходит как колбэк progress для main_function.
+        """
+        cache.add(self.key(stage, 'started_at'), time.time(),
+                  timeout=PROGRESS_TIMEOUT)
+        try:
+            cache.incr(self.key(stage, 'processed'), count)
+        except ValueError:
+            # Ключ вытеснен из кэша — начинаем счёт заново.
+            cache.set(self.key(stage, 'processed'), count,
+                      timeout=PROGRESS_TIMEOUT)
+
+    def finish(self, status):
+        cache.set_many({self.key('status'): status,
+                        self.key('finished_at'): time.time()},
+                       timeout=PROGRESS_TIMEOUT)
+
+    def snapshot(self):
+        """
+        Возвращает состояние запуска: статус, текущий этап и по каждому
+        этапу обработано/всего и оценку оставшегося времени (сек).
+        """
+        keys = [self.key(name)
+                for name in ('total', 'status', 'started_at', 'finished_at')]
+        for stage in ANALYSIS_STAGES:
+            keys += [self.key(stage, 'processed'),
+                     self.key(stage, 'started_at')]
+        values = cache.get_many(keys)
+        if self.key('status') not in values:
+            return None
+
+        now = values.get(self.key('finished_at'), time.time())
+        total = values.get(self.key('total'), 0)
+        stages = []
+        current_stage = None
+        for stage in ANALYSIS_STAGES:
+            processed = values.get(self.key(stage, 'processed'), 0)
+            started_at = values.get(self.key(stage, 'started_at'))
+            eta = None
+            if started_at is not None and 0 < processed < total:
+                eta = round((now - started_at) * (total - processed)
+                            / processed, 1)
+            elif total and processed >= total:
+                eta = 0
+            if current_stage is None and processed < total:
+                current_stage = stage
+            stages.append({'stage': stage, 'processed': processed,
+                           'total': total, 'eta_seconds': eta})
+
+        started_at = values.get(self.key('started_at'), now)
+        done = sum(item['processed'] for item in stages)
+        planned = total * len(stages)
+        eta = None
+        if planned and done >= planned:
+            eta = 0
+        elif done:
+            eta = round((now - started_at) * (planned - done) / done, 1)
+        return {'run_id': self.run_id,
+                'status': values[self.key('status')],
+                'stage': current_stage,
+                'elapsed_seconds': round(now - started_at, 1),
+                'eta_seconds': eta,
+                'stages': stages}
@@ -13,6 +13,27 @@ ANALYSIS_SCHEMA = {
                      'products_matchingpredictions.'),
         summary='Запустить анализ данных и отправить уведомление.'
     ),
+    'progress': extend_schema(
+        description=('Возвращает прогресс анализа: статус, текущий этап, '
+                     'по каждому этапу (загрузка, нормализация, '
+                     'лемматизация, векторизация, поиск, запись) количество '
+                     'обработанных строк из общего числа и оценку '
+                     'оставшегося времени в секундах.\n\nБез параметров '
+                     'возвращается последний запущенный анализ, параметр '
+                     'run_id выбирает конкретный запуск.'),
+        summary='Получить прогресс анализа.',
+        parameters=[OpenApiParameter('run_id', int, required=False,
+                                     description='Идентификатор запуска.')],
+    ),
+    'cancel': extend_schema(
+        description=('Отменяет анализ. Воркеры останавливаются после '
+                     'текущего этапа, уже записанные в БД предсказания '
+                     'сохраняются, а следующий анализ продолжит с '
+                     'оставшихся товаров.\n\nБез параметров отменяется '
+                     'текущий анализ, run_id в теле запроса выбирает '
+                     'конкретный запуск.'),
+        summary='Отменить анализ.',
+    ),
 }
 
 # AuthViewSet
@@ -230,3 +251,39 @@ MATCHING_PREDICTIONS_SCHEMA = {
         summary='Получить детали актуального предсказания соответствия',
     ),
 }
+
+# AnalysisRunViewSet
+ANALYSIS_RUN_SCHEMA = {
+    'list': extend_schema(
+        description=('Получает историю запусков анализа с применением '
+                     'пагинации: кто запустил, статус, количество строк, '
+                     'длительность этапов, пик памяти и количество '
+                     'записанных предсказаний. Фильтр по полю status.'),
+        summary='Получить историю запусков анализа.',
+    ),
+    'retrieve': extend_schema(
+        description='Получает детали запуска анализа.',
+        summary='Получить детали запуска анализа.',
+    ),
+}
+
+# StatisticViewSet
+STATISTIC_SCHEMA = {
+    'list': extend_schema(
+        description=('Получает количество товаров дилеров: всего '
+                     '(total), сопоставленных (is_matching), отложенных '
+                     '(postponed) и без соответствий (has_no_matches). '
+                     'Фильтр по дате: min_date, max_date. С параметром '
+                     'group_by возвращает список тех же счётчиков по '
+                     'дилерам (dealer_id, dealer_name) или по дням (date).'),
+        summary='Получить статистику товаров дилеров.',
+        parameters=[OpenApiParameter(
+            name='group_by',
+            location=OpenApiParameter.QUERY,
+            description='Группировка статистики.',
+            required=False,
+            type=str,
+            enum=['dealer', 'day'],
+        )],
+    ),
+}
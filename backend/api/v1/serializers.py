@@ -2,8 +2,9 @@ from datetime import datetime
 
 from rest_framework import serializers
 
-from products.models import (Dealer, DealerParsing, Product,
-                             Match, MatchingPredictions)
+from products.models import (AnalysisRun, Dealer, DealerParsing,
+                             DealerStatistic, Product, Match,
+                             MatchingPredictions)
 
 
 class DealerSerializer(serializers.ModelSerializer):
@@ -27,10 +28,17 @@ class DealerParsingSerializer(serializers.ModelSerializer):
     """
     Сериализатор для отображения спарсенного списка товаров дилеров.
 
+    Атрибуты класса:
+        - select_related_fields: Связи, загружаемые вместе с объектом;
+        - only_fields: Поля связей, которые читает to_representation.
+
     Методы:
         - to_representation: Преобразует данные DealerParsing
             для представления в JSON.
     """
+    select_related_fields = ('dealer_id',)
+    only_fields = ('dealer_id__name',)
+
     def to_representation(self, instance):
         """
         Преобразует данные DealerParsing для представления в JSON.
@@ -78,11 +86,15 @@ class DealerParsingPostponeSerializer(serializers.ModelSerializer):
 
     Атрибуты класса:
         - `model`: модель, используемая для сериализации;
-        - `fields`: список полей модели, которые будут сериализованы.
+        - `fields`: список полей модели, которые будут сериализованы;
+        - `only_fields`: поля, которые дополнительно читает
+        `to_representation`.
 
     Методы:
         - `update`: обновляет данные отложенного элемента.
     """
+    only_fields = ('product_name', 'product_key', 'postpone_date',
+                   'product_url', 'price')
 
     def to_representation(self, instance):
         """
@@ -152,11 +164,15 @@ class DealerParsingNoMatchesSerializer(serializers.ModelSerializer):
 
     Атрибуты класса:
         - `model`: модель, используемая для сериализации;
-        - `fields`: список полей модели, которые будут сериализованы.
+        - `fields`: список полей модели, которые будут сериализованы;
+        - `only_fields`: поля, которые дополнительно читает
+        `to_representation`.
 
     Методы:
         - `update`: обновляет данные элемента без соответствий.
     """
+    only_fields = ('product_name', 'product_key',
+                   'has_no_matches_toggle_date', 'product_url', 'price')
 
     def to_representation(self, instance):
         """
@@ -247,9 +263,19 @@ class MatchSerializer(serializers.ModelSerializer):
     """
     Сериализатор для отображения списка мэтчей.
 
+    Атрибуты класса:
+        - select_related_fields: Связи, загружаемые вместе с объектом;
+        - only_fields: Поля связей, которые читает to_representation.
+
     Методы:
         - to_representation: Преобразует данные мэтча для представления в JSON.
     """
+    select_related_fields = ('key__dealer_id', 'product_id')
+    only_fields = ('key__product_key', 'key__product_name', 'key__price',
+                   'key__product_url', 'key__matching_date',
+                   'key__dealer_id__name', 'product_id__id_product',
+                   'product_id__name_1c', 'product_id__name',
+                   'product_id__article', 'product_id__cost')
 
     def to_representation(self, instance):
         """
@@ -333,10 +359,24 @@ class MatchingPredictionsSerializer(serializers.ModelSerializer):
     """
     Сериализатор для отображения списка предсказаний совпадений.
 
+    Атрибуты класса:
+        - select_related_fields: Связи, загружаемые вместе с объектом;
+        - only_fields: Поля связей, которые читает to_representation.
+
     Метод:
         - to_representation: Преобразует данные предсказания для
             представления в JSON.
     """
+    select_related_fields = ('dealer_product_id__dealer_id',
+                             'prosept_product_id')
+    only_fields = ('dealer_product_id__product_key',
+                   'dealer_product_id__product_name',
+                   'dealer_product_id__product_url',
+                   'dealer_product_id__dealer_id__name',
+                   'prosept_product_id__id_product',
+                   'prosept_product_id__name_1c', 'prosept_product_id__name',
+                   'prosept_product_id__article', 'prosept_product_id__cost')
+
     def to_representation(self, instance):
         """
         Преобразует данные предсказания для представления в JSON.
@@ -369,3 +409,68 @@ class MatchingPredictionsSerializer(serializers.ModelSerializer):
     class Meta:
         model = MatchingPredictions
         fields = '__all__'
+
+
+class AnalysisRunSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для отображения истории запусков анализа.
+
+    Длительности этапов возвращаются двумя полями: stage_timings - сумма
+    по всем частям анализа (суммарная работа воркеров), stage_timings_max
+    - самая долгая часть (части считаются параллельно, поэтому это ближе
+    к реальному времени этапа).
+
+    Атрибуты класса:
+        - select_related_fields: Связи, загружаемые вместе с объектом;
+        - model: Модель, используемая для сериализации;
+        - fields: Список полей модели, которые будут сериализованы.
+    """
+    select_related_fields = ('user',)
+
+    user = serializers.StringRelatedField()
+    duration = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = AnalysisRun
+        fields = (
+            'id',
+            'user',
+            'status',
+            'created_at',
+            'started_at',
+            'finished_at',
+            'duration',
+            'shards',
+            'dealer_rows',
+            'product_rows',
+            'fast_path_rows',
+            'predictions_written',
+            'predictions_replaced',
+            'stage_timings',
+            'stage_timings_max',
+            'peak_memory_mb',
+            'cancel_requested',
+            'error',
+        )
+
+
+class DealerStatisticSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для отображения счётчиков товаров дилера за день.
+
+    Атрибуты класса:
+        - model: Модель, используемая для сериализации;
+        - fields: Список полей модели, которые будут сериализованы.
+    """
+
+    class Meta:
+        model = DealerStatistic
+        fields = (
+            'id',
+            'date',
+            'dealer',
+            'total',
+            'matched',
+            'postponed',
+            'no_matches',
+        )
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from core.constants.analysis import ANALYSIS_CHUNK_SIZE
+from products.models import DealerParsing, DealerStatistic
+
+# Режимы группировки статистики: поля DealerStatistic, по которым
+# группируются строки, дополнительные поля группы и порядок строк
+GROUP_BY_DEALER = 'dealer'
+GROUP_BY_DAY = 'day'
+GROUPINGS = {
+    GROUP_BY_DEALER: (('dealer_id',), {'dealer_name': F('dealer__name')},
+                      ('dealer_name', 'dealer_id')),
+    GROUP_BY_DAY: (('date',), {}, ('date',)),
+}
+# Ключи ответа статистики и соответствующие им счётчики DealerStatistic
+STATISTIC_COUNTERS = {
+    'is_matching': 'matched',
+    'postponed': 'postponed',
+    'has_no_matches': 'no_matches',
+    'total': 'total',
+}
+
+
+def statistic_counters():
+    """
+    Возвращает счётчики DealerStatistic как условные агрегаты
+    COUNT(... FILTER) по товарам дилеров.
+    """
+    return {
+        'matched': Count('pk', filter=Q(is_matched=True)),
+        'postponed': Count('pk', filter=Q(is_postponed=True)),
+        'no_matches': Count('pk', filter=Q(has_no_matches=True)),
+        'total': Count('pk'),
+    }
+
+
+def aggregate_statistic(queryset, group_by=None):
+    """
+    Суммирует счётчики DealerStatistic одним запросом.
+
+    Без группировки возвращает словарь счётчиков, с группировкой
+    (GROUP_BY_DEALER или GROUP_BY_DAY) - список строк с полями
+    группы и счётчиками: дилеры по названию, дни по дате.
+    """
+    counters = {key: Coalesce(Sum(column), 0)
+                for key, column in STATISTIC_COUNTERS.items()}
+    if group_by is None:
+        return queryset.aggregate(**counters)
+    fields, expressions, ordering = GROUPINGS[group_by]
+    return list(queryset.order_by()
+                .values(*fields, **expressions)
+                .annotate(**counters)
+                .order_by(*ordering))
+
+
+def rebuild_statistics(chunk_size=ANALYSIS_CHUNK_SIZE):
+    """
+    Пересчитывает таблицу DealerStatistic по товарам дилеров.
+
+    Нужна после изменений в обход save() (bulk_update, update(), загрузка
+    SQL дампа) и для первоначального заполнения. Таблица заменяется
+    целиком в одной транзакции. Возвращает количество строк статистики.
+    """
+    rows = (DealerParsing.objects.order_by()
+            .values('date', 'dealer_id')
+            .annotate(**statistic_counters()))
+    with transaction.atomic():
+        DealerStatistic.objects.all().delete()
+        statistics = DealerStatistic.objects.bulk_create(
+            (DealerStatistic(**row)
+             for row in rows.iterator(chunk_size=chunk_size)),
+            batch_size=chunk_size,
+        )
+    return len(statistics)
@@ -1,116 +1,363 @@
-import asyncio
 import logging
+import resource
+from collections import Counter
 
-from django.core.mail import send_mail
-from telegram import Bot
-from telegram.error import BadRequest, InvalidToken, NetworkError, TimedOut
+from celery import chord
+from celery.signals import worker_process_shutdown, worker_shutdown
+from celery.utils.time import get_exponential_backoff_interval
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from DS.ds_analyze import main_function
+from DS.ds_analyze import (AnalysisCancelled, check_cancelled, main_function,
+                           stage_timer)
+from DS.ds_catalog import CatalogCache
+from DS.ds_index import ProductIndex
+from DS.ds_nlp import TokenLemmaCache, current_rss
+from api.v1.analysis import (last_checkpoint, load_dealer_products_frame,
+                             load_products_frame, plan_shards,
+                             save_predictions)
+from api.v1.cancellation import cancel_checker
+from api.v1.lock import analysis_lock
+from api.v1.notifications import (TelegramClient, deliver_pending,
+                                  enqueue_notification)
+from api.v1.progress import AnalysisProgress
 from backend.celery import app
-from backend.settings import DEFAULT_FROM_EMAIL
-from core.environment import BOT_TOKEN
-from products.models import MatchingPredictions, DealerParsing, Product
+from core.constants.analysis import (ANALYSIS_CHECKPOINT_SIZE,
+                                     ANALYSIS_MAX_RETRIES,
+                                     ANALYSIS_RETRY_BACKOFF,
+                                     ANALYSIS_RETRY_BACKOFF_MAX,
+                                     ANALYSIS_SHARD_SIZE)
+from core.environment import (BOT_TOKEN, LEMMA_BATCH_SIZE, LEMMA_N_PROCESS,
+                              LEMMA_CACHE_SIZE, LEMMA_CACHE_PATH,
+                              CATALOG_CACHE_PATH, PRODUCT_INDEX_PATH,
+                              PRODUCT_INDEX_KIND, IVF_NPROBE, HNSW_EF_SEARCH,
+                              NEIGHBORS_BACKEND)
+from products.models import AnalysisChunk, AnalysisRun
 
-bot = Bot(token=BOT_TOKEN)
 logger = logging.getLogger(__name__)
+# Временные ошибки БД (разрыв соединения, блокировки), после которых
+# задачу анализа имеет смысл повторить
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError)
+# Счётчики запуска, которые суммируются по контрольным точкам
+CHUNK_COUNTERS = ('dealer_rows', 'fast_path_rows', 'predictions_written',
+                  'predictions_replaced')
+# Кэши лемм слов, подготовленного каталога и индекс продукции живут всё
+# время жизни процесса воркера.
+lemma_cache = TokenLemmaCache(LEMMA_CACHE_SIZE, LEMMA_CACHE_PATH)
+catalog_cache = CatalogCache(CATALOG_CACHE_PATH)
+product_index = ProductIndex(PRODUCT_INDEX_PATH, PRODUCT_INDEX_KIND,
+                             nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH)
+# Клиент Telegram держит одну HTTP сессию на процесс воркера уведомлений.
+telegram_client = TelegramClient(BOT_TOKEN)
 
 
-@app.task
-async def send_telegram_message(chat_id, email, message):
+@app.task(bind=True)
+def dispatch_notifications(self):
     """
-    Отправляет сообщение в Telegram и, в случае ошибки, уведомляет
-        пользователя по электронной почте.
+    Доставляет уведомления из outbox пачками через общий для процесса
+    клиент Telegram, недоставленные - одним SMTP соединением.
 
-    Параметры:
-        - chat_id: Идентификатор чата Telegram.
-        - email: Адрес электронной почты для уведомления.
-        - message: Текст сообщения для отправки.
+    Запускается после каждого анализа и периодически из celery beat,
+    чтобы повторить отложенные попытки.
     """
-    def _telegram_error(error_message, error_detail):
-        return ('Сообщение в Telegram не отправлено! '
-                f'{error_message}!'
-                ' Отправляем письмо на почту...'
-                f' Детали ошибки: {error_detail}')
+    stats = deliver_pending(telegram_client, self.request.id)
+    if stats:
+        logger.info(f'Уведомления обработаны: {stats}')
+    return stats
 
-    try:
-        async with bot:
-            await bot.send_message(chat_id=chat_id, text=message)
-        logger.info('Сообщение в Telegram успешно отправлено!')
 
-        return
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_telegram_client(**kwargs):
+    """
+    Закрывает HTTP сессию клиента Telegram при остановке воркера.
+    """
+    telegram_client.close()
+
 
-    except BadRequest as err:
-        msg = 'chat_id пользователя не задан! '
-        error = err
+class PeakMemory:
+    """
+    Замер пика резидентной памяти процесса за время одной задачи (МБ).
 
-    except InvalidToken as err:
-        msg = 'Недействительный токен! '
-        error = err
+    ru_maxrss - пик за всё время жизни процесса, а воркеры ml не
+    перезапускаются после задач. Поэтому на Linux в начале замера счётчик
+    пика ядра сбрасывается (запись 5 в /proc/self/clear_refs), и
+    ru_maxrss в конце показывает пик только этой задачи. Если сброс
+    недоступен, пик оценивается по замерам текущей памяти (sample) на
+    границах этапов.
+    """
 
-    except TimedOut as err:
-        msg = 'Истекло время запроса! '
-        error = err
+    def __init__(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+        except OSError:
+            self.kernel_reset = False
+        else:
+            self.kernel_reset = True
+        self.peak = current_rss()
 
-    except NetworkError as err:
-        msg = 'Проверьте возможность подключения к серверам Telegram! '
-        error = err
+    def sample(self):
+        self.peak = max(self.peak, current_rss())
 
-    except Exception as err:
-        msg = 'Произошла непредвиденная ошибка! '
-        error = err
+    def mb(self):
+        self.sample()
+        peak = self.peak
+        if self.kernel_reset:
+            # ru_maxrss в Linux измеряется в килобайтах
+            peak = max(peak, resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss * 1024)
+        return round(peak / 2 ** 20, 1)
 
-    # Логируем ошибку.
-    logger.error(_telegram_error(msg, error))
 
-    try:
-        subject = 'Анализ данных Prosept'
-        message = ('Привет, дорогой друг. Это письмо пришло тебе '
-                   'потому что ты запустил процесс анализа данных в сервисе '
-                   'соответствий.\n\nСпешим сообщить тебе, что анализ прошёл '
-                   'успешно. При следующем запросе тебе будут предоставлены '
-                   'обновлённые данные.\n\nПриятного тебе трудового дня! '
-                   'P.S. Не забывай прерываться на чай :)\n\nС любовью, '
-                   'Команда 4 <3')
-        send_from = DEFAULT_FROM_EMAIL
-        send_to = [email]
-
-        send_mail(subject, message, send_from, send_to, fail_silently=False)
+def merge_shard_metrics(results):
+    """
+    Сводит замеры частей анализа: длительности этапов суммируются
+    (stage_timings - суммарная работа воркеров) и берутся максимальные
+    по частям (stage_timings_max - самая долгая часть, части идут
+    параллельно), пик памяти берётся максимальный.
+    """
+    timings = Counter()
+    longest = {}
+    peaks = []
+    for result in results:
+        for stage, seconds in result.get('stage_timings', {}).items():
+            timings[stage] += seconds
+            longest[stage] = max(longest.get(stage, 0), seconds)
+        if result.get('peak_memory_mb') is not None:
+            peaks.append(result['peak_memory_mb'])
+    return {'stage_timings': {stage: round(seconds, 3)
+                              for stage, seconds in timings.items()},
+            'stage_timings_max': {stage: round(seconds, 3)
+                                  for stage, seconds in longest.items()},
+            'peak_memory_mb': max(peaks, default=None)}
+
 
+def retry_on_db_error(task, error):
+    """
+    Перезапускает задачу с экспоненциальной задержкой, если ошибка БД
+    временная и попытки не исчерпаны. Иначе ничего не делает.
+    """
+    if (isinstance(error, TRANSIENT_DB_ERRORS)
+            and task.request.retries < task.max_retries):
+        logger.warning(f'Повтор задачи {task.name}: {error}')
+        raise task.retry(exc=error, countdown=get_exponential_backoff_interval(
+            ANALYSIS_RETRY_BACKOFF, task.request.retries,
+            ANALYSIS_RETRY_BACKOFF_MAX, full_jitter=True))
+
+
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True,
+          max_retries=ANALYSIS_MAX_RETRIES)
+def make_predictions(self, run_id):
+    """
+    Запускает анализ данных частями.
+
+    Готовит общий для всех частей кэш каталога и FAISS индекс продукции,
+    делит новые и изменённые товары дилеров на диапазоны первичных
+    ключей и запускает chord: каждую часть считает отдельная задача
+    score_shard, а finalize_analysis завершает запуск и отправляет
+    одно уведомление. Через брокер передаются только id запуска
+    и границы диапазонов. При временной ошибке БД задача повторяется,
+    повторно доставленная задача после запуска частей ничего не делает.
+
+    Параметры:
+        - run_id: Идентификатор запуска анализа (AnalysisRun).
+    """
+    pending = AnalysisRun.objects.filter(pk=run_id, dispatched_at=None)
+    if not pending.exists():
+        logger.warning(f'Части анализа #{run_id} уже запущены')
+        return None
+    analysis_lock.heartbeat(run_id)
+    should_stop = cancel_checker(run_id)
+    if should_stop():
+        return finalize_analysis([{'cancelled': True}], run_id)
+    pending.update(status=AnalysisRun.RUNNING, started_at=timezone.now())
+    try:
+        index_stats = sync_product_index()
+        shards = plan_shards(ANALYSIS_SHARD_SIZE)
     except Exception as error:
-        logger.error(f'Непредвиденная ошибка отправки письма: {error}')
+        retry_on_db_error(self, error)
+        logger.exception('Не удалось подготовить анализ')
+        return finalize_analysis([{'error': str(error)}], run_id)
+    if should_stop():
+        return finalize_analysis([{'cancelled': True}], run_id)
+
+    # Повторно доставленная задача (acks_late) не запускает части
+    # ещё раз: запуск фиксируется условным обновлением
+    if not pending.update(dispatched_at=timezone.now(), shards=len(shards),
+                          product_rows=index_stats['total']):
+        logger.warning(f'Части анализа #{run_id} уже запущены')
+        return None
+    logger.info(f'Анализ #{run_id} разделён на {len(shards)} частей')
+    AnalysisProgress(run_id).start(sum(rows for _, _, rows in shards))
+    if not shards:
+        return finalize_analysis([], run_id)
+    chord(score_shard.s(run_id, (first_pk, last_pk))
+          for first_pk, last_pk, _ in shards)(finalize_analysis.s(run_id))
+    return len(shards)
 
 
-@app.task(rate_limit='1/m')
-def make_predictions(json_parser, json_products, email, chat_id=None):
+def score_chunk(run_id, pk_range, products, report, should_stop, timings):
+    """
+    Считает предсказания для порции товаров дилеров и фиксирует их
+    в одной транзакции с контрольной точкой (AnalysisChunk).
+    Длительность этапов копится в timings.
     """
-    Выполняет асинхронный анализ данных и отправляет уведомление в Telegram.
+    with stage_timer(timings, 'loading'):
+        parser = load_dealer_products_frame(pk_range)
+    report('loading', len(parser))
+    fingerprints = dict(zip(parser['product_key'], parser['fingerprint']))
+    match_stats = {}
+    ml_results = main_function(parser, products,
+                               batch_size=LEMMA_BATCH_SIZE,
+                               n_process=LEMMA_N_PROCESS,
+                               lemma_cache=lemma_cache,
+                               catalog_cache=catalog_cache,
+                               product_index=product_index,
+                               backend=NEIGHBORS_BACKEND,
+                               stats=match_stats,
+                               sync_index=False,
+                               progress=report,
+                               should_stop=should_stop,
+                               timings=timings)
+    with stage_timer(timings, 'persistence'), transaction.atomic():
+        save_stats = save_predictions(ml_results, fingerprints=fingerprints)
+        AnalysisChunk.objects.create(
+            run_id=run_id, first_pk=pk_range[0], last_pk=pk_range[1],
+            dealer_rows=len(parser),
+            fast_path_rows=match_stats.get('fast_path', 0),
+            predictions_written=save_stats['rows'],
+            predictions_replaced=save_stats['replaced'])
+    report('persistence', len(parser))
+    logger.info(f'Порция {pk_range} анализа #{run_id}: {match_stats}')
+
+
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True,
+          max_retries=ANALYSIS_MAX_RETRIES)
+def score_shard(self, run_id, pk_range):
+    """
+    Считает предсказания для части товаров дилеров.
+
+    Использует кэш каталога и индекс продукции, подготовленные
+    make_predictions. Часть считается порциями по
+    ANALYSIS_CHECKPOINT_SIZE строк, каждая порция фиксируется вместе
+    с контрольной точкой. Повтор задачи (временная ошибка БД или
+    потерянный воркер - задача подтверждается только после выполнения)
+    продолжает работу после последней зафиксированной порции. После
+    каждого этапа продлевает блокировку анализа. Длительность этапа
+    замеряется вокруг его блока кода (stage_timer) и суммируется по
+    порциям части. Между порциями и этапами проверяется запрос отмены:
+    отменённая часть останавливается, сохранив зафиксированные порции.
+    Прочие ошибки не пробрасываются, а возвращаются в результате, чтобы
+    finalize_analysis завершил запуск.
 
     Параметры:
-        - json_parser: Данные для анализа.
-        - json_products: Данные продуктов.
-        - email: Адрес электронной почты для уведомления.
-        - chat_id: Идентификатор чата Telegram.
+        - run_id: Идентификатор запуска анализа (AnalysisRun).
+        - pk_range: Первый и последний первичный ключ части.
     """
+    progress = AnalysisProgress(run_id)
+    should_stop = cancel_checker(run_id)
+    memory = PeakMemory()
+    timings = {}
+
+    def report(stage, count):
+        progress.advance(stage, count)
+        memory.sample()
+        analysis_lock.heartbeat(run_id)
+
+    first_pk, last_pk = pk_range
     try:
-        ml_results = main_function(json_parser, json_products)
-
-        for dealer_product_id, prosept_product_ids in ml_results.items():
-            dealer_product = DealerParsing.objects.get(
-                product_key=dealer_product_id)
-            for prosept_id in prosept_product_ids:
-                prosept_product = Product.objects.get(id_product=prosept_id)
-                MatchingPredictions.objects.create(
-                    dealer_product_id=dealer_product,
-                    prosept_product_id=prosept_product,
-                )
+        checkpoint = last_checkpoint(run_id, pk_range)
+        if checkpoint is not None:
+            logger.info(f'Часть {pk_range} анализа #{run_id} продолжается '
+                        f'после {checkpoint}')
+            first_pk = checkpoint + 1
+        chunks = plan_shards(ANALYSIS_CHECKPOINT_SIZE,
+                             pk_range=(first_pk, last_pk))
+        # Отмена проверяется до загрузки каталога, чтобы отменённая
+        # часть не читала его впустую
+        check_cancelled(should_stop)
+        with stage_timer(timings, 'loading'):
+            products = load_products_frame() if chunks else None
+        for chunk_first, chunk_last, _ in chunks:
+            check_cancelled(should_stop)
+            score_chunk(run_id, (chunk_first, chunk_last), products, report,
+                        should_stop, timings)
+    except AnalysisCancelled:
+        logger.info(f'Часть {pk_range} анализа #{run_id} отменена')
+        cancelled = True
+    except Exception as error:
+        retry_on_db_error(self, error)
+        logger.exception(f'Ошибка в части {pk_range} анализа #{run_id}')
+        return {'error': str(error)}
+    else:
+        logger.info(f'Часть {pk_range} анализа #{run_id} завершена, '
+                    f'кэш лемм: {lemma_cache.stats()}')
+        cancelled = False
+
+    return {'cancelled': cancelled,
+            'stage_timings': timings,
+            'peak_memory_mb': memory.mb()}
+
+
+@app.task
+def finalize_analysis(results, run_id):
+    """
+    Завершает запуск анализа по результатам всех частей и в той же
+    транзакции сохраняет уведомление в outbox.
 
+    Параметры:
+        - results: Результаты задач score_shard.
+        - run_id: Идентификатор запуска анализа (AnalysisRun).
+    """
+    errors = [result['error'] for result in results if 'error' in result]
+    metrics = merge_shard_metrics(
+        [result for result in results if 'error' not in result])
+    # Счётчики берутся из контрольных точек: они учитывают и порции,
+    # зафиксированные до повтора задач
+    metrics.update(AnalysisChunk.objects.filter(run_id=run_id).aggregate(
+        **{field: Coalesce(Sum(field), 0) for field in CHUNK_COUNTERS}))
+
+    if errors:
+        status = AnalysisRun.FAILED
+        message = ('с ошибкой. Передайте в отдел технической поддержки '
+                   f'следующий код ошибки: {errors[0]}')
+    elif any(result.get('cancelled') for result in results):
+        status = AnalysisRun.CANCELLED
+        message = ('досрочно: анализ отменён.\n\nУже рассчитанные '
+                   'предсказания записаны в БД, следующий анализ '
+                   'продолжит с оставшихся товаров.')
+    else:
+        status = AnalysisRun.SUCCESS
         message = ('успешно.\n\nДанные записаны в БД. Чтобы загрузить свежие '
                    'данные выберите тип "Несортированные" и '
                    'нажмите "Загрузить".')
-    except Exception as error:
-        message = ('с ошибкой. Передайте в отдел технической поддержки '
-                   f'следующий код ошибки: {error}')
 
+    with transaction.atomic():
+        AnalysisRun.objects.filter(pk=run_id).update(
+            status=status, finished_at=timezone.now(),
+            error='\n'.join(errors), **metrics)
+        enqueue_notification(AnalysisRun.objects.get(pk=run_id), message)
+        transaction.on_commit(dispatch_notifications.delay)
+    AnalysisProgress(run_id).finish(status)
+    analysis_lock.release(run_id)
+    logger.info(f'Анализ #{run_id}: {metrics}')
     logger.info('Расчёт соответствий завершён ' + message)
+    return metrics
 
-    asyncio.run(send_telegram_message(chat_id, email, message))
+
+@app.task
+def sync_product_index():
+    """
+    Приводит кэш каталога и FAISS индекс продукции в соответствие с БД.
+
+    Запускается после изменения товаров Prosept. Пересчитываются только
+    новые и изменённые товары, удалённые убираются из индекса.
+    """
+    products = load_products_frame()
+    products_final, base_matrix = catalog_cache.load_or_build(
+        products, LEMMA_BATCH_SIZE, LEMMA_N_PROCESS, lemma_cache)
+    lemma_cache.save()
+    return product_index.sync(products_final['id'], base_matrix)
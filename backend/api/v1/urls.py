@@ -4,8 +4,9 @@ from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView,
                                             TokenVerifyView)
 
-from api.v1.views import (AuthViewSet, AnalysisViewSet, PostponeViewSet,
-                          NoMatchesViewSet, MatchingPredictionsViewSet)
+from api.v1.views import (AuthViewSet, AnalysisViewSet, AnalysisRunViewSet,
+                          PostponeViewSet, NoMatchesViewSet,
+                          MatchingPredictionsViewSet)
 from api.v1.views import (DealerViewSet,
                           DealerParsingViewSet,
                           ProductViewSet,
@@ -17,6 +18,7 @@ from users.views import CustomUserViewSet
 router = DefaultRouter()
 
 router.register(r'', AnalysisViewSet, basename='analyze')
+router.register(r'analysis-runs', AnalysisRunViewSet)
 router.register(r'auth', AuthViewSet, basename='auth')
 router.register(r'dealer', DealerViewSet)
 router.register(r'dealer-products', DealerParsingViewSet)
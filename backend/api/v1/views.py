@@ -1,19 +1,17 @@
-import json
 from datetime import datetime
 
-from django.core.serializers import serialize
-from django.db.models import Subquery, OuterRef
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema_view, extend_schema
 from rest_framework import filters
 from rest_framework import viewsets
 from rest_framework.decorators import action
-from rest_framework.mixins import UpdateModelMixin
+from rest_framework.mixins import ListModelMixin, UpdateModelMixin
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_200_OK, HTTP_201_CREATED,
-                                   HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
-                                   HTTP_404_NOT_FOUND,
+                                   HTTP_202_ACCEPTED, HTTP_204_NO_CONTENT,
+                                   HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND,
                                    HTTP_405_METHOD_NOT_ALLOWED)
 
 from api.v1.filters import (DealerParsingFilter,
@@ -25,18 +23,26 @@ from api.v1.filters import (ProductFilter)
 from api.v1.schemas import (LOGOUT_SCHEMA, DEALER_SCHEMA,
                             DEALER_PARSING_SCHEMA, PRODUCT_SCHEMA,
                             POSTPONE_SCHEMA, NO_MATCHES_SCHEMA, MATCH_SCHEMA,
-                            ANALYSIS_SCHEMA, MATCHING_PREDICTIONS_SCHEMA)
+                            ANALYSIS_SCHEMA, MATCHING_PREDICTIONS_SCHEMA,
+                            ANALYSIS_RUN_SCHEMA, STATISTIC_SCHEMA)
+from api.v1.cancellation import request_cancel
+from api.v1.lock import analysis_lock
+from api.v1.progress import AnalysisProgress
 from api.v1.serializers import (DealerSerializer,
                                 DealerParsingSerializer,
                                 ProductSerializer,
                                 MatchSerializer,
                                 DealerParsingPostponeSerializer,
                                 DealerParsingNoMatchesSerializer,
-                                MatchingPredictionsSerializer)
+                                MatchingPredictionsSerializer,
+                                AnalysisRunSerializer,
+                                DealerStatisticSerializer)
+from api.v1.statistics import GROUPINGS, aggregate_statistic
 from api.v1.tasks import make_predictions
-from backend.celery import app
+from core.mixins import QueryPlanMixin
 from core.pagination import CustomPagination
-from products.models import (Dealer, DealerParsing, Product, Match,
+from products.models import (AnalysisRun, Dealer, DealerParsing,
+                             DealerStatistic, Product, Match,
                              MatchingPredictions)
 
 
@@ -83,7 +89,7 @@ class DealerViewSet(viewsets.ReadOnlyModelViewSet):
 
 @extend_schema_view(**DEALER_PARSING_SCHEMA,
                     update=extend_schema(exclude=True))
-class DealerParsingViewSet(viewsets.ModelViewSet):
+class DealerParsingViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     ViewSet для взаимодействия с моделью DealerParsing.
 
@@ -95,10 +101,13 @@ class DealerParsingViewSet(viewsets.ModelViewSet):
         - filter_backends: Список бэкендов фильтрации.
         - filterset_class: Класс фильтра для данных DealerParsing.
         - search_fields: Список полей для поиска.
+        - cursor_ordering: Сортировка для пагинации по ключу
+            (pagination=cursor).
     """
     queryset = DealerParsing.objects.all()
     serializer_class = DealerParsingSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('-date', '-id')
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, ]
     filterset_class = DealerParsingFilter
     search_fields = ['product_name', 'dealer_id__name']
@@ -133,7 +142,8 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 @extend_schema_view(**POSTPONE_SCHEMA, update=extend_schema(exclude=True))
-class PostponeViewSet(viewsets.ReadOnlyModelViewSet, UpdateModelMixin):
+class PostponeViewSet(QueryPlanMixin, viewsets.ReadOnlyModelViewSet,
+                      UpdateModelMixin):
     """
     ViewSet для работы с отложенными элементами DealerParsing.
 
@@ -184,7 +194,7 @@ class PostponeViewSet(viewsets.ReadOnlyModelViewSet, UpdateModelMixin):
         Пример использования:
             GET /api/postpone/
         """
-        queryset = DealerParsing.objects.filter(is_postponed=True)
+        queryset = self.get_queryset().filter(is_postponed=True)
         page = self.paginate_queryset(queryset)
         serializer = self.serializer_class(page, many=True)
         return self.get_paginated_response(serializer.data)
@@ -245,7 +255,8 @@ class PostponeViewSet(viewsets.ReadOnlyModelViewSet, UpdateModelMixin):
 
 
 @extend_schema_view(**NO_MATCHES_SCHEMA, update=extend_schema(exclude=True))
-class NoMatchesViewSet(viewsets.ReadOnlyModelViewSet, UpdateModelMixin):
+class NoMatchesViewSet(QueryPlanMixin, viewsets.ReadOnlyModelViewSet,
+                       UpdateModelMixin):
     """
     ViewSet для работы с элементами DealerParsing, у которых
     нет соответствий.
@@ -299,7 +310,7 @@ class NoMatchesViewSet(viewsets.ReadOnlyModelViewSet, UpdateModelMixin):
         Пример использования:
             GET /no-matches/
         """
-        queryset = DealerParsing.objects.filter(has_no_matches=True)
+        queryset = self.get_queryset().filter(has_no_matches=True)
         page = self.paginate_queryset(queryset)
         serializer = self.serializer_class(page, many=True)
         return self.get_paginated_response(serializer.data)
@@ -360,7 +371,7 @@ class NoMatchesViewSet(viewsets.ReadOnlyModelViewSet, UpdateModelMixin):
 
 
 @extend_schema_view(**MATCH_SCHEMA, update=extend_schema(exclude=True))
-class MatchViewSet(viewsets.ModelViewSet):
+class MatchViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     Вьюсет для работы с мэтчами.
 
@@ -516,7 +527,8 @@ class MatchViewSet(viewsets.ModelViewSet):
 
 
 @extend_schema_view(**MATCHING_PREDICTIONS_SCHEMA)
-class MatchingPredictionsViewSet(viewsets.ReadOnlyModelViewSet):
+class MatchingPredictionsViewSet(QueryPlanMixin,
+                                 viewsets.ReadOnlyModelViewSet):
     """
     Вьюсет для работы с предсказаниями соответствия продуктов.
 
@@ -529,10 +541,13 @@ class MatchingPredictionsViewSet(viewsets.ReadOnlyModelViewSet):
         serializer_class (Type[MatchingPredictionsSerializer]): Класс
             сериализатора MatchingPredictions.
         pagination_class (CustomPagination): Класс пагинации.
+        cursor_ordering (tuple): Сортировка для пагинации по ключу
+            (pagination=cursor).
     """
     queryset = MatchingPredictions.objects.all().order_by('id')
     serializer_class = MatchingPredictionsSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('id',)
     filter_backends = [DjangoFilterBackend, ]
     filterset_class = PredictionsFilter
 
@@ -552,98 +567,159 @@ class AnalysisViewSet(viewsets.ViewSet):
         """
         Метод для анализа данных.
 
+        Одновременно идёт не более одного анализа. Повторный запрос
+        во время анализа не запускает новый, а возвращает id текущего.
+
         Возвращает:
-            - Response: Объект ответа с сообщением о запуске анализа
-                и статусом HTTP_200_OK.
+            - Response: Объект ответа с id запуска, сообщением о запуске
+                анализа и статусом HTTP_200_OK.
         """
-        existing_predictions_subquery = MatchingPredictions.objects.filter(
-            dealer_product_id=OuterRef('product_key')
-        ).values('dealer_product_id')
-
-        dealer_parsing_entries = DealerParsing.objects.filter(
-            is_matched=False
-        ).exclude(
-            product_key__in=Subquery(existing_predictions_subquery)
-        )
-
-        # Достаём данные о продуктах Просепт и дилеров.
-
-        prosept_products_queryset = Product.objects.all()
-
-        serialized_dealer_products = serialize('json',
-                                               dealer_parsing_entries)
-
-        serialized_prosept_products = serialize('json',
-                                                prosept_products_queryset)
-
-        dump_parsing_data = json.loads(serialized_dealer_products)
-        json_prosept_data = json.loads(serialized_prosept_products)
-
-        json_dealer_data = [item['fields'] for item in dump_parsing_data]
-        json_prosept_data = [item['fields'] for item in json_prosept_data]
-
-        # Это нужно для отправки ему сообщения о готовности подбора или
-        # информации об ошибках.
-        dump_parsing_data = json.dumps(json_dealer_data, ensure_ascii=False)
-        json_prosept_data = json.dumps(json_prosept_data, ensure_ascii=False)
+        # Если анализ уже идёт или ждёт в очереди — возвращаем его id.
+        run_id = analysis_lock.holder()
+        if run_id is not None:
+            return Response({'run_id': run_id,
+                             'detail': 'Анализ уже запущен!'},
+                            status=HTTP_200_OK)
 
         # Получаем текущего пользователя
         current_user = request.user
-        email = current_user.email
 
-        # Инициализируем celery.
-        celery_app = app.control.inspect()
-        # Заглядываем в текущую очередь задач.
-        task_list = celery_app.active()
+        with transaction.atomic():
+            # Запоминаем, кого уведомить о готовности подбора или об ошибках.
+            run = AnalysisRun.objects.create(
+                user=current_user,
+                email=current_user.email,
+                chat_id=getattr(current_user, 'telegram_id', None),
+            )
+            if not analysis_lock.acquire(run.id):
+                # Параллельный запрос успел запустить анализ первым.
+                transaction.set_rollback(True)
+                return Response({'run_id': analysis_lock.holder(),
+                                 'detail': 'Анализ уже запущен!'},
+                                status=HTTP_200_OK)
+
+            # Запускаем задачу в фоновом режиме. В celery передаём только id
+            # запуска, данные воркер прочитает из БД сам.
+            def enqueue():
+                try:
+                    make_predictions.delay(run.id)
+                except Exception:
+                    analysis_lock.release(run.id)
+                    raise
+
+            transaction.on_commit(enqueue)
+
+        return Response({'run_id': run.id,
+                         'detail': 'Задача анализа запущена.'},
+                        status=HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='analyze/cancel')
+    def cancel(self, request, *args, **kwargs):
+        """
+        Метод для отмены анализа.
 
-        # Если задача уже запущена — вернём ошибку 400.
-        for task_info in task_list.values():
-            for task in task_info:
-                if 'make_predictions' in task['name']:
-                    return Response('Анализ уже запущен!',
-                                    status=HTTP_400_BAD_REQUEST)
+        Запуск помечается отменённым, воркеры останавливаются после
+        текущего этапа, уже записанные предсказания сохраняются.
+        Блокировка освобождается при завершении запуска, после чего
+        можно запустить новый анализ. По умолчанию отменяется текущий
+        анализ, параметр run_id позволяет выбрать конкретный запуск.
 
-        # Проверим заведён ли у пользователя Telegram ID.
+        Возвращает:
+            - Response: Объект ответа с id запуска и статусом
+                HTTP_202_ACCEPTED или HTTP_404_NOT_FOUND, если активный
+                запуск не найден.
+        """
         try:
-            chat_id = current_user.telegram_id
+            run_id = int(request.data.get('run_id')
+                         or analysis_lock.holder())
+        except (TypeError, ValueError):
+            run_id = None
+        if run_id is None or not request_cancel(run_id):
+            return Response('Активный анализ не найден.',
+                            status=HTTP_404_NOT_FOUND)
+        return Response({'run_id': run_id,
+                         'detail': 'Отмена анализа запрошена.'},
+                        status=HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path='analyze/progress')
+    def progress(self, request, *args, **kwargs):
+        """
+        Метод для получения прогресса анализа.
 
-        except Exception:
-            chat_id = None
+        Состояние читается из кэша, без обращения к таблицам БД.
+        По умолчанию возвращается последний запущенный анализ,
+        параметр run_id позволяет выбрать конкретный запуск.
 
-        # Запускаем задачу в фоновом режиме.
-        # Здесь передаём данные в celery.
-        make_predictions.delay(dump_parsing_data,
-                               json_prosept_data,
-                               email,
-                               chat_id)
+        Возвращает:
+            - Response: Объект ответа с прогрессом по этапам
+                и статусом HTTP_200_OK или HTTP_404_NOT_FOUND,
+                если прогресс запуска не найден.
+        """
+        run_id = request.query_params.get('run_id')
+        progress = (AnalysisProgress(run_id) if run_id
+                    else AnalysisProgress.current())
+        snapshot = progress.snapshot() if progress is not None else None
+        if snapshot is None:
+            return Response('Прогресс анализа не найден.',
+                            status=HTTP_404_NOT_FOUND)
+        return Response(snapshot, status=HTTP_200_OK)
+
+
+@extend_schema_view(**ANALYSIS_RUN_SCHEMA)
+class AnalysisRunViewSet(QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Вьюсет для просмотра истории запусков анализа.
 
-        return Response('Задача анализа запущена.', status=HTTP_200_OK)
+    Attributes:
+        queryset (QuerySet): Запрос для получения всех объектов AnalysisRun.
+        serializer_class (Type[AnalysisRunSerializer]): Класс
+            сериализатора AnalysisRun.
+        pagination_class (CustomPagination): Класс пагинации.
+    """
+    queryset = AnalysisRun.objects.all()
+    serializer_class = AnalysisRunSerializer
+    pagination_class = CustomPagination
+    filter_backends = [DjangoFilterBackend, ]
+    filterset_fields = ('status',)
 
 
-class StatisticViewSet(viewsets.ReadOnlyModelViewSet):
+@extend_schema_view(**STATISTIC_SCHEMA)
+class StatisticViewSet(ListModelMixin, viewsets.GenericViewSet):
     """
     ViewSet для сбора статистики парсинга дилеров.
 
+    Статистика читается из таблицы счётчиков DealerStatistic, которая
+    обновляется при изменении товаров дилеров. Доступен только список:
+    отдельные строки счётчиков через API не отдаются.
+
     Атрибуты:
-        - queryset: Набор данных, предоставляющий все объекты DealerParsing.
+        - queryset: Набор данных, предоставляющий все объекты
+            DealerStatistic.
     """
-    queryset = DealerParsing.objects.all()
-    serializer_class = DealerParsingSerializer
+    queryset = DealerStatistic.objects.all()
+    serializer_class = DealerStatisticSerializer
     filter_backends = [DjangoFilterBackend,]
     filterset_class = StatisticFilter
 
     def list(self, request, *args, **kwargs):
+        """
+        Возвращает количество товаров дилеров: всего, сопоставленных,
+        отложенных и без соответствий.
+
+        Все счётчики суммируются одним запросом по строкам
+        DealerStatistic за период. Параметр group_by=dealer или
+        group_by=day возвращает те же счётчики по дилерам или по дням.
+
+        Возвращает:
+            - Response: Объект ответа со статистикой и статусом
+                HTTP_200_OK или HTTP_400_BAD_REQUEST при неизвестной
+                группировке.
+        """
+        group_by = request.query_params.get('group_by')
+        if group_by is not None and group_by not in GROUPINGS:
+            return Response(
+                {'group_by': f'Допустимые значения: {", ".join(GROUPINGS)}.'},
+                status=HTTP_400_BAD_REQUEST)
         queryset = self.filter_queryset(self.get_queryset())
-        total_records = queryset.count()
-        matching_records = queryset.filter(is_matched=True).count()
-        postponed_records = queryset.filter(is_postponed=True).count()
-        no_matches_records = queryset.filter(has_no_matches=True).count()
-
-        data = {
-            'is_matching': matching_records,
-            'postponed': postponed_records,
-            'has_no_matches': no_matches_records,
-            'total': total_records,
-        }
-
-        return Response(data, status=HTTP_200_OK)
+        return Response(aggregate_statistic(queryset, group_by),
+                        status=HTTP_200_OK)
@@ -1,6 +1,11 @@
+import logging
 import os
 
 from celery import Celery
+from celery.signals import worker_process_init
+from kombu import Queue
+
+from core.constants.analysis import ML_QUEUE, NOTIFICATIONS_QUEUE
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
@@ -9,3 +14,44 @@ app = Celery('celery', broker='redis://redis:6379/0')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+# Анализ и уведомления идут через разные очереди, которые обслуживают
+# отдельные воркеры со своим пулом и параллелизмом (см. run_django.sh):
+# медленный SMTP или Telegram не занимает процесс с моделями spaCy.
+app.conf.task_queues = (Queue(ML_QUEUE), Queue(NOTIFICATIONS_QUEUE))
+app.conf.task_default_queue = ML_QUEUE
+app.conf.task_routes = {
+    'api.v1.tasks.make_predictions': {'queue': ML_QUEUE},
+    'api.v1.tasks.score_shard': {'queue': ML_QUEUE},
+    'api.v1.tasks.finalize_analysis': {'queue': ML_QUEUE},
+    'api.v1.tasks.sync_product_index': {'queue': ML_QUEUE},
+    'api.v1.tasks.dispatch_notifications': {'queue': NOTIFICATIONS_QUEUE},
+}
+# Задачи анализа долгие: воркер не резервирует следующие, пока занят.
+app.conf.worker_prefetch_multiplier = 1
+
+logger = logging.getLogger(__name__)
+
+
+@worker_process_init.connect
+def warm_nlp_models(**kwargs):
+    """
+    Прогревает реестр моделей spaCy в каждом процессе воркера.
+
+    Модели загружаются один раз при старте процесса и переиспользуются
+    всеми задачами анализа, которые этот процесс выполнит. Воркеру
+    уведомлений модели не нужны, поэтому он их не грузит.
+    """
+    if ML_QUEUE not in app.amqp.queues.consume_from:
+        return
+
+    from DS.ds_nlp import nlp_registry
+
+    try:
+        stats = nlp_registry.warm()
+    except OSError as error:
+        # Модель не установлена — задача анализа сообщит об ошибке сама.
+        logger.error(f'Не удалось загрузить модели spaCy: {error}')
+        return
+
+    logger.info(f'Модели spaCy прогреты: {stats}')
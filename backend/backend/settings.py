@@ -2,15 +2,19 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.utils import get_random_secret_key
 from dotenv import load_dotenv
 
+from core.constants.analysis import NOTIFICATION_DISPATCH_INTERVAL
 from core.environment import (SECRET_KEY, DEBUG, ALLOWED_HOSTS,
                               DB_ENGINE, IS_LOGGING,
+                              CACHE_ENGINE, CACHE_LOCATION,
                               EMAIL_HOST_ENV, EMAIL_PORT_ENV,
                               EMAIL_USE_TLS_ENV, EMAIL_USE_SSL_ENV,
                               EMAIL_HOST_USER_ENV, EMAIL_HOST_PASSWORD_ENV,
-                              DEFAULT_FROM_EMAIL_ENV)
+                              DEFAULT_FROM_EMAIL_ENV,
+                              CELERY_RESULT_BACKEND_ENV)
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -106,6 +110,27 @@ if DB_ENGINE == 'postgresql':
         }
     }
 
+# Кэш общий для веб-процессов и воркеров: прогресс анализа, блокировки
+if CACHE_ENGINE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+elif CACHE_ENGINE == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    raise ImproperlyConfigured(
+        f'Неизвестный CACHE_ENGINE: {CACHE_ENGINE!r} (redis или locmem)')
+
+# Тесты запускаются с кэшем в памяти процесса
+TEST_RUNNER = 'core.test_runner.LocMemCacheTestRunner'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -212,3 +237,16 @@ EMAIL_HOST_USER = EMAIL_HOST_USER_ENV
 EMAIL_HOST_PASSWORD = EMAIL_HOST_PASSWORD_ENV
 DEFAULT_FROM_EMAIL = DEFAULT_FROM_EMAIL_ENV
 
+
+# Хранилище результатов задач нужно для chord частей анализа
+CELERY_RESULT_BACKEND = CELERY_RESULT_BACKEND_ENV
+CELERY_RESULT_EXPIRES = timedelta(days=1)
+# Модуль задач лежит вне приложений, autodiscover его не находит
+CELERY_IMPORTS = ('api.v1.tasks',)
+# Повторная доставка отложенных уведомлений из outbox
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-notifications': {
+        'task': 'api.v1.tasks.dispatch_notifications',
+        'schedule': NOTIFICATION_DISPATCH_INTERVAL,
+    },
+}
@@ -0,0 +1,39 @@
+# -------------------------
+#     Analysis константы
+# -------------------------
+
+PREDICTIONS_BATCH_SIZE: int = 5000
+ANALYSIS_CHUNK_SIZE: int = 2000
+ANALYSIS_SHARD_SIZE: int = 5000
+# Товаров дилеров в порции, предсказания которой фиксируются вместе
+# с контрольной точкой
+ANALYSIS_CHECKPOINT_SIZE: int = 1000
+# Повторы задач анализа при временных ошибках БД (сек)
+ANALYSIS_MAX_RETRIES: int = 3
+ANALYSIS_RETRY_BACKOFF: int = 10
+ANALYSIS_RETRY_BACKOFF_MAX: int = 60 * 5
+STATUS_LENGTH: int = 20
+
+# Этапы анализа в порядке выполнения, по ним публикуется прогресс
+ANALYSIS_STAGES: tuple = ('loading', 'normalization', 'lemmatization',
+                          'vectorization', 'search', 'persistence')
+PROGRESS_TIMEOUT: int = 60 * 60 * 24
+# Время жизни блокировки анализа без продления (сек)
+ANALYSIS_LOCK_TTL: int = 60 * 10
+
+# Очереди Celery: тяжёлые задачи анализа и доставка уведомлений
+# обслуживаются разными воркерами
+ML_QUEUE: str = 'ml'
+NOTIFICATIONS_QUEUE: str = 'notifications'
+# Повторы отправки уведомлений: задержка растёт экспоненциально (сек)
+NOTIFICATION_MAX_RETRIES: int = 5
+NOTIFICATION_RETRY_BACKOFF: int = 5
+NOTIFICATION_RETRY_BACKOFF_MAX: int = 60 * 5
+# Отправка уведомлений из outbox: размер пачки, период запуска диспетчера
+# и время жизни его блокировки (сек)
+NOTIFICATION_BATCH_SIZE: int = 50
+NOTIFICATION_DISPATCH_INTERVAL: int = 30
+NOTIFICATION_DISPATCH_LOCK_TTL: int = 60 * 5
+# Как часто воркер проверяет флаг отмены анализа в БД, если его нет
+# в кэше (сек)
+CANCEL_CHECK_INTERVAL: int = 5
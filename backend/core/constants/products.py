@@ -5,3 +5,4 @@
 BIG_INT_VALUE: int = 2560
 EAN_13_INT_VALUE: int = 15
 SMALL_INT_VALUE: int = 256
+FINGERPRINT_LENGTH: int = 40
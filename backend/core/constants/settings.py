@@ -3,3 +3,6 @@
 # -------------------------
 
 PAGINATION_PAGE_SIZE: int = 10
+# При оценке количества строк (count=estimate) результаты меньше этого
+# числа по оценке планировщика пересчитываются точно
+COUNT_ESTIMATE_THRESHOLD: int = 10000
@@ -14,6 +14,8 @@ DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')  # sqlite3 или postgresql
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 IS_LOGGING = os.getenv('IS_LOGGING', 'False') == 'True'
 SECRET_KEY = os.getenv('SECRET_KEY', get_random_secret_key())
+CACHE_ENGINE = os.getenv('CACHE_ENGINE', 'redis')  # redis или locmem
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', 'redis://redis:6379/2')
 
 ################################################
 #               Settings - Email
@@ -32,3 +34,24 @@ DEFAULT_FROM_EMAIL_ENV = os.getenv('DEFAULT_FROM_EMAIL')
 ################################################
 
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+CELERY_RESULT_BACKEND_ENV = os.getenv('CELERY_RESULT_BACKEND',
+                                      'redis://redis:6379/1')
+
+################################################
+#               DS
+################################################
+
+LEMMA_BATCH_SIZE = int(os.getenv('LEMMA_BATCH_SIZE', 1000))
+# Процессы spaCy порождаются только вне воркеров Celery: дочерние процессы
+# prefork пула демонические, в них лемматизация всегда идет в одном процессе
+LEMMA_N_PROCESS = int(os.getenv('LEMMA_N_PROCESS', 1))
+LEMMA_CACHE_SIZE = int(os.getenv('LEMMA_CACHE_SIZE', 100000))
+LEMMA_CACHE_PATH = os.getenv('LEMMA_CACHE_PATH', 'DS/cache/lemma_cache.pkl')
+CATALOG_CACHE_PATH = os.getenv('CATALOG_CACHE_PATH', 'DS/cache/catalog.pkl')
+PRODUCT_INDEX_PATH = os.getenv('PRODUCT_INDEX_PATH',
+                               'DS/cache/products.faiss')
+PRODUCT_INDEX_SYNC_DELAY = int(os.getenv('PRODUCT_INDEX_SYNC_DELAY', 30))
+NEIGHBORS_BACKEND = os.getenv('NEIGHBORS_BACKEND', 'faiss')  # faiss или sparse
+PRODUCT_INDEX_KIND = os.getenv('PRODUCT_INDEX_KIND', 'flat')  # flat, ivf, hnsw
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', 8))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 64))
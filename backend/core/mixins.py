@@ -0,0 +1,50 @@
+from rest_framework.serializers import ALL_FIELDS
+
+
+def plan_queryset(queryset, serializer_class, restrict_fields=True):
+    """
+    Дополняет запрос связями и полями, которые объявил сериализатор.
+
+    Атрибуты сериализатора:
+        - select_related_fields: Связи, которые читаются при
+        сериализации, загружаются тем же запросом (select_related).
+        - only_fields: Поля, которые сериализатор читает сверх
+        Meta.fields (в том числе поля связей через '__'). Если атрибут
+        задан, загружаются только поля модели из Meta.fields и эти поля
+        (only), иначе - все поля.
+
+    Параметры:
+        - queryset: Исходный запрос.
+        - serializer_class: Класс сериализатора.
+        - restrict_fields: Применять ли only().
+    """
+    related = getattr(serializer_class, 'select_related_fields', ())
+    if related:
+        queryset = queryset.select_related(*related)
+    extra = getattr(serializer_class, 'only_fields', None)
+    if not restrict_fields or extra is None:
+        return queryset
+    model = queryset.model
+    concrete = [field.name for field in model._meta.concrete_fields]
+    fields = serializer_class.Meta.fields
+    if fields == ALL_FIELDS:
+        fields = concrete
+    own = [name for name in fields if name in concrete]
+    return queryset.only(*own, *extra)
+
+
+class QueryPlanMixin:
+    """
+    Миксин вьюсета, который строит запрос по объявлениям сериализатора
+    (см. plan_queryset).
+
+    Связи подгружаются для всех действий, а ограничение полей
+    применяется только к списку: объекты, которые потом сохраняются,
+    загружаются целиком. Благодаря этому страница любого размера
+    выбирается постоянным числом запросов.
+    """
+
+    def get_queryset(self):
+        return plan_queryset(super().get_queryset(),
+                             self.get_serializer_class(),
+                             restrict_fields=self.action == 'list')
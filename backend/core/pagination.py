@@ -1,16 +1,224 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from functools import partial
 
-from core.constants.settings import PAGINATION_PAGE_SIZE
+from django.core.paginator import Paginator as DjangoPaginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.constants.settings import (COUNT_ESTIMATE_THRESHOLD,
+                                     PAGINATION_PAGE_SIZE)
+
+
+def planner_rows(queryset):
+    """
+    Возвращает оценку количества строк запроса планировщиком PostgreSQL
+    (EXPLAIN): по статистике таблиц (pg_class.reltuples) с учётом
+    селективности фильтров, без чтения самих строк.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate_count(queryset, threshold=COUNT_ESTIMATE_THRESHOLD):
+    """
+    Возвращает количество строк запроса и признак приближённости.
+
+    На PostgreSQL большие результаты (от threshold строк по оценке
+    планировщика) не пересчитываются: возвращается оценка. Маленькие
+    результаты и запросы к остальным СУБД (SQLite) считаются точно.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count(), False
+    rows = planner_rows(queryset.order_by())
+    if rows < threshold:
+        return queryset.count(), False
+    return rows, True
+
+
+class EstimatedCountPaginator(DjangoPaginator):
+    """
+    Пагинатор, который по запросу оценивает количество строк
+    (estimate_count) вместо точного COUNT(*).
+    """
+
+    def __init__(self, *args, estimate=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimate = estimate
+        self.count_is_approximate = False
+
+    @cached_property
+    def count(self):
+        if not self.estimate or not hasattr(self.object_list, 'query'):
+            return super().count
+        count, self.count_is_approximate = estimate_count(self.object_list)
+        return count
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу (keyset) для API.
+
+    Страница выбирается условием на значения полей сортировки последней
+    (первой) строки предыдущей страницы, а не OFFSET, и без COUNT(*),
+    поэтому любая страница читает не больше page_size + 1 строк по
+    индексу. Поля сортировки берутся из атрибута вьюсета
+    cursor_ordering и должны однозначно задавать порядок (последним
+    полем - первичный ключ).
+
+    Опции пагинации:
+        - cursor_query_param (str): Параметр запроса с курсором.
+        - page_size_query_param (str): Параметр запроса для указания
+        количества элементов на странице.
+        - page_size (int): Количество элементов на странице по умолчанию.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = PAGINATION_PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(view.cursor_ordering)
+        self.page_size = self.get_page_size(request)
+        position, self.reverse = self.decode_cursor(request)
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """
+        Возвращает условие "строка идёт после position" для сортировки
+        ordering: (a, b) > (x, y) раскрывается в a > x OR (a = x AND b > y).
+
+        Условие a >= x на первое поле позволяет читать составной индекс
+        диапазоном.
+        """
+        lookups = [(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt')
+                   for field in ordering]
+        name, lookup = lookups[0]
+        condition = Q(**{f'{name}__{lookup}e': position[0]})
+        tie = Q()
+        after = Q()
+        for (name, lookup), value in zip(lookups, position):
+            after |= tie & Q(**{f'{name}__{lookup}': value})
+            tie &= Q(**{name: value})
+        return condition & after
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or (
+                len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, instance, reverse):
+        position = [getattr(instance, field.lstrip('-'))
+                    for field in self.ordering]
+        cursor = json.dumps({'p': position, 'r': int(reverse)},
+                            cls=DjangoJSONEncoder)
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param,
+            base64.urlsafe_b64encode(cursor.encode()).decode())
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(),
+                                      self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True,
+                         'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True,
+                             'format': 'uri'},
+                'results': schema,
+            },
+        }
 
 
 class CustomPagination(PageNumberPagination):
     """
     Пользовательская пагинация для API.
 
+    Если вьюсет объявляет cursor_ordering, запрос с параметром
+    pagination=cursor постранично читается по ключу (KeysetPagination):
+    без подсчёта строк и OFFSET. Остальные запросы используют номера
+    страниц. С параметром count=estimate количество строк большого
+    результата оценивается планировщиком (EstimatedCountPaginator),
+    признак count_is_approximate в ответе сообщает, что count
+    приближённый.
+
     Опции пагинации:
         - page_size_query_param (str): Параметр запроса для указания
         количества элементов на странице.
         - page_size (int): Количество элементов на странице по умолчанию.
+        - pagination_query_param (str): Параметр запроса для выбора
+        пагинации по ключу.
+        - count_query_param (str): Параметр запроса для выбора оценки
+        количества строк.
 
     Константы:
         - PAGINATION_PAGE_SIZE (int): Количество элементов на странице
@@ -24,3 +232,70 @@ class CustomPagination(PageNumberPagination):
     """
     page_size_query_param = 'limit'
     page_size = PAGINATION_PAGE_SIZE
+    pagination_query_param = 'pagination'
+    count_query_param = 'count'
+    keyset_pagination_class = KeysetPagination
+    keyset = None
+    estimate = False
+
+    @property
+    def django_paginator_class(self):
+        return partial(EstimatedCountPaginator, estimate=self.estimate)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.estimate = (
+            request.query_params.get(self.count_query_param) == 'estimate')
+        if (request.query_params.get(self.pagination_query_param) == 'cursor'
+                and getattr(view, 'cursor_ordering', None)):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_approximate': self.page.paginator.count_is_approximate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_approximate'] = {
+            'type': 'boolean',
+            'example': False,
+        }
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view) + [{
+            'name': self.count_query_param,
+            'required': False,
+            'in': 'query',
+            'description': ('estimate - оценивать количество строк '
+                            'большого результата вместо точного подсчёта.'),
+            'schema': {'type': 'string', 'enum': ['estimate']},
+        }]
+        if not getattr(view, 'cursor_ordering', None):
+            return parameters
+        return parameters + [
+            {
+                'name': self.pagination_query_param,
+                'required': False,
+                'in': 'query',
+                'description': ('cursor - пагинация по ключу: без count и '
+                                'номеров страниц, переход по ссылкам '
+                                'next и previous.'),
+                'schema': {'type': 'string', 'enum': ['cursor']},
+            },
+            {
+                'name': KeysetPagination.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы при pagination=cursor.',
+                'schema': {'type': 'string'},
+            },
+        ]
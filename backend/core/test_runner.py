@@ -0,0 +1,28 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Кэш тестов: процесс-локальный, без Redis
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class LocMemCacheTestRunner(DiscoverRunner):
+    """
+    Запускает тесты с кэшем в памяти процесса (LocMemCache).
+
+    Рабочий кэш по умолчанию - Redis (CACHE_ENGINE=redis), тестам он
+    не нужен: настройка CACHES подменяется на время прогона через
+    override_settings.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.caches_override = override_settings(CACHES=TEST_CACHES)
+        self.caches_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches_override.disable()
+        super().teardown_test_environment(**kwargs)
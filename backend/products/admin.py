@@ -1,8 +1,9 @@
 from django.contrib import admin
 from import_export.admin import ImportExportModelAdmin
 
-from products.models import (Dealer, DealerParsing, Product,
-                             Match, MatchingPredictions)
+from products.models import (AnalysisRun, Dealer, DealerParsing,
+                             DealerStatistic, Product,
+                             Match, MatchingPredictions, Notification)
 
 
 class DealerAdmin(ImportExportModelAdmin):
@@ -39,6 +40,7 @@ class DealerParsingAdmin(ImportExportModelAdmin):
         'postpone_date',
         'matching_date',
         'has_no_matches_toggle_date',
+        'analyzed_at',
     )
 
 
@@ -97,8 +99,81 @@ class MatchingPredictionsAdmin(admin.ModelAdmin):
     )
 
 
+class AnalysisRunAdmin(admin.ModelAdmin):
+    """
+    Admin класс для модели AnalysisRun.
+
+    Атрибуты:
+        - list_display: Список полей для отображения в списке объектов.
+    """
+    list_display = (
+        'id',
+        'user',
+        'status',
+        'created_at',
+        'started_at',
+        'finished_at',
+        'dealer_rows',
+        'fast_path_rows',
+        'predictions_written',
+        'peak_memory_mb',
+    )
+
+
+class NotificationAdmin(admin.ModelAdmin):
+    """
+    Admin класс для модели Notification.
+
+    Атрибуты:
+        - list_display: Список полей для отображения в списке объектов.
+        - list_filter: Поля для фильтрации списка объектов.
+    """
+    list_display = (
+        'id',
+        'run',
+        'channel',
+        'status',
+        'attempts',
+        'next_attempt_at',
+        'created_at',
+        'sent_at',
+    )
+    list_filter = ('status', 'channel')
+
+
+class DealerStatisticAdmin(admin.ModelAdmin):
+    """
+    Admin класс для модели DealerStatistic.
+
+    Счётчики меняются только при изменении товаров дилеров и командой
+    rebuild_statistics, поэтому в админке доступны только для чтения.
+
+    Атрибуты:
+        - list_display: Список полей для отображения в списке объектов.
+        - list_filter: Список полей для фильтрации объектов.
+    """
+    list_display = (
+        'date',
+        'dealer',
+        'total',
+        'matched',
+        'postponed',
+        'no_matches',
+    )
+    list_filter = ('date',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Dealer, DealerAdmin)
 admin.site.register(DealerParsing, DealerParsingAdmin)
+admin.site.register(DealerStatistic, DealerStatisticAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Match, MatchAdmin)
 admin.site.register(MatchingPredictions, MatchingPredictionsAdmin)
+admin.site.register(AnalysisRun, AnalysisRunAdmin)
+admin.site.register(Notification, NotificationAdmin)
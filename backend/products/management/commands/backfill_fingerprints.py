@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.v1.analysis import backfill_fingerprints
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает отпечатки данных товаров дилеров, изменённых '
+            'в обход save().')
+
+    def handle(self, *args, **options):
+        rows = backfill_fingerprints()
+        self.stdout.write(self.style.SUCCESS(
+            f'Отпечатки пересчитаны: {rows} строк.'))
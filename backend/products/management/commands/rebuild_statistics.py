@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.v1.statistics import rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику товаров дилеров (DealerStatistic).'
+
+    def handle(self, *args, **options):
+        rows = rebuild_statistics()
+        self.stdout.write(self.style.SUCCESS(
+            f'Статистика пересчитана: {rows} строк.'))
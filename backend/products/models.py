@@ -1,7 +1,13 @@
-from django.db import models
+import hashlib
 
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from core.constants.analysis import STATUS_LENGTH
 from core.constants.products import (BIG_INT_VALUE,
                                      EAN_13_INT_VALUE,
+                                     FINGERPRINT_LENGTH,
                                      SMALL_INT_VALUE)
 
 
@@ -57,6 +63,11 @@ class DealerParsing(models.Model):
         postpone_date (datetime): Дата отложенного соответствия.
         has_no_matches (bool): Флаг, указывающий на отсутствие соответствий.
         has_no_matches_toggle_date (datetime): Дата отсутствия соответствия.
+        fingerprint (str): Отпечаток данных товара, по которым строятся
+        предсказания (название и цена).
+        analyzed_fingerprint (str): Отпечаток данных на момент последнего
+        анализа.
+        analyzed_at (datetime): Дата и время последнего анализа.
 
     Meta:
         verbose_name (str): Отображаемое имя в админке для одного объекта.
@@ -117,15 +128,119 @@ class DealerParsing(models.Model):
         null=True,
         blank=True
     )
+    fingerprint = models.CharField(
+        verbose_name='Отпечаток данных',
+        max_length=FINGERPRINT_LENGTH,
+        blank=True,
+        editable=False,
+    )
+    analyzed_fingerprint = models.CharField(
+        verbose_name='Отпечаток данных при последнем анализе',
+        max_length=FINGERPRINT_LENGTH,
+        blank=True,
+        editable=False,
+    )
+    analyzed_at = models.DateTimeField(
+        verbose_name='Дата последнего анализа',
+        null=True,
+        blank=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Товар дилера'
         verbose_name_plural = 'Товары дилеров'
         ordering = ('-date',)
+        indexes = (
+            # Пагинация по ключу (-date, -id) списка товаров дилеров
+            models.Index(fields=('-date', '-id'),
+                         name='dealer_parsing_date_id_idx'),
+        )
 
     def __str__(self) -> str:
         return self.product_name
 
+    @staticmethod
+    def make_fingerprint(product_name, price) -> str:
+        """
+        Возвращает отпечаток данных товара, влияющих на предсказания.
+        """
+        content = f'{product_name}\x1f{price}'.encode()
+        return hashlib.sha1(content).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.make_fingerprint(self.product_name,
+                                                 self.price)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'fingerprint'}
+        # Статистика (DealerStatistic) обновляется сигналами в той же
+        # транзакции, что и сам товар.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class DealerStatistic(models.Model):
+    """
+    Модель, представляющая счётчики товаров дилера за день.
+
+    Счётчики обновляются при каждом сохранении и удалении товара дилера
+    (products.signals), поэтому статистика за период суммирует несколько
+    строк этой таблицы вместо подсчёта всех товаров. Изменения в обход
+    save() (bulk_update, update()) не учитываются, для восстановления
+    используется команда rebuild_statistics.
+
+    Attributes:
+        date (date): Дата получения информации.
+        dealer (Dealer): Дилер.
+        total (int): Количество товаров.
+        matched (int): Количество сопоставленных товаров.
+        postponed (int): Количество отложенных товаров.
+        no_matches (int): Количество товаров без соответствий.
+
+    Meta:
+        verbose_name (str): Отображаемое имя в админке для одного объекта.
+        verbose_name_plural (str): Отображаемое имя в админке для
+        нескольких объектов.
+    """
+    date = models.DateField(
+        verbose_name='Дата получения информации',
+    )
+    dealer = models.ForeignKey(
+        Dealer,
+        verbose_name='Дилер',
+        related_name='statistics',
+        on_delete=models.CASCADE,
+    )
+    total = models.IntegerField(
+        verbose_name='Товаров',
+        default=0,
+    )
+    matched = models.IntegerField(
+        verbose_name='Сопоставлено',
+        default=0,
+    )
+    postponed = models.IntegerField(
+        verbose_name='Отложено',
+        default=0,
+    )
+    no_matches = models.IntegerField(
+        verbose_name='Нет совпадений',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Статистика дилера'
+        verbose_name_plural = 'Статистика дилеров'
+        ordering = ('-date', 'dealer')
+        constraints = (
+            models.UniqueConstraint(fields=('date', 'dealer'),
+                                    name='unique_dealer_statistic'),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.dealer_id} за {self.date}: {self.total}'
+
 
 class Product(models.Model):
     """
@@ -330,3 +445,349 @@ class MatchingPredictions(models.Model):
 
     def __str__(self) -> str:
         return f'{self.prosept_product_id} ->  {self.dealer_product_id}'
+
+
+class AnalysisRun(models.Model):
+    """
+    Модель, представляющая запуск анализа соответствий.
+
+    В очередь Celery передаётся только id запуска, данные для анализа
+    воркер читает из БД сам.
+
+    Attributes:
+        user (User): Пользователь, запустивший анализ.
+        email (str): Адрес для уведомления о результате.
+        chat_id (int): Telegram id для уведомления о результате.
+        status (str): Состояние запуска.
+        created_at (datetime): Дата и время создания запуска.
+        started_at (datetime): Дата и время начала расчёта.
+        finished_at (datetime): Дата и время окончания расчёта.
+        dispatched_at (datetime): Дата и время запуска частей анализа,
+        повторно доставленная задача по нему не запускает их ещё раз.
+        error (str): Текст ошибки, если расчёт завершился неудачно.
+        cancel_requested (bool): Пользователь запросил отмену анализа.
+        shards (int): Количество частей, на которые разделён анализ.
+        dealer_rows (int): Количество проанализированных товаров дилеров.
+        product_rows (int): Количество товаров Prosept в каталоге.
+        fast_path_rows (int): Товары дилеров, найденные по артикулу без
+        TF-IDF поиска.
+        predictions_written (int): Количество записанных предсказаний.
+        predictions_replaced (int): Количество заменённых предсказаний.
+        stage_timings (dict): Длительность этапов анализа (сек), сумма
+        по всем частям - суммарная работа воркеров.
+        stage_timings_max (dict): Длительность этапов анализа (сек) в самой
+        долгой части: части считаются параллельно, поэтому ближе
+        к реальному времени этапа.
+        peak_memory_mb (float): Пиковое потребление памяти процессом
+        воркера за этот запуск (МБ), максимум по частям анализа.
+
+    Meta:
+        verbose_name (str): Отображаемое имя в админке для одного объекта.
+        verbose_name_plural (str): Отображаемое имя в админке для
+        нескольких объектов.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (SUCCESS, 'Завершён'),
+        (FAILED, 'Ошибка'),
+        (CANCELLED, 'Отменён'),
+    )
+    # Состояния запуска, который ещё можно отменить
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name='Пользователь',
+        related_name='analysis_runs',
+        null=True,
+        on_delete=models.SET_NULL,
+    )
+    email = models.EmailField(
+        verbose_name='Адрес для уведомления',
+        blank=True,
+    )
+    chat_id = models.BigIntegerField(
+        verbose_name='Telegram id для уведомления',
+        null=True,
+        blank=True,
+    )
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=STATUS_LENGTH,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата создания',
+        auto_now_add=True,
+    )
+    started_at = models.DateTimeField(
+        verbose_name='Начало расчёта',
+        null=True,
+        blank=True,
+    )
+    finished_at = models.DateTimeField(
+        verbose_name='Окончание расчёта',
+        null=True,
+        blank=True,
+    )
+    dispatched_at = models.DateTimeField(
+        verbose_name='Запуск частей анализа',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    error = models.TextField(
+        verbose_name='Ошибка',
+        blank=True,
+    )
+    cancel_requested = models.BooleanField(
+        verbose_name='Запрошена отмена',
+        default=False,
+    )
+    shards = models.PositiveIntegerField(
+        verbose_name='Количество частей',
+        default=0,
+    )
+    dealer_rows = models.PositiveIntegerField(
+        verbose_name='Товаров дилеров',
+        default=0,
+    )
+    product_rows = models.PositiveIntegerField(
+        verbose_name='Товаров Prosept',
+        default=0,
+    )
+    fast_path_rows = models.PositiveIntegerField(
+        verbose_name='Найдено по артикулу',
+        default=0,
+    )
+    predictions_written = models.PositiveIntegerField(
+        verbose_name='Записано предсказаний',
+        default=0,
+    )
+    predictions_replaced = models.PositiveIntegerField(
+        verbose_name='Заменено предсказаний',
+        default=0,
+    )
+    stage_timings = models.JSONField(
+        verbose_name='Длительность этапов, сумма по частям (сек)',
+        default=dict,
+        blank=True,
+    )
+    stage_timings_max = models.JSONField(
+        verbose_name='Длительность этапов, максимум по частям (сек)',
+        default=dict,
+        blank=True,
+    )
+    peak_memory_mb = models.FloatField(
+        verbose_name='Пик памяти воркера за запуск (МБ)',
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = 'Запуск анализа'
+        verbose_name_plural = 'Запуски анализа'
+        ordering = ('-id',)
+
+    def __str__(self) -> str:
+        return f'Анализ #{self.pk} ({self.status})'
+
+    @property
+    def duration(self):
+        """
+        Возвращает длительность расчёта в секундах или None.
+        """
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+
+class AnalysisChunk(models.Model):
+    """
+    Модель, представляющая завершённую порцию анализа (контрольную точку).
+
+    Создаётся в одной транзакции с предсказаниями порции, поэтому
+    повтор части анализа продолжает работу после последней
+    зафиксированной порции, а не начинает её заново.
+
+    Attributes:
+        run (AnalysisRun): Запуск анализа.
+        first_pk (int): Первый первичный ключ товара дилера в порции.
+        last_pk (int): Последний первичный ключ товара дилера в порции.
+        dealer_rows (int): Количество проанализированных товаров дилеров.
+        fast_path_rows (int): Товары дилеров, найденные по артикулу без
+        TF-IDF поиска.
+        predictions_written (int): Количество записанных предсказаний.
+        predictions_replaced (int): Количество заменённых предсказаний.
+        created_at (datetime): Дата и время фиксации порции.
+
+    Meta:
+        verbose_name (str): Отображаемое имя в админке для одного объекта.
+        verbose_name_plural (str): Отображаемое имя в админке для
+        нескольких объектов.
+    """
+    run = models.ForeignKey(
+        AnalysisRun,
+        verbose_name='Запуск анализа',
+        related_name='chunks',
+        on_delete=models.CASCADE,
+    )
+    first_pk = models.PositiveBigIntegerField(
+        verbose_name='Первый товар дилера',
+    )
+    last_pk = models.PositiveBigIntegerField(
+        verbose_name='Последний товар дилера',
+    )
+    dealer_rows = models.PositiveIntegerField(
+        verbose_name='Товаров дилеров',
+        default=0,
+    )
+    fast_path_rows = models.PositiveIntegerField(
+        verbose_name='Найдено по артикулу',
+        default=0,
+    )
+    predictions_written = models.PositiveIntegerField(
+        verbose_name='Записано предсказаний',
+        default=0,
+    )
+    predictions_replaced = models.PositiveIntegerField(
+        verbose_name='Заменено предсказаний',
+        default=0,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата фиксации',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = 'Порция анализа'
+        verbose_name_plural = 'Порции анализа'
+        ordering = ('run', 'first_pk')
+        constraints = (
+            models.UniqueConstraint(fields=('run', 'first_pk'),
+                                    name='unique_analysis_chunk'),
+        )
+
+    def __str__(self) -> str:
+        return f'Анализ #{self.run_id}: {self.first_pk}-{self.last_pk}'
+
+
+class Notification(models.Model):
+    """
+    Модель, представляющая уведомление в очереди отправки (outbox).
+
+    Уведомление сохраняется в одной транзакции с результатом анализа,
+    а доставляет его задача dispatch_notifications пачками. Сначала
+    используется Telegram, при постоянной ошибке или после исчерпания
+    повторов - электронная почта.
+
+    Attributes:
+        run (AnalysisRun): Запуск анализа, о котором уведомление.
+        chat_id (int): Telegram id получателя.
+        email (str): Адрес электронной почты получателя.
+        message (str): Текст уведомления.
+        channel (str): Канал, через который будет следующая попытка.
+        status (str): Состояние доставки.
+        attempts (int): Количество неудачных попыток в текущем канале.
+        next_attempt_at (datetime): Время, раньше которого попытка
+        не выполняется.
+        last_error (str): Текст последней ошибки доставки.
+        created_at (datetime): Дата и время создания уведомления.
+        sent_at (datetime): Дата и время доставки.
+
+    Meta:
+        verbose_name (str): Отображаемое имя в админке для одного объекта.
+        verbose_name_plural (str): Отображаемое имя в админке для
+        нескольких объектов.
+    """
+    TELEGRAM = 'telegram'
+    EMAIL = 'email'
+
+    CHANNELS = (
+        (TELEGRAM, 'Telegram'),
+        (EMAIL, 'Электронная почта'),
+    )
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUSES = (
+        (PENDING, 'Ожидает отправки'),
+        (SENT, 'Доставлено'),
+        (FAILED, 'Не доставлено'),
+    )
+
+    run = models.ForeignKey(
+        AnalysisRun,
+        verbose_name='Запуск анализа',
+        related_name='notifications',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+    )
+    chat_id = models.BigIntegerField(
+        verbose_name='Telegram id',
+        null=True,
+        blank=True,
+    )
+    email = models.EmailField(
+        verbose_name='Адрес электронной почты',
+        blank=True,
+    )
+    message = models.TextField(
+        verbose_name='Текст уведомления',
+    )
+    channel = models.CharField(
+        verbose_name='Канал',
+        max_length=STATUS_LENGTH,
+        choices=CHANNELS,
+        default=TELEGRAM,
+    )
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=STATUS_LENGTH,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Неудачных попыток',
+        default=0,
+    )
+    next_attempt_at = models.DateTimeField(
+        verbose_name='Следующая попытка',
+        default=timezone.now,
+    )
+    last_error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата создания',
+        auto_now_add=True,
+    )
+    sent_at = models.DateTimeField(
+        verbose_name='Дата доставки',
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = 'Уведомление'
+        verbose_name_plural = 'Уведомления'
+        ordering = ('-id',)
+        indexes = (
+            models.Index(fields=('status', 'next_attempt_at'),
+                         name='notification_pending_idx'),
+        )
+
+    def __str__(self) -> str:
+        return f'Уведомление #{self.pk} ({self.channel}, {self.status})'
@@ -0,0 +1,123 @@
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.environment import PRODUCT_INDEX_SYNC_DELAY
+from products.models import DealerParsing, DealerStatistic, Product
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_INDEX_SYNC_KEY = 'product_index_sync_scheduled'
+# Поля товара дилера, от которых зависит статистика DealerStatistic
+STATISTIC_FIELDS = ('date', 'dealer_id', 'is_matched', 'is_postponed',
+                    'has_no_matches')
+
+
+def schedule_product_index_sync():
+    """
+    Ставит в очередь синхронизацию индекса продукции.
+
+    Серия изменений (например импорт каталога) схлопывается в одну задачу:
+    пока отложенная задача не запущена, новые не ставятся.
+    """
+    if not cache.add(PRODUCT_INDEX_SYNC_KEY, True,
+                     timeout=PRODUCT_INDEX_SYNC_DELAY):
+        return
+
+    from api.v1.tasks import sync_product_index
+
+    try:
+        sync_product_index.apply_async(countdown=PRODUCT_INDEX_SYNC_DELAY)
+    except Exception as error:
+        # Индекс всё равно синхронизируется перед следующим анализом.
+        cache.delete(PRODUCT_INDEX_SYNC_KEY)
+        logger.warning(f'Синхронизация индекса продукции не запущена: {error}')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    """
+    Запускает синхронизацию индекса после фиксации изменения товара.
+    """
+    transaction.on_commit(schedule_product_index_sync)
+
+
+def affects_statistic(update_fields):
+    return update_fields is None or bool(set(update_fields)
+                                         & set(STATISTIC_FIELDS))
+
+
+def statistic_state(instance):
+    return (instance.date, instance.dealer_id_id, instance.is_matched,
+            instance.is_postponed, instance.has_no_matches)
+
+
+def apply_statistic_delta(previous, current):
+    """
+    Переносит товар дилера в статистике из состояния previous
+    в состояние current.
+
+    Состояние - кортеж значений STATISTIC_FIELDS, None - товара нет.
+    Счётчики меняются через F(), поэтому одновременные изменения разных
+    товаров не теряются. Строка статистики создаётся только при
+    увеличении счётчиков.
+    """
+    deltas = {}
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is None:
+            continue
+        date, dealer, matched, postponed, no_matches = state
+        counters = deltas.setdefault((str(date), dealer), {
+            'total': 0, 'matched': 0, 'postponed': 0, 'no_matches': 0})
+        counters['total'] += sign
+        counters['matched'] += sign * matched
+        counters['postponed'] += sign * postponed
+        counters['no_matches'] += sign * no_matches
+    for (date, dealer), counters in deltas.items():
+        changes = {name: F(name) + value
+                   for name, value in counters.items() if value}
+        if not changes:
+            continue
+        rows = DealerStatistic.objects.filter(date=date, dealer_id=dealer)
+        if not rows.update(**changes) and counters['total'] > 0:
+            DealerStatistic.objects.get_or_create(date=date, dealer_id=dealer)
+            rows.update(**changes)
+
+
+@receiver(pre_save, sender=DealerParsing)
+def remember_statistic_state(sender, instance, update_fields=None, **kwargs):
+    """
+    Запоминает состояние товара в БД до сохранения.
+
+    Строка блокируется до конца транзакции сохранения, чтобы
+    одновременные изменения одного товара учитывались по очереди.
+    """
+    instance._statistic_state = None
+    if instance.pk is None or not affects_statistic(update_fields):
+        return
+    instance._statistic_state = (DealerParsing.objects.select_for_update()
+                                 .filter(pk=instance.pk)
+                                 .values_list(*STATISTIC_FIELDS).first())
+
+
+@receiver(post_save, sender=DealerParsing)
+def dealer_product_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Обновляет статистику после сохранения товара дилера.
+    """
+    previous = instance.__dict__.pop('_statistic_state', None)
+    if affects_statistic(update_fields):
+        apply_statistic_delta(previous, statistic_state(instance))
+
+
+@receiver(post_delete, sender=DealerParsing)
+def dealer_product_deleted(sender, instance, **kwargs):
+    """
+    Обновляет статистику после удаления товара дилера.
+    """
+    apply_statistic_delta(statistic_state(instance), None)
@@ -0,0 +1,59 @@
+import pandas as pd
+import spacy
+from spacy.language import Language
+
+from DS.ds_nlp import NLPModelRegistry
+
+
+@Language.component('test_suffix_lemmatizer')
+def suffix_lemmatizer(doc):
+    """Fake lemmatizer: lowercase and drop the trailing vowel."""
+    for token in doc:
+        token.lemma_ = token.lower_.rstrip('аеиоуыяaeiou') or token.lower_
+    return doc
+
+
+def fake_pipelines():
+    """Return blank en/ru pipelines with the fake lemmatizer."""
+    pipelines = []
+    for lang in ('en', 'ru'):
+        nlp = spacy.blank(lang)
+        nlp.add_pipe('test_suffix_lemmatizer')
+        pipelines.append(nlp)
+    return pipelines
+
+
+def fake_registry():
+    """Return NLP registry serving the fake pipelines."""
+    pipelines = dict(zip(('en', 'ru'), fake_pipelines()))
+    return NLPModelRegistry(loader=lambda name: pipelines[name[:2]])
+
+
+PRODUCT_NAMES = [
+    ('008-1', 'Средство для мытья полов Multipower Floor 1 л'),
+    ('002-5', 'Антисептик для дерева ECO 50 готовый состав 5 л'),
+    ('018-10', 'Огнебиозащита 1 группа красная 10 кг'),
+    ('0031-1', 'Очиститель фасадов Fasad Cleaner 1 л'),
+    ('029-5', 'Гель для стирки Crystal универсальный 5 л'),
+    ('023-05', 'Средство для удаления ржавчины 0,5 л'),
+]
+
+
+def make_products(names=PRODUCT_NAMES):
+    """Return products frame shaped like json_reading output."""
+    return pd.DataFrame([{
+        'id': 100 + number,
+        'article': article,
+        'ean_13': None,
+        'name': name,
+        'cost': '100',
+        'recommended_price': '200',
+        'category_id': None,
+        'ozon_name': f'{name} PROSEPT',
+        'name_1c': name,
+        'wb_name': None,
+        'ozon_article': None,
+        'wb_article': None,
+        'ym_article': None,
+        'wb_article_td': None,
+    } for number, (article, name) in enumerate(names)])
@@ -0,0 +1,523 @@
+import datetime
+import resource
+from io import StringIO
+from smtplib import SMTPRecipientsRefused
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from telegram.error import BadRequest, TimedOut
+
+from api.v1.analysis import (backfill_fingerprints, load_dealer_products_frame,
+                             load_products_frame, pending_dealer_products,
+                             plan_shards, save_predictions)
+from api.v1.cancellation import request_cancel
+from api.v1.lock import (COMPARE_AND_DELETE, COMPARE_AND_EXPIRE,
+                         AnalysisLock, analysis_lock)
+from api.v1.notifications import (deliver_pending, dispatch_lock,
+                                  enqueue_notification)
+from api.v1.progress import AnalysisProgress
+from api.v1.tasks import (PeakMemory, dispatch_notifications,
+                          make_predictions, merge_shard_metrics,
+                          score_shard)
+from backend.celery import app
+from core.constants.analysis import NOTIFICATION_MAX_RETRIES
+from products.models import (AnalysisRun, Dealer, DealerParsing,
+                             MatchingPredictions, Notification, Product)
+
+
+def create_catalog(keys=('key-1', 'key-2'), products=3):
+    """Create a dealer, dealer products and Prosept products."""
+    dealer, _ = Dealer.objects.get_or_create(name='dealer')
+    for key in keys:
+        DealerParsing.objects.create(
+            product_key=key, price='100', product_url='http://a.ru',
+            product_name=key, date=datetime.date(2023, 7, 1),
+            dealer_id=dealer)
+    for id_product in range(1, products + 1):
+        Product.objects.create(id_product=str(id_product),
+                               article=str(id_product),
+                               name=str(id_product),
+                               name_1c=str(id_product))
+    return dealer
+
+
+class SavePredictionsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog()
+
+    def test_bulk_save(self):
+        """Test predictions are saved in bulk and duplicates are skipped."""
+        ml_results = {'key-1': [1, 2, 3], 'key-2': [3, 99], 'unknown': [1]}
+        # Two in_bulk lookups, two INSERTs and the savepoint pair.
+        with self.assertNumQueries(6):
+            stats = save_predictions(ml_results, batch_size=2)
+        self.assertEqual(stats['rows'], 4)
+        self.assertEqual(stats['missing_dealer_products'], 1)
+        self.assertEqual(stats['missing_products'], 1)
+        self.assertEqual(MatchingPredictions.objects.count(), 4)
+
+        save_predictions(ml_results)
+        self.assertEqual(MatchingPredictions.objects.count(), 4)
+        self.assertQuerysetEqual(
+            MatchingPredictions.objects.filter(
+                dealer_product_id='key-1').order_by('id')
+            .values_list('prosept_product_id', flat=True),
+            ['1', '2', '3'])
+
+
+class LoadFramesTestCase(TestCase):
+    def analyze(self, ml_results):
+        """Save predictions the way make_predictions does."""
+        parser = load_dealer_products_frame()
+        fingerprints = dict(zip(parser['product_key'], parser['fingerprint']))
+        return save_predictions(ml_results, fingerprints=fingerprints)
+
+    def test_only_new_dealer_products(self):
+        """Test matched and already analysed dealer products are skipped."""
+        create_catalog(keys=('matched', 'analyzed'))
+        DealerParsing.objects.filter(product_key='matched').update(
+            is_matched=True)
+        self.analyze({'analyzed': [1]})
+        create_catalog(keys=('new',), products=0)
+
+        parser = load_dealer_products_frame()
+        self.assertEqual(parser['product_key'].tolist(), ['new'])
+        self.assertEqual(parser.columns.tolist(),
+                         ['product_key', 'price', 'product_name',
+                          'dealer_id', 'fingerprint'])
+        products = load_products_frame()
+        self.assertEqual(sorted(products['id']), [1, 2, 3])
+
+    def test_changed_dealer_product_rescored(self):
+        """Test a changed dealer product is selected and its predictions replaced."""
+        create_catalog()
+        self.analyze({'key-1': [1, 2], 'key-2': [3]})
+        self.assertTrue(load_dealer_products_frame().empty)
+
+        dealer_product = DealerParsing.objects.get(product_key='key-1')
+        dealer_product.price = '150'
+        dealer_product.save()
+        DealerParsing.objects.filter(product_key='key-2').update(
+            fingerprint='')
+        self.assertEqual(backfill_fingerprints(), 1)
+        self.assertEqual(load_dealer_products_frame()['product_key'].tolist(),
+                         ['key-1'])
+
+        DealerParsing.objects.filter(product_key='key-2').update(
+            product_name='changed')
+        self.assertEqual(
+            sorted(load_dealer_products_frame()['product_key']), ['key-1'])
+        call_command('backfill_fingerprints', stdout=StringIO())
+        self.assertEqual(
+            sorted(load_dealer_products_frame()['product_key']),
+            ['key-1', 'key-2'])
+        DealerParsing.objects.filter(product_key='key-2').update(
+            product_name='key-2')
+        self.assertEqual(backfill_fingerprints(), 1)
+
+        stats = self.analyze({'key-1': [3]})
+        self.assertEqual((stats['replaced'], stats['analyzed']), (2, 1))
+        self.assertQuerysetEqual(
+            MatchingPredictions.objects.order_by('id').values_list(
+                'dealer_product_id', 'prosept_product_id'),
+            [('key-2', '3'), ('key-1', '3')], transform=tuple)
+        self.assertTrue(load_dealer_products_frame().empty)
+
+
+class AnalysisLockTestCase(TestCase):
+    def test_redis_checks_holder_atomically(self):
+        """Test django-redis heartbeat and release run one compare script."""
+        client = mock.Mock()
+        client.make_key.return_value = ':1:lock'
+        client.encode.return_value = 7
+        redis = client.get_client.return_value
+        redis.eval.return_value = 0
+        lock = AnalysisLock(ttl=30, key='lock')
+        with mock.patch('api.v1.lock.cache') as cache_mock:
+            cache_mock.client = client
+            self.assertFalse(lock.heartbeat(7))
+            lock.release(7)
+        self.assertEqual(redis.eval.call_args_list, [
+            mock.call(COMPARE_AND_EXPIRE, 1, ':1:lock', 7, 30),
+            mock.call(COMPARE_AND_DELETE, 1, ':1:lock', 7),
+        ])
+        cache_mock.get.assert_not_called()
+        cache_mock.delete.assert_not_called()
+
+    def test_other_holder_is_kept(self):
+        """Test a stale holder neither extends nor frees another lease."""
+        lock = AnalysisLock(ttl=30, key='lock')
+        lock.acquire(1)
+        self.assertFalse(lock.heartbeat(2))
+        lock.release(2)
+        self.assertEqual(lock.holder(), 1)
+        lock.release(1)
+
+
+class MergeShardMetricsTestCase(TestCase):
+    def test_sum_and_max(self):
+        """Test stage timings are summed and maxed over shards."""
+        metrics = merge_shard_metrics([
+            {'stage_timings': {'search': 1.0, 'loading': 0.5},
+             'peak_memory_mb': 100.0},
+            {'stage_timings': {'search': 3.0}, 'peak_memory_mb': 80.0},
+        ])
+        self.assertEqual(metrics, {
+            'stage_timings': {'search': 4.0, 'loading': 0.5},
+            'stage_timings_max': {'search': 3.0, 'loading': 0.5},
+            'peak_memory_mb': 100.0})
+
+
+class PeakMemoryTestCase(TestCase):
+    def test_earlier_peak_is_not_reported(self):
+        """Test the measured peak excludes allocations before the task."""
+        buffer = bytearray(300 * 2 ** 20)
+        del buffer
+        process_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory = PeakMemory()
+        if not memory.kernel_reset:
+            self.skipTest('Сброс пика памяти недоступен')
+        self.assertLess(memory.mb(), process_peak / 1024 - 200)
+
+
+class AnalyzeViewTestCase(APITestCase):
+    def setUp(self):
+        """Authenticate a user with a Telegram id."""
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password', telegram_id=42)
+        self.client.force_authenticate(self.user)
+
+    @mock.patch('api.v1.views.make_predictions.delay')
+    def test_enqueues_run_id(self, delay):
+        """Test the view creates a run and enqueues only its id."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get('/api/analyze/')
+        self.assertEqual(response.status_code, 200)
+        run = AnalysisRun.objects.get()
+        self.assertEqual(response.data['run_id'], run.id)
+        self.assertEqual((run.email, run.chat_id, run.status),
+                         ('user@prosept.ru', 42, AnalysisRun.PENDING))
+        delay.assert_called_once_with(run.id)
+
+    @mock.patch('api.v1.views.make_predictions.delay')
+    def test_duplicate_requests_coalesced(self, delay):
+        """Test requests during a run return the running run id."""
+        response = self.client.get('/api/analyze/')
+        run_id = response.data['run_id']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/analyze/')
+        self.assertEqual(response.data['run_id'], run_id)
+        self.assertEqual(AnalysisRun.objects.count(), 1)
+
+        analysis_lock.release(run_id)
+        response = self.client.get('/api/analyze/')
+        self.assertNotEqual(response.data['run_id'], run_id)
+
+    @mock.patch('api.v1.views.make_predictions.delay')
+    def test_lost_race_rolls_back(self, delay):
+        """Test a request losing the lock race creates no run."""
+        with mock.patch('api.v1.views.analysis_lock.holder',
+                        side_effect=[None, 99]):
+            analysis_lock.acquire(99)
+            response = self.client.get('/api/analyze/')
+        self.assertEqual(response.data['run_id'], 99)
+        self.assertFalse(AnalysisRun.objects.exists())
+        delay.assert_not_called()
+
+
+    @mock.patch('api.v1.views.make_predictions.delay')
+    def test_cancel(self, delay):
+        """Test a cancelled run stops and frees the single-run lock."""
+        run_id = self.client.get('/api/analyze/').data['run_id']
+
+        response = self.client.post('/api/analyze/cancel/')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['run_id'], run_id)
+        self.assertTrue(AnalysisRun.objects.get().cancel_requested)
+        make_predictions(run_id)
+        run = AnalysisRun.objects.get()
+        self.assertEqual(run.status, AnalysisRun.CANCELLED)
+        self.assertIsNone(analysis_lock.holder())
+        response = self.client.post('/api/analyze/cancel/',
+                                    {'run_id': run_id})
+        self.assertEqual(response.status_code, 404)
+
+
+class ShardedAnalysisTestCase(TestCase):
+    def setUp(self):
+        """Create dealer products and run Celery tasks eagerly."""
+        create_catalog(keys=('key-1', 'key-2', 'key-3'))
+        self.run = AnalysisRun.objects.create(email='user@prosept.ru')
+        cache.clear()
+        analysis_lock.acquire(self.run.id)
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+
+    def test_plan_shards(self):
+        """Test pending dealer products are split into pk ranges."""
+        pks = list(DealerParsing.objects.order_by('pk')
+                   .values_list('pk', flat=True))
+        self.assertEqual(plan_shards(shard_size=2),
+                         [(pks[0], pks[1], 2), (pks[2], pks[2], 1)])
+
+    @mock.patch('api.v1.tasks.dispatch_notifications')
+    @mock.patch('api.v1.tasks.sync_product_index',
+                return_value={'total': 3})
+    @mock.patch('api.v1.tasks.main_function')
+    @mock.patch('api.v1.tasks.ANALYSIS_SHARD_SIZE', 2)
+    def test_chord(self, main_function, sync_index, dispatch):
+        """Test every shard is scored and the run is finalized once."""
+        main_function.side_effect = lambda parser, products, **kwargs: {
+            key: [1] for key in parser['product_key']}
+        make_predictions(self.run.id)
+
+        self.assertEqual(main_function.call_count, 2)
+        self.assertFalse(main_function.call_args.kwargs['sync_index'])
+        sync_index.assert_called_once()
+        self.assertEqual(self.run.notifications.count(), 1)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, AnalysisRun.SUCCESS)
+        self.assertIsNone(analysis_lock.holder())
+        self.assertEqual((self.run.shards, self.run.dealer_rows,
+                          self.run.product_rows,
+                          self.run.predictions_written), (2, 3, 3, 3))
+        self.assertEqual(set(self.run.stage_timings),
+                         {'loading', 'persistence'})
+        self.assertLessEqual(self.run.stage_timings_max['persistence'],
+                             self.run.stage_timings['persistence'])
+        self.assertGreater(self.run.peak_memory_mb, 0)
+        self.assertEqual(MatchingPredictions.objects.count(), 3)
+        self.assertFalse(pending_dealer_products().exists())
+        snapshot = AnalysisProgress(self.run.id).snapshot()
+        self.assertEqual(snapshot['status'], AnalysisRun.SUCCESS)
+        stages = {item['stage']: item['processed']
+                  for item in snapshot['stages']}
+        self.assertEqual((stages['loading'], stages['persistence']), (3, 3))
+
+    @mock.patch('api.v1.tasks.dispatch_notifications')
+    @mock.patch('api.v1.tasks.sync_product_index',
+                return_value={'total': 3})
+    @mock.patch('api.v1.tasks.main_function')
+    def test_redelivery_does_not_dispatch_again(self, main_function,
+                                                sync_index, dispatch):
+        """Test a redelivered make_predictions does not start a second chord."""
+        main_function.side_effect = lambda parser, products, **kwargs: {
+            key: [1] for key in parser['product_key']}
+        make_predictions(self.run.id)
+        self.assertEqual(main_function.call_count, 1)
+
+        self.assertIsNone(make_predictions(self.run.id))
+        self.assertEqual(main_function.call_count, 1)
+        sync_index.assert_called_once()
+        self.assertEqual(self.run.notifications.count(), 1)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, AnalysisRun.SUCCESS)
+
+    @mock.patch('api.v1.tasks.dispatch_notifications')
+    @mock.patch('api.v1.tasks.sync_product_index')
+    @mock.patch('api.v1.tasks.main_function')
+    def test_concurrent_delivery_does_not_dispatch(self, main_function,
+                                                   sync_index, dispatch):
+        """Test only the delivery that marks the run dispatched starts shards."""
+        def sync():
+            AnalysisRun.objects.filter(pk=self.run.id).update(
+                dispatched_at=timezone.now())
+            return {'total': 3}
+
+        sync_index.side_effect = sync
+        self.assertIsNone(make_predictions(self.run.id))
+        main_function.assert_not_called()
+        self.assertEqual(self.run.notifications.count(), 0)
+
+    @mock.patch('api.v1.tasks.dispatch_notifications')
+    @mock.patch('api.v1.tasks.sync_product_index',
+                return_value={'total': 3})
+    @mock.patch('api.v1.tasks.main_function')
+    @mock.patch('api.v1.tasks.ANALYSIS_CHECKPOINT_SIZE', 2)
+    def test_resume_from_checkpoint(self, main_function, sync_index,
+                                    dispatch):
+        """Test a retried shard skips chunks committed before the error."""
+        calls = []
+
+        def score(parser, products, **kwargs):
+            calls.append(list(parser['product_key']))
+            if len(calls) == 2:
+                raise OperationalError('connection lost')
+            return {key: [1] for key in parser['product_key']}
+
+        main_function.side_effect = score
+        make_predictions(self.run.id)
+
+        self.assertEqual(calls, [['key-1', 'key-2'], ['key-3'], ['key-3']])
+        self.assertEqual(self.run.chunks.count(), 2)
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, AnalysisRun.SUCCESS)
+        self.assertEqual((self.run.dealer_rows,
+                          self.run.predictions_written), (3, 3))
+        self.assertEqual(MatchingPredictions.objects.count(), 3)
+
+
+    @mock.patch('api.v1.tasks.dispatch_notifications')
+    @mock.patch('api.v1.tasks.sync_product_index',
+                return_value={'total': 3})
+    @mock.patch('api.v1.tasks.main_function')
+    @mock.patch('api.v1.tasks.ANALYSIS_CHECKPOINT_SIZE', 2)
+    def test_cancel_keeps_committed_chunks(self, main_function, sync_index,
+                                           dispatch):
+        """Test cancellation stops before the next chunk."""
+        def score(parser, products, **kwargs):
+            request_cancel(self.run.id)
+            return {key: [1] for key in parser['product_key']}
+
+        main_function.side_effect = score
+        make_predictions(self.run.id)
+
+        main_function.assert_called_once()
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, AnalysisRun.CANCELLED)
+        self.assertEqual(MatchingPredictions.objects.count(), 2)
+        self.assertEqual(pending_dealer_products().count(), 1)
+        self.assertIsNone(analysis_lock.holder())
+
+    @mock.patch('api.v1.tasks.load_products_frame')
+    def test_cancelled_shard_skips_catalog(self, load_products):
+        """Test a shard cancelled before it starts does not load the catalog."""
+        request_cancel(self.run.id)
+        pks = DealerParsing.objects.order_by('pk').values_list('pk',
+                                                               flat=True)
+        result = score_shard(self.run.id, (pks.first(), pks.last()))
+
+        self.assertTrue(result['cancelled'])
+        load_products.assert_not_called()
+
+
+class AnalysisProgressTestCase(APITestCase):
+    def setUp(self):
+        """Authenticate a user and clear the progress cache."""
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password')
+        self.client.force_authenticate(self.user)
+
+    def test_progress(self):
+        """Test stage counters are aggregated and served from the cache."""
+        response = self.client.get('/api/analyze/progress/')
+        self.assertEqual(response.status_code, 404)
+
+        progress = AnalysisProgress(7)
+        progress.start(10)
+        for stage in ('loading', 'normalization'):
+            progress.advance(stage, 4)
+            progress.advance(stage, 6)
+        progress.advance('lemmatization', 5)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/analyze/progress/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['run_id'], response.data['status'],
+                          response.data['stage']),
+                         (7, 'running', 'lemmatization'))
+        stages = {item['stage']: item for item in response.data['stages']}
+        self.assertEqual(stages['normalization']['processed'], 10)
+        self.assertEqual(stages['normalization']['eta_seconds'], 0)
+        self.assertEqual(stages['lemmatization']['processed'], 5)
+        self.assertIsNone(stages['search']['eta_seconds'])
+
+        progress.finish('success')
+        response = self.client.get('/api/analyze/progress/?run_id=7')
+        self.assertEqual(response.data['status'], 'success')
+
+
+class AnalysisRunViewSetTestCase(APITestCase):
+    def test_history(self):
+        """Test run history is listed read-only and filtered by status."""
+        user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password')
+        self.client.force_authenticate(user)
+        AnalysisRun.objects.create(user=user, status=AnalysisRun.FAILED)
+        AnalysisRun.objects.create(user=user, status=AnalysisRun.SUCCESS,
+                                   dealer_rows=10,
+                                   stage_timings={'search': 1.5})
+
+        response = self.client.get('/api/analysis-runs/?status=success')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        run = response.data['results'][0]
+        self.assertEqual((run['dealer_rows'], run['stage_timings']),
+                         (10, {'search': 1.5}))
+        response = self.client.delete(f'/api/analysis-runs/{run["id"]}/')
+        self.assertEqual(response.status_code, 405)
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        """Create an analysis run and clear the dispatcher lock."""
+        self.run = AnalysisRun.objects.create(email='user@prosept.ru',
+                                              chat_id=1)
+        cache.clear()
+
+    def test_routes(self):
+        """Test analysis and notification tasks use separate queues."""
+        router = app.amqp.router
+        self.assertEqual(
+            router.route({}, make_predictions.name)['queue'].name, 'ml')
+        self.assertEqual(
+            router.route({}, dispatch_notifications.name)['queue'].name,
+            'notifications')
+
+    def test_enqueue_without_chat_id(self):
+        """Test a run without chat_id is notified by email only."""
+        self.run.chat_id = None
+        notification = enqueue_notification(self.run, 'message')
+        self.assertEqual(notification.channel, Notification.EMAIL)
+
+    def test_batch_delivery(self):
+        """Test one Telegram batch, email fallback and delayed retries."""
+        sent, wrong_chat, timed_out = (
+            enqueue_notification(self.run, 'message') for _ in range(3))
+        client = mock.Mock()
+        client.send_many.return_value = [None, BadRequest('chat'), TimedOut()]
+
+        stats = deliver_pending(client, 'holder')
+
+        client.send_many.assert_called_once_with([(1, 'message')] * 3)
+        self.assertEqual(len(mail.outbox), 1)
+        for notification in (sent, wrong_chat, timed_out):
+            notification.refresh_from_db()
+        self.assertEqual((sent.channel, sent.status),
+                         (Notification.TELEGRAM, Notification.SENT))
+        self.assertEqual((wrong_chat.channel, wrong_chat.status),
+                         (Notification.EMAIL, Notification.SENT))
+        self.assertEqual((timed_out.status, timed_out.attempts),
+                         (Notification.PENDING, 1))
+        self.assertGreater(timed_out.next_attempt_at, timezone.now())
+        self.assertEqual(stats, {'telegram_sent': 1, 'email_sent': 1,
+                                 'telegram_pending': 1})
+        self.assertIsNone(dispatch_lock.holder())
+
+    def test_retries_exhausted(self):
+        """Test Telegram falls back to email and then gives up."""
+        notification = enqueue_notification(self.run, 'message')
+        notification.attempts = NOTIFICATION_MAX_RETRIES
+        notification.save()
+        client = mock.Mock()
+        client.send_many.return_value = [TimedOut()]
+
+        with mock.patch.object(EmailMessage, 'send',
+                               side_effect=SMTPRecipientsRefused({})):
+            deliver_pending(client, 'holder')
+
+        notification.refresh_from_db()
+        self.assertEqual((notification.channel, notification.status),
+                         (Notification.EMAIL, Notification.FAILED))
@@ -0,0 +1,88 @@
+import time
+from io import StringIO
+from unittest import mock
+
+import pandas as pd
+from django.test import SimpleTestCase
+
+from DS.ds_analyze import (AnalysisCancelled, build_article_index,
+                           find_product_id_by_article, main_function,
+                           match_articles, products_prep)
+from tests.ds_fixtures import PRODUCT_NAMES, fake_registry, make_products
+
+
+@mock.patch('DS.ds_analyze.nlp_registry', fake_registry())
+class ArticleFastPathTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create products where one article belongs to two products."""
+        self.products = make_products(
+            PRODUCT_NAMES + [('029-5', 'Гель для стирки Crystal 5 л')])
+        self.parser = pd.DataFrame({
+            'product_key': ['unique', 'shared', 'no-article'],
+            'price': [100, 200, 300],
+            'product_name': [
+                'Средство для мытья полов Multipower 008-1 1 л',
+                'Гель для стирки Crystal 029-5 5 л',
+                'Очиститель фасадов Fasad Cleaner 1 л'],
+            'dealer_id': [1, 1, 1],
+        })
+
+    def test_index_matches_scan(self):
+        """Test article index agrees with the full scan lookup."""
+        products_final = products_prep(self.products.copy())
+        article_index = build_article_index(products_final)
+        self.assertEqual(article_index['029-5'], [104, 106])
+        for article, _ in PRODUCT_NAMES:
+            self.assertEqual(
+                article_index[article][:1],
+                find_product_id_by_article(article, products_final))
+
+    def test_fast_path(self):
+        """Test a unique article hit skips the TF-IDF search."""
+        stats, progress = {}, []
+        with mock.patch('DS.ds_analyze.get_neighbors',
+                        return_value={'shared': [101],
+                                      'no-article': [103]}) as neighbors:
+            result = main_function(StringIO(self.parser.to_json()),
+                                   StringIO(self.products.to_json()),
+                                   stats=stats,
+                                   progress=lambda *args: progress.append(
+                                       args))
+        searched = neighbors.call_args.args[1]['key'].tolist()
+        self.assertEqual(sorted(searched), ['no-article', 'shared'])
+        self.assertEqual(result, {'unique': [100],
+                                  'shared': [104, 106, 101],
+                                  'no-article': [103]})
+        self.assertEqual(stats, {'rows': 3, 'article_hits': 2,
+                                 'fast_path': 1, 'searched': 2})
+        self.assertEqual(progress, [('normalization', 3),
+                                    ('lemmatization', 3),
+                                    ('vectorization', 1), ('search', 1)])
+
+    def test_cancel_between_stages(self):
+        """Test should_stop aborts the pipeline after the current stage."""
+        progress = []
+        with self.assertRaises(AnalysisCancelled):
+            main_function(StringIO(self.parser.to_json()),
+                          StringIO(self.products.to_json()),
+                          progress=lambda *args: progress.append(args),
+                          should_stop=lambda: bool(progress))
+        self.assertEqual(progress, [('normalization', 3)])
+
+    def test_stage_timings(self):
+        """Test each stage is timed around its own block only."""
+        def slow_match(*args):
+            time.sleep(0.2)
+            return match_articles(*args)
+
+        timings = {}
+        with mock.patch('DS.ds_analyze.get_neighbors', return_value={}), \
+                mock.patch('DS.ds_analyze.match_articles',
+                           side_effect=slow_match):
+            main_function(StringIO(self.parser.to_json()),
+                          StringIO(self.products.to_json()),
+                          timings=timings)
+        self.assertEqual(set(timings), {'normalization', 'lemmatization',
+                                        'catalog', 'articles'})
+        self.assertGreaterEqual(timings['articles'], 0.2)
+        self.assertLess(timings['normalization'], 0.2)
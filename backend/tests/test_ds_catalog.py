@@ -0,0 +1,55 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from DS.ds_analyze import load_vectorizer, products_prep
+from DS.ds_catalog import CatalogCache
+from tests.ds_fixtures import fake_registry, make_products
+
+
+@mock.patch('DS.ds_analyze.nlp_registry', fake_registry())
+class CatalogCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create products and a cache in a temporary directory."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'catalog.pkl')
+        self.products = make_products()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertMatchesFresh(self, products, frame, matrix):
+        """Compare cached output with a fresh products_prep run."""
+        expected = products_prep(products.copy())
+        self.assertEqual(frame['id'].tolist(), expected['id'].tolist())
+        self.assertEqual(frame['full_name'].tolist(),
+                         expected['full_name'].tolist())
+        expected_matrix = load_vectorizer().transform(expected['full_name'])
+        self.assertEqual((matrix != expected_matrix).nnz, 0)
+
+    def test_full_hit(self):
+        """Test second run with unchanged products rebuilds nothing."""
+        CatalogCache(self.path).load_or_build(self.products)
+        cache = CatalogCache(self.path)
+        frame, matrix = cache.load_or_build(self.products)
+        self.assertEqual(cache.last_stats['rebuilt_rows'], 0)
+        self.assertMatchesFresh(self.products, frame, matrix)
+
+    def test_only_changed_rows_rebuilt(self):
+        """Test a changed and a new product are the only rebuilt rows."""
+        cache = CatalogCache(self.path)
+        cache.load_or_build(self.products)
+
+        products = self.products.copy()
+        products.loc[2, 'name_1c'] = 'Огнебиозащита 2 группа 25 кг'
+        products = products.drop(index=4)
+        products.loc[len(self.products)] = products.loc[0]
+        products.loc[len(self.products), ['id', 'name_1c']] = [
+            999, 'Грунт Multiprimer 10 л']
+        products = products.iloc[::-1]
+
+        frame, matrix = cache.load_or_build(products)
+        self.assertEqual(cache.last_stats['rebuilt_rows'], 2)
+        self.assertMatchesFresh(products, frame, matrix)
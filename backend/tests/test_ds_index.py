@@ -0,0 +1,108 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+from scipy import sparse
+
+from DS.ds_index import ProductIndex
+
+
+def random_matrix(rows, seed):
+    """Return random sparse l2-normalized matrix."""
+    matrix = sparse.random(rows, 40, density=0.2, format='csr',
+                           random_state=seed)
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A.ravel()
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+class ProductIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create catalog vectors and an index in a temporary directory."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'products.faiss')
+        self.ids = np.arange(100, 130)
+        self.matrix = random_matrix(30, seed=1).tocsr()
+        self.queries = random_matrix(5, seed=2).tocsr()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def exact_neighbors(self, ids, matrix, k=10):
+        """Brute-force L2 neighbours."""
+        base, query = matrix.toarray(), self.queries.toarray()
+        distances = ((query[:, None, :] - base[None, :, :]) ** 2).sum(axis=2)
+        return np.asarray(ids)[np.argsort(distances, axis=1)[:, :k]]
+
+    def test_search_after_build(self):
+        """Test persisted index returns exact neighbours by product id."""
+        index = ProductIndex(self.path)
+        stats = index.sync(self.ids, self.matrix)
+        self.assertEqual(stats['added'], 30)
+        _, found = ProductIndex(self.path).search(self.queries)
+        np.testing.assert_array_equal(
+            found, self.exact_neighbors(self.ids, self.matrix))
+
+    def test_incremental_sync(self):
+        """Test update, delete and insert touch only the changed vectors."""
+        ProductIndex(self.path).sync(self.ids, self.matrix)
+
+        matrix = self.matrix.tolil()
+        matrix[3] = random_matrix(1, seed=3).toarray()
+        keep = [row for row in range(30) if row != 7]
+        ids = np.append(self.ids[keep], 500)
+        matrix = sparse.vstack([matrix.tocsr()[keep],
+                                random_matrix(1, seed=4)]).tocsr()
+
+        index = ProductIndex(self.path)
+        stats = index.sync(ids, matrix)
+        self.assertEqual((stats['added'], stats['removed']), (2, 2))
+        self.assertEqual(stats['total'], 30)
+        _, found = index.search(self.queries)
+        np.testing.assert_array_equal(found,
+                                      self.exact_neighbors(ids, matrix))
+
+        self.assertEqual(index.sync(ids, matrix)['added'], 0)
+
+    def test_index_kinds(self):
+        """Test every index kind finds exact neighbours on a small catalog."""
+        for kind, params in (('flat', {}), ('ivf', {'nlist': 2, 'nprobe': 2}),
+                             ('hnsw', {})):
+            with self.subTest(kind=kind):
+                path = os.path.join(self.tmp_dir.name, f'{kind}.faiss')
+                index = ProductIndex(path, kind, **params)
+                index.sync(self.ids, self.matrix)
+                _, found = index.search(self.queries)
+                np.testing.assert_array_equal(
+                    found, self.exact_neighbors(self.ids, self.matrix))
+
+    def test_rebuild_on_kind_change_and_hnsw_removal(self):
+        """Test changed index kind or removal from HNSW rebuilds the index."""
+        ProductIndex(self.path, 'flat').sync(self.ids, self.matrix)
+        stats = ProductIndex(self.path, 'hnsw').sync(self.ids, self.matrix)
+        self.assertTrue(stats['rebuilt'])
+
+        index = ProductIndex(self.path, 'hnsw')
+        stats = index.sync(self.ids[1:], self.matrix[1:])
+        self.assertTrue(stats['rebuilt'])
+        self.assertEqual(stats['total'], 29)
+        _, found = index.search(self.queries)
+        np.testing.assert_array_equal(
+            found, self.exact_neighbors(self.ids[1:], self.matrix[1:]))
+
+    def test_ivf_recall_after_incremental_sync(self):
+        """Test an IVF index still finds every product after a replacement."""
+        ids = np.arange(1000, 1300)
+        matrix = random_matrix(300, seed=5).tocsr()
+        index = ProductIndex(self.path, 'ivf', nlist=4, nprobe=4)
+        index.sync(ids, matrix)
+
+        matrix = matrix.tolil()
+        matrix[10] = random_matrix(1, seed=6).toarray()
+        matrix = matrix.tocsr()
+        stats = index.sync(ids, matrix)
+        self.assertTrue(stats['rebuilt'])
+        self.assertEqual(stats['total'], 300)
+        _, found = index.search(matrix, k=1)
+        self.assertEqual((found[:, 0] == ids).mean(), 1.0)
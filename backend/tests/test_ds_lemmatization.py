@@ -0,0 +1,91 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from DS.ds_analyze import (allowed_n_process, lemmatizate,
+                           lemmatizate_batch, lemmatizate_cached)
+from DS.ds_nlp import TokenLemmaCache
+from tests.ds_fixtures import fake_pipelines
+
+TEXTS = [
+    'Средство для мытья полов prosept multipower 1 л',
+    'антисептик для дерева  eco 50 готовый состав',
+    '',
+    'очиститель фасадов fasad cleaner',
+]
+
+
+class LemmatizateBatchTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create fake spaCy pipelines."""
+        self.nlp, self.nlp_ru = fake_pipelines()
+
+    def test_batch_matches_per_row(self):
+        """Test batched lemmatization returns the per-row output."""
+        expected = [lemmatizate(text, self.nlp, self.nlp_ru)
+                    for text in TEXTS]
+        self.assertEqual(
+            lemmatizate_batch(TEXTS, self.nlp, self.nlp_ru, batch_size=2),
+            expected)
+
+
+class TokenLemmaCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create fake pipelines and a temporary cache file."""
+        self.nlp, self.nlp_ru = fake_pipelines()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'lemmas.pkl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cached_lemmatization(self):
+        """Test cached output matches per-token lemmatization."""
+        cache = TokenLemmaCache(path=None)
+        result = lemmatizate_cached(TEXTS, self.nlp, self.nlp_ru, cache)
+        expected = [' '.join(lemmatizate(token, self.nlp, self.nlp_ru)
+                             for token in text.split())
+                    for text in TEXTS]
+        self.assertEqual(result, expected)
+        self.assertEqual(cache.hits, 0)
+
+    def test_repeated_run_hits_cache(self):
+        """Test second run with a reloaded cache sends nothing to spaCy."""
+        cache = TokenLemmaCache(path=self.path)
+        first = lemmatizate_cached(TEXTS, self.nlp, self.nlp_ru, cache)
+        cache.save()
+
+        reloaded = TokenLemmaCache(path=self.path)
+        second = lemmatizate_cached(TEXTS, self.nlp, self.nlp_ru, reloaded)
+        self.assertEqual(first, second)
+        self.assertEqual(reloaded.misses, 0)
+        self.assertEqual(reloaded.hits, len(cache))
+
+    def test_lru_eviction(self):
+        """Test least recently used tokens are evicted first."""
+        cache = TokenLemmaCache(maxsize=2, path=None)
+        cache.update({'a': 'a', 'b': 'b'})
+        cache.lookup(['a'])
+        cache.update({'c': 'c'})
+        found, missing = cache.lookup(['a', 'b', 'c'])
+        self.assertEqual(set(found), {'a', 'c'})
+        self.assertEqual(missing, ['b'])
+
+
+class NProcessTestCase(SimpleTestCase):
+    def test_daemon_process_uses_one_process(self):
+        """Test spaCy is not asked to fork from a daemonic process."""
+        nlp, nlp_ru = fake_pipelines()
+        with mock.patch('DS.ds_analyze.is_daemon_process',
+                        return_value=True), \
+                mock.patch.object(nlp, 'pipe', wraps=nlp.pipe) as pipe:
+            lemmatizate_batch(TEXTS, nlp, nlp_ru, n_process=4)
+        self.assertEqual(pipe.call_args.kwargs['n_process'], 1)
+
+    def test_regular_process_keeps_setting(self):
+        """Test n_process is passed through outside daemonic processes."""
+        with mock.patch('DS.ds_analyze.is_daemon_process',
+                        return_value=False):
+            self.assertEqual(allowed_n_process(4), 4)
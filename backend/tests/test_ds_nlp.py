@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase
+
+from DS.ds_nlp import NLPModelRegistry
+
+
+class NLPModelRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create registry with a counting fake loader."""
+        self.loaded = []
+
+        def loader(name):
+            self.loaded.append(name)
+            return object()
+
+        self.registry = NLPModelRegistry(loader=loader)
+
+    def test_models_loaded_once(self):
+        """Test repeated get() reuses already loaded models."""
+        first = self.registry.get()
+        second = self.registry.get()
+        self.registry.warm()
+        self.assertIs(first, second)
+        self.assertEqual(self.registry.loads, 1)
+        self.assertEqual(len(self.loaded), 2)
+
+    def test_reload(self):
+        """Test reload() replaces the models and updates stats."""
+        first = self.registry.get()
+        stats = self.registry.reload()
+        self.assertIsNot(first, self.registry.get())
+        self.assertEqual(stats['loads'], 2)
+        self.assertTrue(stats['loaded'])
+        self.assertIsNotNone(stats['load_time'])
+        self.assertGreaterEqual(stats['memory_footprint'], 0)
@@ -0,0 +1,28 @@
+import pandas as pd
+from django.test import SimpleTestCase
+
+from DS.ds_analyze import change_equal, change_equal_frame
+
+NAMES = [
+    'Средство для мытья полов PROSEPT Multipower Floor концентрат 1 л',
+    'Антисептик ПРОСЕПТ ECO 50 готовый состав 5л',
+    'Просепт50 огнебиозащита 1 группа 10 кг 018-10',
+    'Prosept50, пропитка 600 мл',
+    'ProseptEco50, антисептик 1000 г',
+    'Гель для стирки Crystal ultra 4,5 л 029-5',
+    'Средство ф/п для удаления ржавчины 0.5 л 023-05/1',
+    'Универсальная-ая добавка 12 шт',
+    'Грунт глубокого проникновения prosept500',
+    'Очиститель фасадов без объёма',
+    '203-5 антисептик 203-5 двойной артикул 1,5кг',
+    '',
+]
+
+
+class ChangeEqualFrameTestCase(SimpleTestCase):
+    def test_golden_output(self):
+        """Test vectorized normalizer reproduces change_equal per row."""
+        names = pd.Series(NAMES, index=range(10, 10 + len(NAMES)))
+        expected = names.apply(change_equal).apply(pd.Series)
+        result = change_equal_frame(names)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
@@ -0,0 +1,38 @@
+import numpy as np
+from django.test import SimpleTestCase
+from scipy import sparse
+
+from DS.ds_sparse import sparse_neighbors, sparse_top_k
+
+
+class SparseTopKTestCase(SimpleTestCase):
+    def setUp(self):
+        """Create random sparse catalog and queries."""
+        self.base = sparse.random(50, 30, density=0.2, format='csr',
+                                  random_state=1)
+        self.query = sparse.random(12, 30, density=0.2, format='csr',
+                                   random_state=2)
+
+    def test_matches_dense_cosine(self):
+        """Test blocked sparse search returns exact cosine top-k."""
+        base, query = self.base.toarray(), self.query.toarray()
+        base /= np.maximum(np.linalg.norm(base, axis=1, keepdims=True), 1e-12)
+        query /= np.maximum(np.linalg.norm(query, axis=1, keepdims=True),
+                            1e-12)
+        similarity = query @ base.T
+        scores, positions = sparse_top_k(self.base, self.query, k=5,
+                                         block_size=4)
+        np.testing.assert_allclose(
+            scores, -np.sort(-similarity, axis=1)[:, :5], rtol=1e-5)
+        np.testing.assert_allclose(
+            np.take_along_axis(similarity, positions, axis=1), scores,
+            rtol=1e-5)
+
+    def test_neighbors_structure(self):
+        """Test result maps dealer keys to product ids."""
+        ids = list(range(1000, 1050))
+        result = sparse_neighbors(ids, self.base, ['a', 'b'],
+                                  self.query[:2], k=3)
+        self.assertEqual(list(result), ['a', 'b'])
+        self.assertTrue(all(len(value) == 3 and set(value) <= set(ids)
+                            for value in result.values()))
@@ -0,0 +1,277 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from products.models import (AnalysisRun, Dealer, DealerParsing,
+                             DealerStatistic, Match, MatchingPredictions,
+                             Product)
+
+LIST_URLS = ('/api/dealer-products/', '/api/postpone/',
+             '/api/has_no_matches/', '/api/match/', '/api/predictions/',
+             '/api/analysis-runs/')
+
+
+class ListQueriesTestCase(APITestCase):
+    def setUp(self):
+        """Authenticate a user."""
+        self.user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password')
+        self.client.force_authenticate(self.user)
+
+    def create_rows(self, count, offset=0):
+        """Create dealer products with a match and a prediction each."""
+        for number in range(offset, offset + count):
+            dealer = Dealer.objects.create(name=f'dealer-{number}')
+            dealer_product = DealerParsing.objects.create(
+                product_key=f'key-{number}', price='100',
+                product_url='http://a.ru', product_name=f'name-{number}',
+                date=datetime.date(2023, 7, 1), dealer_id=dealer,
+                is_postponed=number % 2 == 0,
+                has_no_matches=number % 2 == 1)
+            product = Product.objects.create(
+                id_product=str(number), article=str(number),
+                name=str(number), name_1c=str(number))
+            Match.objects.create(key=dealer_product, dealer_id=dealer,
+                                 product_id=product)
+            MatchingPredictions.objects.create(
+                dealer_product_id=dealer_product, prosept_product_id=product)
+            AnalysisRun.objects.create(user=self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'limit': 100})
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_constant_queries(self):
+        """Test list endpoints do not issue a query per row."""
+        self.create_rows(2)
+        expected = {url: self.count_queries(url) for url in LIST_URLS}
+        self.create_rows(6, offset=2)
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), expected[url])
+                self.assertLessEqual(expected[url], 2)
+
+    def test_representation(self):
+        """Test related fields are still serialized from joined rows."""
+        self.create_rows(1)
+        match = self.client.get('/api/match/').data['results'][0]
+        self.assertEqual((match['dealer_name'], match['prosept_name']),
+                         ('dealer-0', '0'))
+        prediction = self.client.get('/api/predictions/').data['results'][0]
+        self.assertEqual((prediction['dealer_name'],
+                          prediction['product_name']), ('dealer-0', 'name-0'))
+
+
+class StatisticTestCase(APITestCase):
+    URL = '/api/statistic/'
+
+    def setUp(self):
+        """Create dealer products over two dealers and two days."""
+        user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password')
+        self.client.force_authenticate(user)
+        dealers = [Dealer.objects.create(name=f'dealer-{number}')
+                   for number in range(2)]
+        flags = [{'is_matched': True}, {'is_postponed': True},
+                 {'has_no_matches': True}, {}]
+        for number, dealer_flags in enumerate(flags):
+            DealerParsing.objects.create(
+                product_key=f'key-{number}', price='100',
+                product_url='http://a.ru', product_name=f'name-{number}',
+                date=datetime.date(2023, 7, 1 + number % 2),
+                dealer_id=dealers[number // 3], **dealer_flags)
+        self.dealers = dealers
+
+    def statistic_rows(self):
+        return sorted(DealerStatistic.objects.filter(total__gt=0).values_list(
+            'date', 'dealer_id', 'total', 'matched', 'postponed',
+            'no_matches'))
+
+    def test_single_query(self):
+        """Test all counters are summed from the statistic table."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([query for query in queries
+                              if 'products_dealerstatistic' in query['sql']]),
+                         1)
+        self.assertEqual(response.data, {'is_matching': 1, 'postponed': 1,
+                                         'has_no_matches': 1, 'total': 4})
+
+    def test_date_filter(self):
+        """Test counters respect the date filter."""
+        response = self.client.get(self.URL, {'min_date': '2023-07-02'})
+        self.assertEqual(response.data, {'is_matching': 0, 'postponed': 1,
+                                         'has_no_matches': 0, 'total': 2})
+
+    def test_group_by_dealer(self):
+        """Test counters grouped by dealer."""
+        response = self.client.get(self.URL, {'group_by': 'dealer'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['dealer_id'], row['dealer_name'], row['total'],
+              row['is_matching']) for row in response.data],
+            [(self.dealers[0].pk, 'dealer-0', 3, 1),
+             (self.dealers[1].pk, 'dealer-1', 1, 0)])
+
+    def test_group_by_day(self):
+        """Test counters grouped by day."""
+        response = self.client.get(self.URL, {'group_by': 'day'})
+        self.assertEqual(
+            [(row['date'], row['total'], row['postponed'])
+             for row in response.data],
+            [(datetime.date(2023, 7, 1), 2, 0),
+             (datetime.date(2023, 7, 2), 2, 1)])
+
+    def test_invalid_group_by(self):
+        """Test an unknown grouping is rejected."""
+        response = self.client.get(self.URL, {'group_by': 'month'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_flag_changes_update_statistic(self):
+        """Test toggling flags through the API moves the counters."""
+        dealer_product = DealerParsing.objects.get(has_no_matches=True)
+        response = self.client.patch(
+            f'/api/postpone/{dealer_product.pk}/', {'is_postponed': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.URL).data,
+                         {'is_matching': 1, 'postponed': 2,
+                          'has_no_matches': 0, 'total': 4})
+
+    def test_matches_rebuild(self):
+        """Test incremental counters agree with a full rebuild."""
+        moved = DealerParsing.objects.get(is_matched=True)
+        moved.date = datetime.date(2023, 7, 5)
+        moved.dealer_id = self.dealers[1]
+        moved.save()
+        DealerParsing.objects.filter(is_postponed=True).delete()
+        incremental = self.statistic_rows()
+        call_command('rebuild_statistics', stdout=open('/dev/null', 'w'))
+        self.assertEqual(self.statistic_rows(), incremental)
+        self.assertEqual(self.client.get(self.URL).data['total'], 3)
+
+    def test_rows_are_not_exposed(self):
+        """Test single counter rows have no retrieve endpoint."""
+        statistic = DealerStatistic.objects.first()
+        response = self.client.get(f'{self.URL}{statistic.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class CursorPaginationTestCase(APITestCase):
+    URL = '/api/dealer-products/'
+
+    def setUp(self):
+        """Create dealer products sharing dates so ties need the id."""
+        user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password')
+        self.client.force_authenticate(user)
+        dealer = Dealer.objects.create(name='dealer')
+        for number in range(7):
+            DealerParsing.objects.create(
+                product_key=f'key-{number}', price='100',
+                product_url='http://a.ru', product_name=f'name-{number}',
+                date=datetime.date(2023, 7, 1 + number % 3),
+                dealer_id=dealer)
+        self.expected = list(DealerParsing.objects.order_by(
+            '-date', '-id').values_list('id', flat=True))
+
+    def walk(self, url, params=None):
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            if response.data['next'] is None:
+                return pages
+            response = self.client.get(response.data['next'])
+
+    def test_pages_follow_ordering(self):
+        """Test cursor pages cover every row once in (-date, -id) order."""
+        pages = self.walk(self.URL, {'pagination': 'cursor', 'limit': 3})
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 1])
+        self.assertEqual([row['id'] for page in pages
+                          for row in page['results']], self.expected)
+
+    def test_previous_link(self):
+        """Test the previous link returns the preceding page."""
+        pages = self.walk(self.URL, {'pagination': 'cursor', 'limit': 3})
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']],
+                         self.expected[3:6])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_page_number_by_default(self):
+        """Test page number pagination stays the default."""
+        response = self.client.get(self.URL, {'limit': 3})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected."""
+        response = self.client.get(self.URL, {'pagination': 'cursor',
+                                              'cursor': 'broken'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_predictions(self):
+        """Test predictions are paged by id."""
+        product = Product.objects.create(id_product='1', article='1',
+                                         name='1', name_1c='1')
+        for dealer_product in DealerParsing.objects.all():
+            MatchingPredictions.objects.create(
+                dealer_product_id=dealer_product, prosept_product_id=product)
+        pages = self.walk('/api/predictions/',
+                          {'pagination': 'cursor', 'limit': 4})
+        ids = [row['id'] for page in pages for row in page['results']]
+        self.assertEqual(ids, sorted(MatchingPredictions.objects.values_list(
+            'id', flat=True)))
+
+
+class EstimatedCountTestCase(APITestCase):
+    URL = '/api/dealer-products/'
+
+    def setUp(self):
+        """Create a few dealer products."""
+        user = get_user_model().objects.create_user(
+            email='user@prosept.ru', password='password')
+        self.client.force_authenticate(user)
+        dealer = Dealer.objects.create(name='dealer')
+        for number in range(3):
+            DealerParsing.objects.create(
+                product_key=f'key-{number}', price='100',
+                product_url='http://a.ru', product_name=f'name-{number}',
+                date=datetime.date(2023, 7, 1), dealer_id=dealer)
+
+    def get_count(self, planner_rows, vendor='postgresql'):
+        with mock.patch.object(connection, 'vendor', vendor), \
+                mock.patch('core.pagination.planner_rows',
+                           return_value=planner_rows) as planner:
+            response = self.client.get(self.URL, {'count': 'estimate'})
+        self.assertEqual(response.status_code, 200)
+        return (response.data['count'],
+                response.data['count_is_approximate'], planner.called)
+
+    def test_exact_by_default(self):
+        """Test the count is exact unless an estimate is requested."""
+        response = self.client.get(self.URL)
+        self.assertEqual((response.data['count'],
+                          response.data['count_is_approximate']), (3, False))
+
+    def test_large_result_is_estimated(self):
+        """Test a large planner estimate is returned as approximate."""
+        self.assertEqual(self.get_count(50000), (50000, True, True))
+
+    def test_small_result_is_counted(self):
+        """Test a small planner estimate falls back to an exact count."""
+        self.assertEqual(self.get_count(2), (3, False, True))
+
+    def test_sqlite_is_counted(self):
+        """Test non-PostgreSQL databases always count exactly."""
+        self.assertEqual(self.get_count(50000, vendor='sqlite'),
+                         (3, False, False))